@@ -0,0 +1,322 @@
+"""
+A placement-search Columns player.
+
+For each new faller, ColumnsBot enumerates every (column, rotation) the
+faller can reach with shift_faller_sideways and rotate_faller, drops it,
+plays the landing and the whole cascade through tick(), and scores the
+result with a pluggable heuristic.  With depth > 1 it also looks ahead
+over a fixed sample of possible next fallers.  Positions already scored
+are memoized by ColumnsSnapshot, and root placements can be spread over
+a process pool.  Searches stop at a per-move time budget and return the
+best placement found so far.
+"""
+import os
+import random
+import time
+
+import columnlogic
+import column_sim
+
+Loss_Score = float('-inf')
+# First guess at what a pool task costs beyond its search (sending it,
+# starting it and getting the result back); refined as tasks finish
+Pool_Task_Overhead = 0.001
+
+
+def default_heuristic(state: columnlogic.ColumnsState, cleared: int, chain: int) -> float:
+    """
+    Score a settled board reached after clearing `cleared` jewels with a
+    longest chain of `chain` links: reward clearing, punish tall and
+    uneven stacks.
+    """
+    heights = [state.get_column_height(col) for col in range(state.get_columns())]
+    bumpiness = sum(abs(heights[col] - heights[col + 1]) for col in range(len(heights) - 1))
+    return 10.0 * cleared + 5.0 * chain - 0.5 * sum(heights) - 2.0 * max(heights) - 0.5 * bumpiness
+
+
+def reachable_placements(state: columnlogic.ColumnsState) -> list:
+    """
+    The column_sim action lists that take the active faller to each distinct
+    (column, rotation) it can reach from where it is.  The state is left as
+    it was.
+    """
+    root = state.snapshot()
+    placements = []
+    seen = set()
+    for rotations in range(3):
+        for action in (None, column_sim.LEFT, column_sim.RIGHT):
+            state.restore(root)
+            actions = [column_sim.ROTATE] * rotations
+            for rotate in actions:
+                column_sim.apply_action(state, rotate)
+            while True:
+                position = state.zobrist_hash()
+                if position not in seen:
+                    seen.add(position)
+                    placements.append(list(actions))
+                if action is None:
+                    break
+                # A blocked shift leaves the faller, and so the hash, unchanged
+                column_sim.apply_action(state, action)
+                if state.zobrist_hash() == position:
+                    break
+                actions.append(action)
+    state.restore(root)
+    return placements
+
+
+def spawn_sample(state: columnlogic.ColumnsState, faller: list) -> bool:
+    """
+    Spawn a lookahead faller in the open column nearest the middle.
+    Returns True if no column can take it, like FallerGenerator.spawn.
+    """
+    cols = state.get_columns()
+    for col in sorted(range(cols), key=lambda col: abs(2 * col - (cols - 1))):
+        if state.get_cell_state(0, col) != columnlogic.OCCUPIED_JEWEL:
+            return state.spawn_faller(col + 1, list(faller))
+    return True
+
+
+def play_placement(state: columnlogic.ColumnsState, actions: list) -> tuple:
+    """
+    Apply `actions`, drop the faller, tick until it has landed and resolve
+    the cascade.  Returns (alive, jewels cleared, chain length).
+    """
+    for action in actions:
+        column_sim.apply_action(state, action)
+    state.hard_drop()
+    game_over = state.tick()
+    if game_over:
+        return False, 0, 0
+    links = state.resolve_all()
+    return True, sum(map(len, links)), len(links)
+
+
+class ColumnsBot:
+    """
+    Search-based player.  Use plan(state) to get the actions for the
+    current faller, or pass the bot as a column_sim policy.
+    """
+    def __init__(self, heuristic=default_heuristic, depth: int = 2, time_budget: float = 0.005,
+                 samples: int = 2, workers: int = 1, seed: int = 0,
+                 jewel_types: list = column_sim.Jewel_Types, cache_size: int = 200000,
+                 cascade_cache_size: int = 0):
+        self._heuristic = heuristic
+        self._depth = depth
+        # None searches to full depth regardless of time
+        self._timeBudget = time_budget
+        self._workers = workers
+        self._cacheSize = cache_size
+        self._cache = {}
+        self._executor = None
+        # Pool tasks from earlier moves that were still running at their deadline
+        self._running = []
+        # Running average of the pool task overhead, kept off the time budget
+        self._taskOverhead = Pool_Task_Overhead
+        # Cascade steps memoized by board during the search, if enabled
+        self._cascadeCache = columnlogic.CascadeCache(cascade_cache_size) if cascade_cache_size else None
+        # Tells worker processes which bot a task came from, so each worker
+        # keeps one memo per bot across moves
+        self._key = (os.getpid(), id(self))
+        # Lookahead uses the same few possible next fallers at every level,
+        # so equal positions share memoized scores
+        rng = random.Random(seed)
+        self._samples = [[rng.choice(jewel_types) for _ in range(3)] for _ in range(samples)]
+        # Worker processes start with the bot rather than in its first move
+        if workers > 1:
+            self._start_pool()
+
+    def __getstate__(self) -> dict:
+        # The process pool stays behind when the bot is sent to a worker
+        state = dict(self.__dict__)
+        state['_executor'] = None
+        state['_running'] = []
+        state['_cache'] = {}
+        if self._cascadeCache is not None:
+            state['_cascadeCache'] = columnlogic.CascadeCache(self._cascadeCache.max_entries)
+        return state
+
+    def __call__(self, state: columnlogic.ColumnsState, rng: random.Random) -> list:
+        return self.plan(state) + [column_sim.DROP]
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def plan(self, state: columnlogic.ColumnsState) -> list:
+        """The actions that move the current faller to the best placement found."""
+        if not state.has_faller():
+            return []
+        previous_cache = state.get_cascade_cache()
+        if self._cascadeCache is not None:
+            state.set_cascade_cache(self._cascadeCache)
+        try:
+            return self._plan(state)
+        finally:
+            state.set_cascade_cache(previous_cache)
+
+    def _plan(self, state: columnlogic.ColumnsState) -> list:
+        deadline = None if self._timeBudget is None else time.perf_counter() + self._timeBudget
+        rows, cols = state.get_rows(), state.get_columns()
+        placements = reachable_placements(state)
+        root = state.snapshot()
+
+        # Depth one for the placements first, so there is always an answer;
+        # past the deadline the ones scored so far have to do
+        scored = []
+        for actions in placements:
+            if scored and deadline is not None and time.perf_counter() >= deadline:
+                break
+            scored.append((self._score_placement(state, root, actions, 1, None), actions))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        best_score, best_actions = scored[0]
+        if self._depth <= 1:
+            state.restore(root)
+            return best_actions
+
+        # Deepen the most promising placements first until time runs out.
+        # Tasks still running from an earlier move would delay this one's,
+        # so the pool is skipped until they finish
+        candidates = [actions for _, actions in scored]
+        if self._workers > 1 and not self._pool_busy():
+            deep = self._score_in_pool(root, rows, cols, candidates, deadline)
+        else:
+            deep = self._deepen(state, root, candidates, deadline)
+        state.restore(root)
+        # Deeper scores only count if the depth-one best was among them
+        if any(actions == best_actions for _, actions in deep):
+            return max(deep, key=lambda item: item[0])[1]
+        return best_actions
+
+    def _deepen(self, state: columnlogic.ColumnsState, root: columnlogic.ColumnsSnapshot, candidates: list,
+                deadline: float) -> list:
+        deep = []
+        for actions in candidates:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            score = self._score_placement(state, root, actions, self._depth, deadline)
+            if score is not None:
+                deep.append((score, actions))
+        return deep
+
+    def _start_pool(self) -> None:
+        # Imported on first use, so workers and single-process bots skip it
+        from concurrent.futures import ProcessPoolExecutor, wait
+        self._executor = ProcessPoolExecutor(max_workers=self._workers)
+        # The processes start with the first tasks
+        wait([self._executor.submit(int) for _ in range(self._workers)])
+
+    def _pool_busy(self) -> bool:
+        self._running = [future for future in self._running if not future.done()]
+        return bool(self._running)
+
+    def _score_in_pool(self, root: columnlogic.ColumnsSnapshot, rows: int, cols: int, candidates: list,
+                       deadline: float) -> list:
+        from concurrent.futures import wait, FIRST_COMPLETED
+        if self._executor is None:
+            self._start_pool()
+        # Tasks stop searching one task overhead before the deadline, so
+        # their results are back by it
+        cutoff = None if deadline is None else deadline - self._taskOverhead
+        # Workers cannot share perf_counter, so they get a wall-clock deadline
+        wall_deadline = None if cutoff is None else time.time() + (cutoff - time.perf_counter())
+        # One task per worker at a time, the best candidates first, so at the
+        # deadline nothing is left queued and at most one task per worker runs on
+        candidates = iter(candidates)
+        futures = {}
+        deep = []
+        while True:
+            while len(futures) < self._workers and (cutoff is None or time.perf_counter() < cutoff):
+                actions = next(candidates, None)
+                if actions is None:
+                    break
+                submitted = time.perf_counter()
+                future = self._executor.submit(_score_candidate, self, root, rows, cols, actions, wall_deadline)
+                futures[future] = (actions, submitted)
+            if not futures:
+                break
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            done, pending = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            now = time.perf_counter()
+            for future in done:
+                actions, submitted = futures.pop(future)
+                score, searched = future.result()
+                self._taskOverhead += (now - submitted - searched - self._taskOverhead) / 8
+                if score is not None:
+                    deep.append((score, actions))
+        # Tasks still running stop at their own deadline check
+        self._running = [future for future in futures if not future.cancel()]
+        return deep
+
+    def _score_placement(self, state: columnlogic.ColumnsState, root: columnlogic.ColumnsSnapshot,
+                         actions: list, depth: int, deadline: float):
+        state.restore(root)
+        alive, cleared, chain = play_placement(state, actions)
+        if not alive:
+            return Loss_Score
+        return self._search(state, depth - 1, cleared, chain, deadline)
+
+    def _search(self, state: columnlogic.ColumnsState, depth: int, cleared: int, chain: int, deadline: float):
+        """
+        Score a settled board with `depth` more fallers to place, or None if
+        the deadline passed first.
+        """
+        if depth <= 0:
+            return self._heuristic(state, cleared, chain)
+
+        position = state.snapshot()
+        key = (position, depth, cleared, chain)
+        if key in self._cache:
+            return self._cache[key]
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+
+        total = 0.0
+        for faller in self._samples:
+            state.restore(position)
+            game_over = spawn_sample(state, faller)
+            if game_over:
+                total += Loss_Score
+                continue
+            best = Loss_Score
+            spawned = state.snapshot()
+            for actions in reachable_placements(state):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return None
+                state.restore(spawned)
+                alive, more_cleared, more_chain = play_placement(state, actions)
+                if not alive:
+                    continue
+                score = self._search(state, depth - 1, cleared + more_cleared, max(chain, more_chain), deadline)
+                if score is None:
+                    return None
+                best = max(best, score)
+            total += best
+        state.restore(position)
+
+        value = total / len(self._samples)
+        if len(self._cache) >= self._cacheSize:
+            self._cache.clear()
+        self._cache[key] = value
+        return value
+
+
+def _score_candidate(bot: ColumnsBot, root: columnlogic.ColumnsSnapshot, rows: int, cols: int,
+                     actions: list, wall_deadline: float):
+    # Runs in a worker process.  Every task carries a fresh copy of the bot
+    # with an empty memo, so the first copy is kept and reused
+    global _worker_bot
+    if _worker_bot is None or _worker_bot._key != bot._key:
+        _worker_bot = bot
+    start = time.perf_counter()
+    deadline = None if wall_deadline is None else start + (wall_deadline - time.time())
+    state = columnlogic.ColumnsState(rows, cols, cascade_cache=_worker_bot._cascadeCache)
+    score = _worker_bot._score_placement(state, root, actions, _worker_bot._depth, deadline)
+    # The search time lets the bot tell its own overhead from the search
+    return score, time.perf_counter() - start
+
+
+_worker_bot = None
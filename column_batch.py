@@ -0,0 +1,298 @@
+"""
+Many independent Columns boards stepped together with NumPy.
+
+BatchColumnsState keeps B boards as (B, rows, cols) arrays of the same
+jewel and state codes ColumnsState uses, and applies every operation to
+all (or a masked subset of) the boards with a handful of array
+operations.  Each board behaves exactly like its own ColumnsState.
+"""
+from __future__ import annotations
+
+import columnlogic
+from columnlogic import _EMPTY_CODE, _FALLER_MOVING_CODE, _FALLER_STOPPED_CODE, _OCCUPIED_CODE, _MATCHED_CODE, _NO_JEWEL
+
+# numpy is imported by the first batch (see _load_numpy), so importing the
+# module stays cheap for processes that never step one
+np = None
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy as np
+    return np
+
+
+def _to_codes(values) -> np.ndarray:
+    """Convert jewel strings (or codes) to an array of jewel codes."""
+    array = np.asarray(values)
+    if array.dtype.kind in 'US':
+        return np.vectorize(columnlogic._jewel_code, otypes=[np.uint8])(array)
+    return array.astype(np.uint8)
+
+
+class BatchColumnsState:
+    def __init__(self, boards: int, rows: int, cols: int):
+        _load_numpy()
+        self._boards = boards
+        self._rows = rows
+        self._columns = cols
+        self._jewels = np.full((boards, rows, cols), _NO_JEWEL, dtype=np.uint8)
+        self._states = np.zeros((boards, rows, cols), dtype=np.uint8)
+        # One faller per board; row is the bottom jewel's row as in _Faller
+        self._fallerActive = np.zeros(boards, dtype=bool)
+        self._fallerStopped = np.zeros(boards, dtype=bool)
+        self._fallerRow = np.zeros(boards, dtype=np.int64)
+        self._fallerCol = np.zeros(boards, dtype=np.int64)
+        self._fallerContents = np.full((boards, 3), _NO_JEWEL, dtype=np.uint8)
+
+    def get_boards(self) -> int:
+        return self._boards
+
+    def get_rows(self) -> int:
+        return self._rows
+
+    def get_columns(self) -> int:
+        return self._columns
+
+    def get_jewels(self) -> np.ndarray:
+        """The (boards, rows, cols) array of jewel codes; do not modify."""
+        return self._jewels
+
+    def get_states(self) -> np.ndarray:
+        """The (boards, rows, cols) array of state codes; do not modify."""
+        return self._states
+
+    def get_cell_state(self, board: int, row: int, col: int) -> str:
+        if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
+            return columnlogic.EMPTY_JEWEL
+        return columnlogic._STATE_NAMES[self._states[board, row, col]]
+
+    def get_cell_contents(self, board: int, row: int, col: int) -> str:
+        if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
+            return columnlogic.EMPTY
+        return columnlogic._JEWEL_NAMES[self._jewels[board, row, col]]
+
+    def has_faller(self) -> np.ndarray:
+        return self._fallerActive.copy()
+
+    def _select(self, mask) -> np.ndarray:
+        """Indices of the boards selected by a boolean mask (all if None)."""
+        if mask is None:
+            return np.arange(self._boards)
+        return np.flatnonzero(mask)
+
+    def initialize_board_contents(self, contents) -> None:
+        """
+        Fill every board from a (boards, rows, cols) or (rows, cols) grid of
+        jewels, then settle it and mark matches like ColumnsState does.
+        """
+        codes = np.broadcast_to(_to_codes(contents), self._jewels.shape)
+        occupied = codes != _NO_JEWEL
+        self._jewels[...] = np.where(occupied, codes, _NO_JEWEL)
+        self._states[...] = np.where(occupied, _OCCUPIED_CODE, _EMPTY_CODE)
+        boards = np.arange(self._boards)
+        self._gem_gravity(boards)
+        self._find_and_mark_matches(boards)
+
+    def spawn_faller(self, columns, fallers, mask=None) -> np.ndarray:
+        """
+        Spawn a faller on every selected board that has none.  `columns`
+        holds 1-based columns and `fallers` the (top, middle, bottom)
+        jewels, one entry per board.  Returns a per-board array that is
+        True where the game should end (column is full).
+        """
+        columns = np.broadcast_to(np.asarray(columns, dtype=np.int64), (self._boards,))
+        fallers = np.broadcast_to(_to_codes(fallers), (self._boards, 3))
+        game_over = np.zeros(self._boards, dtype=bool)
+
+        boards = self._select(mask)
+        boards = boards[~self._fallerActive[boards]]
+        cols = columns[boards] - 1
+        full = self._states[boards, 0, cols] == _OCCUPIED_CODE
+        game_over[boards[full]] = True
+
+        boards = boards[~full]
+        self._fallerActive[boards] = True
+        self._fallerContents[boards] = fallers[boards]
+        self._fallerRow[boards] = -1
+        self._fallerCol[boards] = columns[boards] - 1
+        self._fallerStopped[boards] = False
+        self._update_faller_state(boards)
+        return game_over
+
+    def rotate_faller(self, mask=None) -> None:
+        boards = self._select(mask)
+        boards = boards[self._fallerActive[boards]]
+        # Rotate: bottom becomes top, others shift down
+        self._fallerContents[boards] = self._fallerContents[boards][:, [2, 0, 1]]
+        self._update_faller_state(boards)
+
+    def shift_faller_sideways(self, directions) -> None:
+        """Shift each board's faller by its entry in `directions` (LEFT, RIGHT or 0)."""
+        directions = np.broadcast_to(np.asarray(directions, dtype=np.int64), (self._boards,))
+        boards = np.flatnonzero(self._fallerActive & ((directions == columnlogic.LEFT) | (directions == columnlogic.RIGHT)))
+        targets = self._fallerCol[boards] + directions[boards]
+        inside = (targets >= 0) & (targets < self._columns)
+        boards = boards[inside]
+        targets = targets[inside]
+
+        # Movement is blocked by an occupied cell beside any visible faller jewel
+        blocked = np.zeros(len(boards), dtype=bool)
+        for i in range(3):
+            rows = self._fallerRow[boards] - i
+            visible = rows >= 0
+            blocked[visible] |= self._states[boards[visible], rows[visible], targets[visible]] == _OCCUPIED_CODE
+        boards = boards[~blocked]
+        targets = targets[~blocked]
+
+        self._erase_faller(boards)
+        self._fallerCol[boards] = targets
+        self._update_faller_state(boards)
+
+    def _is_solid(self, boards: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        below = rows >= self._rows
+        inside = ~below
+        solid = below.copy()
+        solid[inside] = self._states[boards[inside], rows[inside], cols[inside]] == _OCCUPIED_CODE
+        return solid
+
+    def _landing_check_rows(self, boards: np.ndarray) -> np.ndarray:
+        # When the faller is at row -1 its bottom jewel is displayed at row 0
+        rows = self._fallerRow[boards]
+        return np.where(rows == -1, 1, rows + 1)
+
+    def _erase_faller(self, boards: np.ndarray) -> None:
+        cols = self._fallerCol[boards]
+        states = self._states[boards, :, cols]
+        jewels = self._jewels[boards, :, cols]
+        faller = (states == _FALLER_MOVING_CODE) | (states == _FALLER_STOPPED_CODE)
+        states[faller] = _EMPTY_CODE
+        jewels[faller] = _NO_JEWEL
+        self._states[boards, :, cols] = states
+        self._jewels[boards, :, cols] = jewels
+
+    def _update_faller_state(self, boards: np.ndarray) -> None:
+        self._erase_faller(boards)
+        cols = self._fallerCol[boards]
+        stopped = self._is_solid(boards, self._landing_check_rows(boards), cols)
+        self._fallerStopped[boards] = stopped
+        cell_states = np.where(stopped, _FALLER_STOPPED_CODE, _FALLER_MOVING_CODE).astype(np.uint8)
+
+        bottom = self._fallerRow[boards]
+        for i in range(3):
+            rows = bottom - i
+            if i == 0:
+                rows = np.where(rows == -1, 0, rows)
+            visible = (rows >= 0) & (rows < self._rows)
+            self._states[boards[visible], rows[visible], cols[visible]] = cell_states[visible]
+            self._jewels[boards[visible], rows[visible], cols[visible]] = self._fallerContents[boards[visible], 2 - i]
+
+    def _gem_gravity(self, boards: np.ndarray) -> None:
+        """
+        Settle the given boards: in every column, jewels keep their order
+        and drop onto the next jewel, faller cell or the floor, while faller
+        cells stay put, as in ColumnsState._gem_gravity.
+        """
+        if len(boards) == 0:
+            return
+        # Work bottom-up: position 0 is the bottom row
+        states = self._states[boards, ::-1, :]
+        jewels = self._jewels[boards, ::-1, :]
+        rows = self._rows
+        positions = np.arange(rows).reshape(1, rows, 1)
+
+        is_jewel = states >= _OCCUPIED_CODE
+        is_faller = (states == _FALLER_MOVING_CODE) | (states == _FALLER_STOPPED_CODE)
+        # Each stretch of cells between faller cells compacts on its own
+        segment_start = np.maximum.accumulate(np.where(is_faller, positions + 1, 0), axis=1)
+        below = np.cumsum(is_jewel, axis=1) - is_jewel
+        below_segment = np.take_along_axis(np.concatenate([below, below[:, -1:] + is_jewel[:, -1:]], axis=1),
+                                           np.minimum(segment_start, rows), axis=1)
+        targets = segment_start + below - below_segment
+
+        new_states = np.where(is_faller, states, _EMPTY_CODE).astype(np.uint8)
+        new_jewels = np.where(is_faller, jewels, _NO_JEWEL).astype(np.uint8)
+        board_index, _, col_index = np.nonzero(is_jewel)
+        target_rows = targets[is_jewel]
+        new_states[board_index, target_rows, col_index] = states[is_jewel]
+        new_jewels[board_index, target_rows, col_index] = jewels[is_jewel]
+
+        self._states[boards] = new_states[:, ::-1, :]
+        self._jewels[boards] = new_jewels[:, ::-1, :]
+
+    def _find_and_mark_matches(self, boards: np.ndarray) -> None:
+        """Mark every run of three equal matchable jewels in all four directions."""
+        if len(boards) == 0:
+            return
+        states = self._states[boards]
+        jewels = self._jewels[boards]
+        matchable = states >= _OCCUPIED_CODE
+        marked = np.zeros(states.shape, dtype=bool)
+        rows = self._rows
+        cols = self._columns
+
+        # (row step, column step) of the horizontal, vertical and diagonal lines
+        for row_step, col_step in columnlogic._LINE_STEPS:
+            row_span = rows - 2 * row_step
+            col_span = cols - 2 * abs(col_step)
+            if row_span <= 0 or col_span <= 0:
+                continue
+            col_first = 2 if col_step < 0 else 0
+            windows = []
+            for k in range(3):
+                row = k * row_step
+                col = col_first + k * col_step
+                windows.append((slice(row, row + row_span), slice(col, col + col_span)))
+
+            (r0, c0), (r1, c1), (r2, c2) = windows
+            runs = (matchable[:, r0, c0] & matchable[:, r1, c1] & matchable[:, r2, c2]
+                    & (jewels[:, r0, c0] == jewels[:, r1, c1]) & (jewels[:, r1, c1] == jewels[:, r2, c2]))
+            for rows_slice, cols_slice in windows:
+                marked[:, rows_slice, cols_slice] |= runs
+
+        states[marked] = _MATCHED_CODE
+        self._states[boards] = states
+
+    def tick(self) -> np.ndarray:
+        """
+        Handle one tick of game time on every board.
+        Returns a per-board array that is True where the game should end.
+        """
+        game_over = np.zeros(self._boards, dtype=bool)
+
+        # Clear existing matches, apply gravity, then mark new matches
+        matched = np.flatnonzero((self._states == _MATCHED_CODE).any(axis=(1, 2)))
+        if len(matched):
+            states = self._states[matched]
+            jewels = self._jewels[matched]
+            cleared = states == _MATCHED_CODE
+            states[cleared] = _EMPTY_CODE
+            jewels[cleared] = _NO_JEWEL
+            self._states[matched] = states
+            self._jewels[matched] = jewels
+            self._gem_gravity(matched)
+            self._find_and_mark_matches(matched)
+
+        # Freeze fallers that had already landed
+        landed = np.flatnonzero(self._fallerActive & self._fallerStopped)
+        cols = self._fallerCol[landed]
+        for i in range(3):
+            rows = self._fallerRow[landed] - i
+            visible = rows >= 0
+            self._states[landed[visible], rows[visible], cols[visible]] = _OCCUPIED_CODE
+        # Not all three jewels are visible - game over, the faller stays
+        overflow = self._fallerRow[landed] - 2 < 0
+        game_over[landed[overflow]] = True
+        frozen = landed[~overflow]
+        self._fallerActive[frozen] = False
+        self._find_and_mark_matches(frozen)
+
+        # Move the other fallers down, or land them
+        moving = np.flatnonzero(self._fallerActive & ~self._fallerStopped)
+        blocked = self._is_solid(moving, self._landing_check_rows(moving), self._fallerCol[moving])
+        falling = moving[~blocked]
+        # When faller is at row -1, moving down takes it to row 1
+        self._fallerRow[falling] = np.where(self._fallerRow[falling] == -1, 1, self._fallerRow[falling] + 1)
+        self._update_faller_state(moving)
+        return game_over
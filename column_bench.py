@@ -0,0 +1,351 @@
+"""
+Benchmarks for the columnlogic hot paths.
+
+Every path is timed on generated boards over a grid of sizes, fill
+densities and cascade depths.  Results are written as JSON and can be
+compared against a stored baseline, failing (exit status 1) when any
+path got slower than the baseline by more than a given percentage.
+
+    python column_bench.py --output bench.json
+    python column_bench.py --baseline bench_baseline.json --save-baseline
+    python column_bench.py --baseline bench_baseline.json --threshold 15
+
+--startup instead checks the headless modules that worker processes
+import: each is imported in fresh interpreters, failing when an import
+takes longer than the budget or loads pygame.
+
+    python column_bench.py --startup --startup-budget 40
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import columnlogic
+
+Sizes = [(13, 6), (50, 50), (200, 200), (500, 500)]
+Densities = [0.3, 0.6, 0.9]
+Cascade_Depths = [0, 1, 3]
+
+# Filler jewels never match each other on a generated board; the two
+# chain jewels are only used for the planted cascades.
+Filler_Jewels = ['R', 'G', 'O', 'P', 'B']
+Chain_Jewels = ['Y', 'T']
+# Planted cascades go in every Chain_Spacing-th column
+Chain_Spacing = 3
+
+# Modules a headless worker process may import, and the time each import
+# may take in a fresh interpreter
+Startup_Modules = ['column_config', 'column_sim', 'column_replay', 'column_ai', 'column_dataset', 'column_render',
+                   'column_batch']
+Startup_Budget_Ms = 50.0
+Startup_Repeats = 5
+
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print((time.perf_counter() - start) * 1e3, 'pygame' in sys.modules)
+"""
+
+
+def generate_board(rows: int, cols: int, density: float, cascade_depth: int, seed: int = 0) -> list:
+    """
+    Generate a settled board (list of rows of jewel strings) whose columns
+    are filled to roughly `density` of the height.  Filler jewels form no
+    runs; when cascade_depth > 0 a column stack that clears in exactly
+    that many chain links is planted in every Chain_Spacing-th column.
+    """
+    rng = random.Random(seed)
+    board = [[columnlogic.EMPTY] * cols for _ in range(rows)]
+
+    # Bottom-up for depth 3: b b a a X X X a b, where clearing each run
+    # drops the pair above onto the pair below to form the next run
+    chain = []
+    if cascade_depth > 0 and 3 * cascade_depth <= rows:
+        links = [Chain_Jewels[link % 2] for link in range(cascade_depth)]
+        chain = [jewel for jewel in reversed(links[1:]) for _ in range(2)] + [links[0]] * 3 + links[1:]
+
+    heights = [min(rows, max(0, round(rows * density + rng.uniform(-1, 1)))) for _ in range(cols)]
+    for col in range(0, cols, Chain_Spacing):
+        for i, jewel in enumerate(chain):
+            board[rows - 1 - i][col] = jewel
+
+    # Fill bottom-up so every window of three is complete when its last
+    # cell is chosen, and pick a filler that completes none of them
+    for row in range(rows - 1, -1, -1):
+        for col in range(cols):
+            if (chain and col % Chain_Spacing == 0) or rows - row > heights[col]:
+                continue
+            choices = [jewel for jewel in Filler_Jewels if not _completes_run(board, row, col, jewel)]
+            board[row][col] = rng.choice(choices)
+    return board
+
+
+def _completes_run(board: list, row: int, col: int, jewel: str) -> bool:
+    rows = len(board)
+    cols = len(board[0])
+    # Left, below, below-left and below-right are already filled
+    for rowStep, colStep in ((0, -1), (1, 0), (1, -1), (1, 1)):
+        r1, c1 = row + rowStep, col + colStep
+        r2, c2 = row + 2 * rowStep, col + 2 * colStep
+        if r2 < rows and 0 <= c2 < cols and board[r1][c1] == jewel and board[r2][c2] == jewel:
+            return True
+    return False
+
+
+def _new_state(board: list) -> columnlogic.ColumnsState:
+    state = columnlogic.ColumnsState(len(board), len(board[0]))
+    state.initialize_board_contents(board)
+    return state
+
+
+def _spawn_column(state: columnlogic.ColumnsState) -> int:
+    """The 1-based column with the most free space, where a faller fits."""
+    best = 0
+    best_free = -1
+    for col in range(state.get_columns()):
+        free = 0
+        while free < state.get_rows() and state.get_cell_state(free, col) == columnlogic.EMPTY_JEWEL:
+            free += 1
+        if free > best_free:
+            best, best_free = col, free
+    return best + 1
+
+
+def _remove_faller(state: columnlogic.ColumnsState) -> None:
+    state._clear_faller_cells(state._faller.get_col())
+    state._faller.active = False
+
+
+# Each benchmark takes a generated board and returns a (setup, run) pair:
+# setup() prepares fresh input outside the timed region and returns the
+# argument for run(), the single timed call.
+
+def bench_initialize_board_contents(board: list):
+    def setup():
+        return columnlogic.ColumnsState(len(board), len(board[0]))
+    return setup, lambda state: state.initialize_board_contents(board)
+
+
+def _bench_match(name: str):
+    def bench(board: list):
+        state = _new_state(board)
+        return (lambda: state), lambda state: getattr(state, name)()
+    return bench
+
+
+def bench_gem_gravity(board: list):
+    # Scatter the jewels of each column over its full height so gravity
+    # has gaps to close in every column
+    rows = len(board)
+    rng = random.Random(rows)
+    scattered = [[columnlogic.EMPTY] * len(board[0]) for _ in range(rows)]
+    for col in range(len(board[0])):
+        jewels = [board[row][col] for row in range(rows) if board[row][col] != columnlogic.EMPTY]
+        for row, jewel in zip(sorted(rng.sample(range(rows), len(jewels))), jewels):
+            scattered[row][col] = jewel
+
+    def setup():
+        state = columnlogic.ColumnsState(rows, len(board[0]))
+        for row in range(rows):
+            for col in range(len(board[0])):
+                if scattered[row][col] != columnlogic.EMPTY:
+                    state.set_cell(row, col, scattered[row][col], columnlogic.OCCUPIED_JEWEL)
+        return state
+    return setup, lambda state: state._gem_gravity()
+
+
+def bench_tick(board: list):
+    # One tick with a falling faller; planted cascades clear on this tick
+    column = _spawn_column(_new_state(board))
+
+    def setup():
+        state = _new_state(board)
+        state.spawn_faller(column, ['R', 'G', 'B'])
+        return state
+    return setup, lambda state: state.tick()
+
+
+def bench_spawn_faller(board: list):
+    state = _new_state(board)
+    column = _spawn_column(state)
+
+    def setup():
+        if state.has_faller():
+            _remove_faller(state)
+        return state
+    return setup, lambda state: state.spawn_faller(column, ['R', 'G', 'B'])
+
+
+def bench_shift_faller_sideways(board: list):
+    state = _new_state(board)
+    state.spawn_faller(_spawn_column(state), ['R', 'G', 'B'])
+    directions = [columnlogic.LEFT, columnlogic.RIGHT]
+    calls = [0]
+
+    def setup():
+        calls[0] += 1
+        return directions[calls[0] % 2]
+    return setup, state.shift_faller_sideways
+
+
+BENCHMARKS = {
+    'tick': bench_tick,
+    'match_x_axis': _bench_match('match_x_axis'),
+    'match_y_axis': _bench_match('match_y_axis'),
+    'match_diagonal': _bench_match('match_diagonal'),
+    '_gem_gravity': bench_gem_gravity,
+    'spawn_faller': bench_spawn_faller,
+    'shift_faller_sideways': bench_shift_faller_sideways,
+    'initialize_board_contents': bench_initialize_board_contents,
+}
+
+
+def time_call(setup, run, min_time: float, min_repeats: int = 3, max_repeats: int = 1000) -> dict:
+    """Time run(setup()) until min_time of timed calls or max_repeats, in microseconds."""
+    samples = []
+    total = 0.0
+    while len(samples) < min_repeats or (total < min_time and len(samples) < max_repeats):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed * 1e6)
+        total += elapsed
+    return {
+        'median_us': statistics.median(samples),
+        'min_us': min(samples),
+        'repeats': len(samples),
+    }
+
+
+def run_benchmarks(paths: list, sizes: list, densities: list, depths: list, min_time: float, log=None) -> dict:
+    results = {}
+    for rows, cols in sizes:
+        for density in densities:
+            for depth in depths:
+                if 3 * depth > rows:
+                    continue
+                board = generate_board(rows, cols, density, depth)
+                for path in paths:
+                    key = '{}/{}x{}/density={}/cascade={}'.format(path, rows, cols, density, depth)
+                    setup, run = BENCHMARKS[path](board)
+                    results[key] = time_call(setup, run, min_time)
+                    if log:
+                        log('{:<70} {:>12.1f} us'.format(key, results[key]['median_us']))
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float, statistic: str = 'min_us') -> list:
+    """Return (key, baseline_us, current_us) for every path slower than baseline by more than threshold %."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key][statistic]
+        after = result[statistic]
+        if after > before * (1 + threshold / 100):
+            regressions.append((key, before, after))
+    return regressions
+
+
+def measure_startup(module: str, repeats: int = Startup_Repeats) -> dict:
+    """
+    Import `module` in `repeats` fresh interpreters and return its import
+    time in milliseconds and whether it loaded pygame.
+    """
+    samples = []
+    loads_pygame = False
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT.format(module=module)], check=True,
+                                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        elapsed, pygame_loaded = output.stdout.split()
+        samples.append(float(elapsed))
+        loads_pygame = loads_pygame or pygame_loaded == 'True'
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+        'loads_pygame': loads_pygame,
+    }
+
+
+def check_startup(modules: list, budget_ms: float, repeats: int = Startup_Repeats, log=None) -> bool:
+    """Return True if every module imports within budget_ms (best of repeats) without loading pygame."""
+    ok = True
+    for module in modules:
+        result = measure_startup(module, repeats)
+        over = result['min_ms'] > budget_ms or result['loads_pygame']
+        ok = ok and not over
+        if log:
+            log('{:<20} {:>8.1f} ms{}{}'.format(module, result['min_ms'],
+                                                '  loads pygame' if result['loads_pygame'] else '',
+                                                '  OVER BUDGET' if over else ''))
+    return ok
+
+
+def _parse_size(text: str) -> tuple:
+    rows, cols = text.lower().split('x')
+    return int(rows), int(cols)
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the columnlogic hot paths.')
+    parser.add_argument('--paths', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=_parse_size, default=Sizes, help='board sizes as ROWSxCOLS')
+    parser.add_argument('--densities', nargs='+', type=float, default=Densities)
+    parser.add_argument('--cascades', nargs='+', type=int, default=Cascade_Depths)
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds of timed calls per benchmark')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='compare against this JSON results file')
+    parser.add_argument('--threshold', type=float, default=20.0, help='allowed slowdown against the baseline, in percent')
+    parser.add_argument('--statistic', choices=['min_us', 'median_us'], default='min_us',
+                        help='timing compared against the baseline; the minimum is least affected by machine load')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline instead of comparing')
+    parser.add_argument('--startup', action='store_true', help='check headless import times instead of benchmarking')
+    parser.add_argument('--startup-modules', nargs='+', default=Startup_Modules)
+    parser.add_argument('--startup-budget', type=float, default=Startup_Budget_Ms, help='milliseconds allowed per import')
+    args = parser.parse_args(argv)
+    if args.save_baseline and not args.baseline:
+        parser.error('--save-baseline needs --baseline to name the file')
+
+    log = lambda line: print(line, file=sys.stderr)
+    if args.startup:
+        return 0 if check_startup(args.startup_modules, args.startup_budget, log=log) else 1
+
+    results = run_benchmarks(args.paths, args.sizes, args.densities, args.cascades, args.min_time, log)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    elif not args.save_baseline:
+        print(text)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as output:
+            output.write(text + '\n')
+    elif args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.threshold, args.statistic)
+        for key, before, after in regressions:
+            log('REGRESSION {}: {:.1f} us -> {:.1f} us ({:+.0f}%)'.format(key, before, after, (after / before - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+Game settings and faller generation, shared by the window and the
+headless tools.
+
+This module only uses the standard library, so simulations, replays and
+worker processes can set up games without importing pygame.
+"""
+import random
+
+import columnlogic
+
+Rows = 13
+Columns = 6
+Tick_Interval = 1.0
+
+Jewels_Colors = {
+    'R': (255, 0, 0),
+    'G': (0, 255, 0),
+    'O': (255, 128, 0),
+    'P': (102, 0, 204),
+    'B': (0, 0, 255),
+    'Y': (255, 255, 0),
+    'T': (51, 255, 255)
+}
+
+Jewel_Types = list(Jewels_Colors.keys())
+
+Config_Keys = ('rows', 'cols', 'jewels', 'tick_interval', 'seed')
+
+
+def load_config(path: str = None, **overrides) -> dict:
+    """
+    Game settings from an optional JSON file with any of Config_Keys,
+    with non-None overrides applied on top and defaults for the rest.
+    jewels is a list of jewel types (a string is split into letters);
+    seed is None unless given.
+    """
+    config = {}
+    if path:
+        import json
+        with open(path) as config_file:
+            config = json.load(config_file)
+    for key, value in overrides.items():
+        if key not in Config_Keys:
+            raise ValueError('unknown setting {!r}'.format(key))
+        if value is not None:
+            config[key] = value
+
+    return {
+        'rows': int(config.get('rows', Rows)),
+        'cols': int(config.get('cols', Columns)),
+        'jewels': list(config.get('jewels') or Jewel_Types),
+        'tick_interval': float(config.get('tick_interval', Tick_Interval)),
+        'seed': config.get('seed'),
+    }
+
+
+class FallerGenerator:
+    """
+    Seeded faller generation: a random open column, then three random
+    jewels, drawn in that order from one random.Random.
+    """
+    def __init__(self, seed=None, jewel_types: list = Jewel_Types):
+        self._random = random.Random(seed)
+        self._jewelTypes = list(jewel_types)
+
+    def spawn(self, state: columnlogic.ColumnsState) -> bool:
+        """
+        Spawn a random faller in a random open column.
+        Returns True if game should end (no column can take it), False otherwise.
+        """
+        if state.has_faller():
+            return False
+
+        available_cols = []
+        for col in range(1, state.get_columns() + 1):
+            if state.get_cell_state(0, col - 1) != columnlogic.OCCUPIED_JEWEL:
+                available_cols.append(col)
+
+        if not available_cols:
+            return True
+
+        col = self._random.choice(available_cols)
+        colors = [self._random.choice(self._jewelTypes) for _ in range(3)]
+        return state.spawn_faller(col, colors)
@@ -0,0 +1,318 @@
+"""
+Board positions exported as fixed-size records for training.
+
+Every record is one position as the player saw it before a tick: the
+board's jewel and state codes, the faller and the actions chosen before
+that tick.  Records are appended, through a buffer, to a file of a small
+header followed by packed records, so numpy.memmap can open any number of
+them without parsing:
+
+    positions = column_dataset.open_dataset('positions.cds')
+    positions['jewels'][1000:2000]    # (1000, rows, cols) uint8, no copy
+
+Positions come from replays, recorded here from headless games or loaded
+from column_replay files, and are streamed one game at a time.
+
+    python column_dataset.py positions.cds --games 1000 --policy bot
+    python column_dataset.py positions.cds --replays replays/*.clrp
+
+Replays recorded in the game window log every key press, so a tick can
+hold more actions than the bot ever makes; give such datasets more
+action slots (--action-slots).  A game that does not fit is refused
+before any of its positions are written.
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import os
+import struct
+import sys
+
+import columnlogic
+import column_replay
+import column_sim
+
+Magic = b'CLDS'
+Version = 1
+Header_Size = 64
+Buffer_Records = 4096
+
+# Action codes in the actions field; unused slots hold No_Action
+No_Action = 0
+Action_Codes = {
+    column_sim.LEFT: 1,
+    column_sim.RIGHT: 2,
+    column_sim.ROTATE: 3,
+    column_sim.DROP: 4,
+}
+
+# magic, version, rows, cols, action slots; zero-padded to Header_Size
+_HEADER = struct.Struct('<4sBxHHH')
+
+# numpy is imported with the first record layout (see _load_numpy), so pool
+# workers that only record games start without it
+np = None
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy as np
+    return np
+
+
+def record_dtype(rows: int, cols: int, action_slots: int) -> np.dtype:
+    """
+    The packed record layout.  faller_state is 0 with no faller, otherwise
+    the faller's cell state code (1 moving, 2 stopped); faller_row is the
+    bottom jewel's row as in ColumnsState.
+    """
+    _load_numpy()
+    return np.dtype([
+        ('game', '<i8'),
+        ('tick', '<u4'),
+        ('jewels', 'u1', (rows, cols)),
+        ('states', 'u1', (rows, cols)),
+        ('faller_state', 'u1'),
+        ('faller_row', '<i2'),
+        ('faller_col', '<u2'),
+        ('faller_contents', 'u1', (3,)),
+        ('action_count', 'u1'),
+        ('actions', 'u1', (action_slots,)),
+    ])
+
+
+def default_action_slots(cols: int) -> int:
+    # Enough for the search bot: two rotations, a shift across the board and a drop
+    return cols + 2
+
+
+def max_actions_per_tick(replay: column_replay.Replay) -> int:
+    """The most inputs the replay applies before any one tick."""
+    counts = collections.Counter(tick for tick, action in replay.inputs if tick < replay.ticks)
+    return max(counts.values(), default=0)
+
+
+def dataset_action_slots(path: str) -> int:
+    """The action slots of an existing dataset file, or None if there is none yet."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as dataset_file:
+        return _read_header(dataset_file)[2]
+
+
+def _read_header(dataset_file) -> tuple:
+    header = dataset_file.read(Header_Size)
+    if len(header) < Header_Size or header[:4] != Magic:
+        raise ValueError('not a Columns dataset')
+    magic, version, rows, cols, action_slots = _HEADER.unpack_from(header)
+    if version != Version:
+        raise ValueError('unsupported dataset version {}'.format(version))
+    return rows, cols, action_slots
+
+
+class DatasetWriter:
+    """
+    Appends position records to a dataset file, creating it if needed.
+    Records are collected in a buffer of buffer_records and written in bulk.
+    """
+    def __init__(self, path: str, rows: int, cols: int, action_slots: int = None,
+                 buffer_records: int = Buffer_Records):
+        if action_slots is None:
+            action_slots = default_action_slots(cols)
+        self._dtype = record_dtype(rows, cols, action_slots)
+        self.action_slots = action_slots
+        self.shape = (rows, cols)
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as existing:
+                if _read_header(existing) != (rows, cols, action_slots):
+                    raise ValueError('{} holds records of a different layout'.format(path))
+            # Drop a partly written last record so appends stay aligned
+            records = (os.path.getsize(path) - Header_Size) // self._dtype.itemsize
+            self._file = open(path, 'r+b')
+            self._file.truncate(Header_Size + records * self._dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(_HEADER.pack(Magic, Version, rows, cols, action_slots).ljust(Header_Size, b'\0'))
+
+        self._buffer = np.zeros(buffer_records, dtype=self._dtype)
+        # Per-field views of the buffer, so filling a record is a few array stores
+        self._fields = {name: self._buffer[name] for name in self._dtype.names}
+        self._count = 0
+        self.records_written = 0
+
+    def __enter__(self) -> 'DatasetWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, game: int, tick: int, state: columnlogic.ColumnsState, actions: list) -> None:
+        if len(actions) > self.action_slots:
+            raise ValueError('{} actions do not fit in {} action slots'.format(len(actions), self.action_slots))
+        fields = self._fields
+        n = self._count
+        jewels, states = state.get_board_codes()
+        fields['game'][n] = game
+        fields['tick'][n] = tick
+        fields['jewels'][n] = np.frombuffer(jewels, dtype=np.uint8).reshape(self.shape)
+        fields['states'][n] = np.frombuffer(states, dtype=np.uint8).reshape(self.shape)
+
+        faller = state.get_faller()
+        if faller is None:
+            fields['faller_state'][n] = 0
+            fields['faller_row'][n] = 0
+            fields['faller_col'][n] = 0
+            fields['faller_contents'][n] = columnlogic._NO_JEWEL
+        else:
+            row, col, contents, stopped = faller
+            fields['faller_state'][n] = columnlogic._FALLER_STOPPED_CODE if stopped else columnlogic._FALLER_MOVING_CODE
+            fields['faller_row'][n] = row
+            fields['faller_col'][n] = col
+            fields['faller_contents'][n] = [columnlogic._jewel_code(jewel) for jewel in contents]
+
+        fields['action_count'][n] = len(actions)
+        slots = fields['actions'][n]
+        slots[:] = No_Action
+        for slot, action in enumerate(actions):
+            slots[slot] = Action_Codes[action]
+
+        self._count += 1
+        if self._count == len(self._buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._count:
+            self._file.write(self._buffer[:self._count].data)
+            self.records_written += self._count
+            self._count = 0
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def open_dataset(path: str, mode: str = 'r') -> np.ndarray:
+    """Map a dataset file as a structured array of records, without reading it."""
+    with open(path, 'rb') as dataset_file:
+        rows, cols, action_slots = _read_header(dataset_file)
+    dtype = record_dtype(rows, cols, action_slots)
+    records = (os.path.getsize(path) - Header_Size) // dtype.itemsize
+    if records == 0:
+        # numpy cannot map an empty region
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=Header_Size, shape=(records,))
+
+
+def replay_positions(replay: column_replay.Replay):
+    """
+    Re-run a replay and yield (tick, state, actions) before every tick,
+    then once more for the final position with no actions.  The state is
+    the live game and changes after each step, so copy what you need.
+    """
+    state = columnlogic.ColumnsState(replay.rows, replay.cols)
+    generator = column_sim.FallerGenerator(replay.seed, replay.jewel_types)
+    inputs = replay.inputs
+    next_input = 0
+
+    game_over = generator.spawn(state)
+    for tick in range(replay.ticks):
+        actions = []
+        while next_input < len(inputs) and inputs[next_input][0] == tick:
+            actions.append(inputs[next_input][1])
+            next_input += 1
+        yield tick, state, actions
+
+        for action in actions:
+            column_sim.apply_action(state, action)
+        game_over = state.tick()
+        if not state.has_faller() and not game_over:
+            game_over = generator.spawn(state)
+    yield replay.ticks, state, []
+
+
+def headless_replays(games: int, seed: int = 0, policy=column_sim.random_policy, rows: int = column_sim.Rows,
+                     cols: int = column_sim.Columns, max_ticks: int = column_sim.Max_Ticks, workers: int = 1):
+    """
+    Record `games` headless games with seeds seed, seed + 1, ... and yield
+    their replays in seed order, playing them across a process pool when
+    workers > 1.  Only the small replays come back from the workers.
+    """
+    jobs = [(seed + game, policy, rows, cols, column_sim.Jewel_Types, max_ticks) for game in range(games)]
+    if workers == 1:
+        yield from map(_record_game_args, jobs)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_record_game_args, jobs, chunksize=max(1, games // (workers * 16)))
+
+
+def _record_game_args(args: tuple) -> column_replay.Replay:
+    return column_replay.record_game(*args)
+
+
+def export(replays, path: str, action_slots: int = None, buffer_records: int = Buffer_Records) -> int:
+    """
+    Append every position of every replay to the dataset at `path`, one
+    game at a time, and return the number of records written.  All the
+    replays must share one board size.
+
+    An existing dataset keeps its action slots; a new one gets
+    action_slots, or enough for the bot.  Each replay is checked as it
+    arrives, and one of another board size or with a tick of more actions
+    than there are slots raises ValueError before any of its positions
+    are written, leaving the games before it in the dataset.
+    """
+    writer = None
+    try:
+        for replay in replays:
+            if writer is None:
+                if action_slots is None:
+                    action_slots = dataset_action_slots(path) or default_action_slots(replay.cols)
+                writer = DatasetWriter(path, replay.rows, replay.cols, action_slots, buffer_records)
+            elif (replay.rows, replay.cols) != writer.shape:
+                raise ValueError('replay of game {} is {}x{}, the dataset is {}x{}'.format(
+                    replay.seed, replay.rows, replay.cols, *writer.shape))
+            actions = max_actions_per_tick(replay)
+            if actions > writer.action_slots:
+                raise ValueError('game {} has a tick of {} actions, more than the {} action slots of {}'.format(
+                    replay.seed, actions, writer.action_slots, path))
+            for tick, state, actions in replay_positions(replay):
+                writer.write(replay.seed, tick, state, actions)
+    finally:
+        if writer is not None:
+            writer.close()
+    return writer.records_written if writer else 0
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description='Export Columns positions as a memory-mappable dataset.')
+    parser.add_argument('output', help='dataset file; records are appended if it exists')
+    parser.add_argument('--replays', nargs='+', help='export these replay files instead of playing games')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', choices=sorted(column_sim.POLICIES), default='random')
+    parser.add_argument('--rows', type=int, default=column_sim.Rows)
+    parser.add_argument('--cols', type=int, default=column_sim.Columns)
+    parser.add_argument('--max-ticks', type=int, default=column_sim.Max_Ticks)
+    parser.add_argument('--workers', type=int, default=1, help='processes playing games')
+    parser.add_argument('--action-slots', type=int,
+                        help='actions stored per position of a new dataset (default: enough for the bot)')
+    args = parser.parse_args(argv)
+
+    if args.replays:
+        replays = (column_replay.Replay.load(path) for path in args.replays)
+    else:
+        replays = headless_replays(args.games, args.seed, column_sim.POLICIES[args.policy], args.rows, args.cols,
+                                   args.max_ticks, args.workers)
+    records = export(replays, args.output, args.action_slots)
+    print('{} positions written to {} ({} in total)'.format(records, args.output, len(open_dataset(args.output))))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
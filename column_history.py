@@ -0,0 +1,160 @@
+"""
+A ColumnsState that keeps every version of the game and can step back
+and forth between them.
+
+A version is the board as a tuple of rows, each one bytes object of the
+row's jewel codes followed by its state codes, plus the faller.  A new
+version copies only the rows the call changed and shares the rest with
+the version before it, so a 10,000-tick game keeps a few rows per tick
+rather than a whole board.  Stepping between versions writes back only
+the rows that differ between them.
+
+    state = column_history.RewindableColumnsState(13, 6)
+    ...
+    state.undo(10)      # ten calls back
+    state.redo()        # and one forward again
+
+Versions are recorded after every tick, input, spawn, board setup and
+restore(); cells changed by other calls (set_cell and friends) are not
+seen until a recorded call changes their rows.
+"""
+import functools
+import sys
+
+import columnlogic
+
+_NO_CELLS = frozenset()
+
+
+def _recorded(name: str):
+    method = getattr(columnlogic.ColumnsState, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._record({row for row, col in self.get_changes().cells_changed})
+        return result
+    return wrapper
+
+
+class RewindableColumnsState(columnlogic.ColumnsState):
+    def __init__(self, rows: int, cols: int, full_scan: bool = False, cascade_cache: columnlogic.CascadeCache = None):
+        super().__init__(rows, cols, full_scan, cascade_cache)
+        # Every row of the empty board is the same bytes object
+        # Versions are (rows, faller, dirty cells, unsettled columns)
+        self._versions = [((self._row_bytes(0),) * rows, self._faller_tuple(), _NO_CELLS, _NO_CELLS)]
+        self._version = 0
+
+    tick = _recorded('tick')
+    rotate_faller = _recorded('rotate_faller')
+    shift_faller_sideways = _recorded('shift_faller_sideways')
+    spawn_faller = _recorded('spawn_faller')
+    hard_drop = _recorded('hard_drop')
+    fast_forward = _recorded('fast_forward')
+    resolve_all = _recorded('resolve_all')
+    initialize_board_contents = _recorded('initialize_board_contents')
+
+    def restore(self, snapshot: columnlogic.ColumnsSnapshot) -> None:
+        super().restore(snapshot)
+        # A snapshot can be from anywhere, so every row is compared
+        self._record(None)
+
+    def _faller_tuple(self) -> tuple:
+        faller = self._faller
+        return faller.active, faller.row, faller.column, tuple(faller.contents), faller.state
+
+    def _row_bytes(self, row: int) -> bytes:
+        start = row * self._columns
+        end = start + self._columns
+        return self._jewels[start:end] + self._states[start:end]
+
+    def _record(self, rows) -> None:
+        """Add a version after the current one, copying `rows` (every changed row if None)."""
+        boardRows = self._versions[self._version][0]
+        if rows is None:
+            rows = [row for row in range(self._rows) if boardRows[row] != self._row_bytes(row)]
+        if rows:
+            boardRows = list(boardRows)
+            for row in rows:
+                boardRows[row] = bytes(self._row_bytes(row))
+            boardRows = tuple(boardRows)
+
+        # A new call after undo() drops the versions that were undone
+        del self._versions[self._version + 1:]
+        self._versions.append((boardRows, self._faller_tuple(),
+                               frozenset(self._dirty) if self._dirty else _NO_CELLS,
+                               frozenset(self._unsettledColumns) if self._unsettledColumns else _NO_CELLS))
+        self._version += 1
+
+    def get_version(self) -> int:
+        """The current version: 0 is the new board, and every recorded call adds one."""
+        return self._version
+
+    def get_version_count(self) -> int:
+        return len(self._versions)
+
+    def undo(self, steps: int = 1) -> int:
+        """Go back `steps` versions, or as far as there are; returns the versions moved."""
+        target = max(0, self._version - steps)
+        moved = self._version - target
+        self.seek(target)
+        return moved
+
+    def redo(self, steps: int = 1) -> int:
+        """Go forward `steps` undone versions, or as many as there are; returns the versions moved."""
+        target = min(len(self._versions) - 1, self._version + steps)
+        moved = target - self._version
+        self.seek(target)
+        return moved
+
+    def seek(self, version: int) -> None:
+        """Make `version` the current one; get_changes() then lists the cells that differ."""
+        if not 0 <= version < len(self._versions):
+            raise IndexError('no version {} (there are {})'.format(version, len(self._versions)))
+        self._seek(version)
+
+    @columnlogic._records_changes
+    def _seek(self, version: int) -> None:
+        current = self._versions[self._version]
+        target = self._versions[version]
+        jewels = self._jewels
+        states = self._states
+        cols = self._columns
+        currentRows = current[0]
+        for row, targetRow in enumerate(target[0]):
+            # Rows shared by both versions are the same objects
+            if targetRow is currentRows[row]:
+                continue
+            base = row * cols
+            for col in range(cols):
+                index = base + col
+                jewel = targetRow[col]
+                state = targetRow[cols + col]
+                if jewels[index] != jewel or states[index] != state:
+                    self._write(index, jewel, state)
+
+        faller = self._faller
+        faller.active, faller.row, faller.column, contents, faller.state = target[1]
+        faller.contents = list(contents)
+        self._dirty = set(target[2])
+        self._unsettledColumns = set(target[3])
+        self._version = version
+
+    def history_stats(self) -> dict:
+        """
+        Version count, the distinct rows they hold between them, and the
+        bytes taken by those rows and the row tuples, against what full
+        copies of the board would take.
+        """
+        objects = {}
+        for version in self._versions:
+            rows = version[0]
+            objects[id(rows)] = rows
+            for row in rows:
+                objects[id(row)] = row
+        return {
+            'versions': len(self._versions),
+            'distinct_rows': sum(1 for value in objects.values() if isinstance(value, bytes)),
+            'history_bytes': sum(map(sys.getsizeof, objects.values())),
+            'full_copy_bytes': len(self._versions) * sys.getsizeof(bytes(2 * self._rows * self._columns)),
+        }
@@ -0,0 +1,279 @@
+"""
+Opt-in instrumentation for ColumnsState.
+
+A Profiler attached to a state times every call of the engine's main
+methods and counts the work they do (see Counters).  Attaching puts timed
+wrappers on that one state object; a state that was never attached (or
+has been detached) runs the plain class methods at no extra cost.
+
+Timings go into log-bucketed histograms that report p50/p95/p99 and can
+be exported as JSON or CSV.  Run as a script to profile headless games:
+
+    python column_profile.py --games 200 --json profile.json
+"""
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from contextlib import contextmanager
+
+import columnlogic
+import column_sim
+
+Timed_Methods = (
+    'tick',
+    'resolve_all',
+    '_cascade',
+    '_matching',
+    '_clear_matched',
+    '_gem_gravity',
+    '_find_and_mark_matches',
+    '_mark_dirty_matches',
+    'match_x_axis',
+    'match_y_axis',
+    'match_diagonal',
+)
+
+# cells_rechecked: cells whose lines were searched for new matches, every
+#     cell on a full scan and only the changed ones otherwise
+# cells_marked: jewels marked as matched, including by cascade cache hits
+# gravity_moves: jewels moved by gravity, except in cascade steps a cascade
+#     cache hit wrote back without running them
+# cascade_cache_hits: cascade steps taken from the cascade cache
+# cascade_links, max_cascade_depth: chain links after the first, by tick
+#     or resolve_all, and the longest chain
+Counters = (
+    'cells_rechecked',
+    'cells_marked',
+    'gravity_moves',
+    'cascade_cache_hits',
+    'cascade_links',
+    'max_cascade_depth',
+)
+
+Percentiles = (50, 95, 99)
+
+
+class Histogram:
+    """
+    Durations in seconds, counted in log-spaced buckets with Sub_Buckets
+    buckets per doubling, so percentiles are within about 4%.
+    """
+    Sub_Buckets = 16
+
+    def __init__(self):
+        self._buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+        # Bucket by nanoseconds: exponent plus the top bits of the mantissa
+        mantissa, exponent = math.frexp(max(seconds * 1e9, 1.0))
+        bucket = exponent * self.Sub_Buckets + int((mantissa - 0.5) * 2 * self.Sub_Buckets)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+
+    def percentile(self, percent: float) -> float:
+        """The duration below which `percent` % of the samples fall, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                exponent, sub = divmod(bucket, self.Sub_Buckets)
+                # Middle of the bucket, capped by the largest sample
+                upper = math.ldexp(0.5 + (sub + 0.5) / (2 * self.Sub_Buckets), exponent) / 1e9
+                return min(upper, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        result = {
+            'count': self.count,
+            'total_ms': self.total * 1e3,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+            'max_us': self.max * 1e6,
+        }
+        for percent in Percentiles:
+            result['p{}_us'.format(percent)] = self.percentile(percent) * 1e6
+        return result
+
+
+class Profiler:
+    def __init__(self):
+        self.timings = {}
+        self.counters = dict.fromkeys(Counters, 0)
+        self._chain = 0
+
+    def timing(self, name: str) -> Histogram:
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        return histogram
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timing(name).add(seconds)
+
+    @contextmanager
+    def time(self, name: str):
+        """Time the body of a with statement under `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timing(name).add(time.perf_counter() - start)
+
+    def attach(self, state: columnlogic.ColumnsState) -> None:
+        """Start timing and counting the calls made on `state`."""
+        for name in Timed_Methods:
+            method = getattr(type(state), name).__get__(state)
+            setattr(state, name, self._wrap(state, name, method))
+
+    def detach(self, state: columnlogic.ColumnsState) -> None:
+        for name in Timed_Methods:
+            state.__dict__.pop(name, None)
+
+    def _wrap(self, state: columnlogic.ColumnsState, name: str, method):
+        histogram = self.timing(name)
+        counters = self.counters
+        clock = time.perf_counter
+
+        if name == 'tick':
+            def timed(*args):
+                start = clock()
+                result = method(*args)
+                histogram.add(clock() - start)
+                # Every tick that marks jewels is one more link of a chain
+                if state.get_changes().matches_marked:
+                    self._add_chain_links(1)
+                else:
+                    self._chain = 0
+                return result
+        elif name == 'resolve_all':
+            def timed(*args):
+                start = clock()
+                links = method(*args)
+                histogram.add(clock() - start)
+                # Every link but the last marked the jewels the next one cleared
+                if len(links) > 1:
+                    self._add_chain_links(len(links) - 1)
+                self._chain = 0
+                return links
+        elif name == '_cascade':
+            def timed(*args):
+                cache = state.get_cascade_cache()
+                hits = cache.hits if cache is not None else 0
+                start = clock()
+                links = method(*args)
+                histogram.add(clock() - start)
+                # A hit skips _find_and_mark_matches, which counts the marks
+                # otherwise; each link clears what the one before it marked
+                if cache is not None and cache.hits > hits:
+                    counters['cascade_cache_hits'] += 1
+                    counters['cells_marked'] += sum(map(len, links[1:])) + len(state._matchedCells)
+                return links
+        elif name == '_find_and_mark_matches':
+            def timed(*args):
+                if state._fullScan:
+                    counters['cells_rechecked'] += state.get_rows() * state.get_columns()
+                else:
+                    counters['cells_rechecked'] += len(state._dirty)
+                marked = len(state._matchedCells)
+                start = clock()
+                result = method(*args)
+                histogram.add(clock() - start)
+                counters['cells_marked'] += len(state._matchedCells) - marked
+                return result
+        elif name == '_gem_gravity':
+            def timed(*args):
+                start = clock()
+                moves = method(*args)
+                histogram.add(clock() - start)
+                counters['gravity_moves'] += moves
+                return moves
+        else:
+            def timed(*args):
+                start = clock()
+                result = method(*args)
+                histogram.add(clock() - start)
+                return result
+        return timed
+
+    def _add_chain_links(self, links: int) -> None:
+        counters = self.counters
+        # Links after the first of a chain are cascades
+        counters['cascade_links'] += min(links, self._chain + links - 1)
+        self._chain += links
+        counters['max_cascade_depth'] = max(counters['max_cascade_depth'], self._chain)
+
+    def summary(self) -> dict:
+        return {
+            'timings': {name: histogram.summary() for name, histogram in sorted(self.timings.items()) if histogram.count},
+            'counters': dict(self.counters),
+        }
+
+    def to_json(self, output) -> None:
+        json.dump(self.summary(), output, indent=2, sort_keys=True)
+        output.write('\n')
+
+    def to_csv(self, output) -> None:
+        """One row per timed name, then one per counter (in the count column)."""
+        fields = ['name', 'count', 'total_ms', 'mean_us'] + ['p{}_us'.format(p) for p in Percentiles] + ['max_us']
+        writer = csv.DictWriter(output, fields)
+        writer.writeheader()
+        for name, result in self.summary()['timings'].items():
+            writer.writerow(dict(result, name=name))
+        for name, value in self.counters.items():
+            writer.writerow({'name': name, 'count': value})
+
+    def hud_lines(self, names: list) -> list:
+        """Short 'name last/p50/p99' lines for the timings in `names`."""
+        lines = []
+        for name in names:
+            histogram = self.timings.get(name)
+            if histogram and histogram.count:
+                lines.append('{} {:.2f} ms (p50 {:.2f}, p99 {:.2f})'.format(
+                    name, histogram.last * 1e3, histogram.percentile(50) * 1e3, histogram.percentile(99) * 1e3))
+        return lines
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description='Profile the Columns engine over headless games.')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', choices=sorted(column_sim.POLICIES), default='random')
+    parser.add_argument('--rows', type=int, default=column_sim.Rows)
+    parser.add_argument('--cols', type=int, default=column_sim.Columns)
+    parser.add_argument('--full-scan', action='store_true', help='match with full board scans instead of incrementally')
+    parser.add_argument('--cascade-cache', type=int, default=0, help='share a cascade cache of this many entries')
+    parser.add_argument('--json', help='write the profile as JSON to this file')
+    parser.add_argument('--csv', help='write the profile as CSV to this file')
+    args = parser.parse_args(argv)
+
+    profiler = Profiler()
+    cache = columnlogic.CascadeCache(args.cascade_cache) if args.cascade_cache else None
+    for game in range(args.games):
+        column_sim.play_game(args.seed + game, column_sim.POLICIES[args.policy], args.rows, args.cols,
+                             profiler=profiler, full_scan=args.full_scan, cascade_cache=cache)
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            profiler.to_json(output)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as output:
+            profiler.to_csv(output)
+    if not args.json and not args.csv:
+        profiler.to_json(sys.stdout)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,284 @@
+"""
+Columns boards drawn onto any pygame surface, on screen or off.
+
+BoardRenderer draws cells at one cell size from sprites it caches per
+jewel and state; the game window draws with one, and it needs no window
+of its own, so boards can be rendered to images with SDL's dummy video
+driver.  Run as a script to render replays (a frame every few ticks) or
+the positions of a column_dataset file to PNG files across a process
+pool, each worker keeping one renderer and its sprites for all its jobs:
+
+    python column_render.py frames --replays replays/*.clrp --every 10
+    python column_render.py thumbs --dataset positions.cds --cell-size 8 --workers 4
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+import columnlogic
+import column_dataset
+import column_replay
+from column_config import Jewels_Colors
+
+# pygame and numpy are imported by the first renderer (see _load_pygame),
+# so the module can be imported and its jobs pickled without a display and
+# pool workers start quickly
+pygame = None
+np = None
+
+# Below this size cells are drawn as plain colored squares
+Sprite_Min_Cell_Size = 6
+Default_Cell_Size = 16
+# Dataset records rendered per worker job
+Records_Per_Job = 256
+
+Background_Color = (255, 255, 255)
+Grind_Color = (0, 0, 0)
+Landing_Color = (255, 255, 0)
+Matching_Color = (255, 255, 255)
+Unknown_Jewel_Color = (128, 128, 128)
+
+
+def _load_pygame():
+    global pygame, np
+    if pygame is None:
+        import pygame
+    if np is None:
+        import numpy as np
+    return pygame
+
+
+def fit_cell_size(rows: int, cols: int, width: int, height: int) -> int:
+    """The largest whole cell size at which a rows x cols board fits in width x height pixels."""
+    return int(min(width / cols, height / rows))
+
+
+class BoardRenderer:
+    """
+    Draws cells of one size.  Sprites are made on first use for every
+    (contents, state, flash) drawn, so a renderer kept for many boards
+    only ever draws each kind of cell once.
+    """
+    def __init__(self, cell_size: int, jewel_colors: dict = Jewels_Colors):
+        _load_pygame()
+        self.cell_size = cell_size
+        self.jewel_colors = jewel_colors
+        self.sprites = {}
+        # Sprites without flash by (state code << 8 | jewel code), for drawing from cell codes
+        self._codeSprites = {}
+
+        # Colors of the plain squares drawn for small cells, by jewel code
+        self.color_table = np.full((256, 3), Unknown_Jewel_Color, dtype=np.uint8)
+        for jewel, color in jewel_colors.items():
+            if len(jewel) == 1 and ord(jewel) < 128:
+                self.color_table[ord(jewel)] = color
+
+    def get_jewel_color(self, char: str) -> tuple:
+        return self.jewel_colors.get(char, Unknown_Jewel_Color)
+
+    def get_sprite(self, contents: str, state: str, flash: bool) -> pygame.Surface:
+        key = (contents, state, flash)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            size = int(self.cell_size)
+            sprite = pygame.Surface((size, size))
+            sprite.fill(Background_Color)
+            if contents != columnlogic.EMPTY:
+                if size < Sprite_Min_Cell_Size:
+                    sprite.fill(self.get_jewel_color(contents))
+                else:
+                    self.draw_jewel(sprite, 0, 0, contents, state, flash)
+            elif size >= Sprite_Min_Cell_Size:
+                rect = pygame.Rect(0, 0, self.cell_size - 2, self.cell_size - 2)
+                pygame.draw.rect(sprite, Grind_Color, rect, width=1)
+            self.sprites[key] = sprite
+        return sprite
+
+    def draw_jewel(self, surface: pygame.Surface, x: int, y: int, char: str, state: str, flash: bool = False):
+        jewel_color = self.get_jewel_color(char)
+
+        if flash:
+            if state == columnlogic.FALLER_STOPPED_CELL:
+                jewel_color = tuple(min(255, c + 100) for c in jewel_color)
+            elif state == columnlogic.MATCHED_JEWEL:
+                jewel_color = tuple(min(255, c + 150) for c in jewel_color)
+
+        rect = pygame.Rect(x, y, self.cell_size - 2, self.cell_size - 2)
+
+        if state == columnlogic.FALLER_MOVING_JEWEL:
+            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
+            pygame.draw.rect(surface, (0,0,0), rect, width=2, border_radius=5)
+        elif state == columnlogic.FALLER_STOPPED_CELL:
+            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
+            pygame.draw.rect(surface, Landing_Color, rect, width=3, border_radius=5)
+        elif state == columnlogic.MATCHED_JEWEL:
+            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
+            pygame.draw.rect(surface, Matching_Color, rect, width=3, border_radius=5)
+
+            center_x = x + self.cell_size // 2
+            center_y = y + self.cell_size // 2
+            size = self.cell_size // 4
+
+            pygame.draw.line(surface, Matching_Color, (center_x - size, center_y), (center_x + size, center_y), 2)
+            pygame.draw.line(surface, Matching_Color, (center_x, center_y - size), (center_x, center_y + size), 2)
+            pygame.draw.line(surface, Matching_Color,(int(center_x - size*0.7), int(center_y - size*0.7)),(int(center_x + size*0.7), int(center_y + size*0.7)), 2)
+            pygame.draw.line(surface, Matching_Color,(int(center_x - size*0.7), int(center_y + size*0.7)),(int(center_x + size*0.7), int(center_y - size*0.7)), 2)
+        elif state == columnlogic.OCCUPIED_JEWEL:
+            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
+        else:
+            pygame.draw.rect(surface, Grind_Color, rect, width=1)
+
+    def draw_codes(self, surface: pygame.Surface, jewels, states, cols: int, top: int, left: int, bottom: int,
+                   right: int, x: int = 0, y: int = 0):
+        """
+        Draw cells [top, bottom) x [left, right) of a board `cols` wide
+        from its flat jewel and state codes (as ColumnsState.get_board_codes
+        gives them) with the top left cell at (x, y), without flashes.
+        """
+        size = self.cell_size
+        if size < Sprite_Min_Cell_Size:
+            # One pixel per cell from the cell codes, scaled up to the cell size
+            jewels = np.frombuffer(jewels, dtype=np.uint8).reshape(-1, cols)[top:bottom, left:right]
+            states = np.frombuffer(states, dtype=np.uint8).reshape(-1, cols)[top:bottom, left:right]
+            pixels = self.color_table[jewels]
+            pixels[states == 0] = Background_Color
+            cells = pygame.surfarray.make_surface(pixels.transpose(1, 0, 2))
+            surface.blit(pygame.transform.scale(cells, ((right - left) * size, (bottom - top) * size)), (x, y))
+            return
+
+        sprites = self._codeSprites
+        blits = []
+        for row in range(top, bottom):
+            base = row * cols
+            cell_y = y + (row - top) * size
+            for col in range(left, right):
+                jewel = jewels[base + col]
+                state = states[base + col]
+                sprite = sprites.get(state << 8 | jewel)
+                if sprite is None:
+                    sprite = sprites[state << 8 | jewel] = self.get_sprite(
+                        columnlogic._JEWEL_NAMES[jewel], columnlogic._STATE_NAMES[state], False)
+                blits.append((sprite, (x + (col - left) * size, cell_y)))
+        surface.blits(blits, doreturn=False)
+
+    def draw_cells(self, surface: pygame.Surface, board, top: int, left: int, bottom: int, right: int,
+                   x: int = 0, y: int = 0):
+        """draw_codes for a region of a ColumnsState (or anything with get_board_codes and get_columns)."""
+        jewels, states = board.get_board_codes()
+        self.draw_codes(surface, jewels, states, board.get_columns(), top, left, bottom, right, x, y)
+
+    def render_codes(self, jewels, states, rows: int, cols: int) -> pygame.Surface:
+        """A new surface of the whole board drawn from its cell codes."""
+        surface = pygame.Surface((cols * self.cell_size, rows * self.cell_size))
+        surface.fill(Background_Color)
+        self.draw_codes(surface, jewels, states, cols, 0, 0, rows, cols)
+        return surface
+
+    def render(self, board) -> pygame.Surface:
+        """A new surface of a whole ColumnsState (or anything that reads like one)."""
+        jewels, states = board.get_board_codes()
+        return self.render_codes(jewels, states, board.get_rows(), board.get_columns())
+
+
+# One renderer per cell size in each worker process, kept across jobs so
+# every worker draws its sprites once
+_worker_renderers = {}
+
+
+def _worker_renderer(cell_size: int) -> BoardRenderer:
+    renderer = _worker_renderers.get(cell_size)
+    if renderer is None:
+        # Workers never open a window; should anything start SDL's video
+        # it gets the dummy driver rather than looking for a display
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        renderer = _worker_renderers[cell_size] = BoardRenderer(cell_size)
+    return renderer
+
+
+def render_replay(path: str, out_dir: str, cell_size: int = Default_Cell_Size, every: int = 1) -> int:
+    """
+    Render the position before every `every`-th tick of a replay file,
+    and the final position, to <out_dir>/<replay name>_<tick>.png.
+    Returns the number of images written.
+    """
+    renderer = _worker_renderer(cell_size)
+    replay = column_replay.Replay.load(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    images = 0
+    for tick, state, actions in column_dataset.replay_positions(replay):
+        if tick % every == 0 or tick == replay.ticks:
+            pygame.image.save(renderer.render(state), os.path.join(out_dir, '{}_{:06d}.png'.format(name, tick)))
+            images += 1
+    return images
+
+
+def render_records(path: str, start: int, stop: int, out_dir: str, cell_size: int = Default_Cell_Size) -> int:
+    """
+    Render records [start, stop) of a column_dataset file to
+    <out_dir>/<dataset name>_<record>.png; returns the images written.
+    """
+    renderer = _worker_renderer(cell_size)
+    records = column_dataset.open_dataset(path)[start:stop]
+    rows, cols = records['jewels'].shape[1:]
+    name = os.path.splitext(os.path.basename(path))[0]
+    for offset, record in enumerate(records):
+        surface = renderer.render_codes(record['jewels'].tobytes(), record['states'].tobytes(), rows, cols)
+        pygame.image.save(surface, os.path.join(out_dir, '{}_{:07d}.png'.format(name, start + offset)))
+    return len(records)
+
+
+def _run_job(job: tuple) -> int:
+    function, args = job
+    return function(*args)
+
+
+def render_batch(jobs: list, workers: int = 1):
+    """
+    Run (function, args) render jobs, such as (render_replay, (path,
+    out_dir)), yielding each one's image count in order, across a process
+    pool when workers > 1.
+    """
+    if workers == 1:
+        yield from map(_run_job, jobs)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_run_job, jobs)
+
+
+def main(argv: list = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Render Columns boards to PNG files.')
+    parser.add_argument('output', help='directory for the images')
+    parser.add_argument('--replays', nargs='+', default=[], help='render positions of these replay files')
+    parser.add_argument('--every', type=int, default=1, help='render a replay position every this many ticks')
+    parser.add_argument('--dataset', help='render the records of this column_dataset file')
+    parser.add_argument('--start', type=int, default=0, help='first dataset record')
+    parser.add_argument('--stop', type=int, help='dataset record to stop before')
+    parser.add_argument('--cell-size', type=int, default=Default_Cell_Size, help='pixels per cell')
+    parser.add_argument('--workers', type=int, default=1, help='processes rendering images')
+    args = parser.parse_args(argv)
+    if not args.replays and not args.dataset:
+        parser.error('give --replays or --dataset')
+
+    os.makedirs(args.output, exist_ok=True)
+    jobs = [(render_replay, (path, args.output, args.cell_size, args.every)) for path in args.replays]
+    if args.dataset:
+        stop = len(column_dataset.open_dataset(args.dataset))
+        if args.stop is not None:
+            stop = min(stop, args.stop)
+        jobs += [(render_records, (args.dataset, start, min(stop, start + Records_Per_Job), args.output, args.cell_size))
+                 for start in range(args.start, stop, Records_Per_Job)]
+
+    start_time = time.perf_counter()
+    images = sum(render_batch(jobs, args.workers))
+    elapsed = time.perf_counter() - start_time
+    print('{} images in {:.2f}s ({:.0f} images/s)'.format(images, elapsed, images / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
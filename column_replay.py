@@ -0,0 +1,272 @@
+"""
+Compact, deterministic Columns replays.
+
+A replay holds everything needed to re-run a game exactly: the faller
+generator's seed, the board size, the jewel types and every input
+together with the tick it was applied before.  Every checksum_interval
+ticks the board's Zobrist hash is stored as well, so playback can tell
+exactly where it went off track.  Playback runs the game with no
+real-time waits.
+
+File layout (little-endian):
+
+    magic 'CLRP', version u8, rows u16, cols u16, seed i64,
+    checksum interval u16, jewel type count u8, jewel types (ASCII),
+    then events until END.
+
+Each event is a varint of (ticks since the previous event << 3 | opcode),
+followed by an 8-byte hash for CHECKSUM and a game-over byte for END.
+
+    python column_replay.py --record 100 --policy bot --dir replays
+    python column_replay.py replays/*.clrp
+"""
+import os
+import struct
+import sys
+import time
+
+import columnlogic
+import column_sim
+
+Magic = b'CLRP'
+Version = 1
+Checksum_Interval = 100
+
+_HEADER = struct.Struct('<4sBHHqHB')
+_HASH = struct.Struct('<Q')
+
+_OP_LEFT = 0
+_OP_RIGHT = 1
+_OP_ROTATE = 2
+_OP_DROP = 3
+_OP_CHECKSUM = 4
+_OP_END = 5
+
+_ACTION_OPS = {
+    column_sim.LEFT: _OP_LEFT,
+    column_sim.RIGHT: _OP_RIGHT,
+    column_sim.ROTATE: _OP_ROTATE,
+    column_sim.DROP: _OP_DROP,
+}
+_OP_ACTIONS = {op: action for action, op in _ACTION_OPS.items()}
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayMismatch(ReplayError):
+    """Playback reached a board whose checksum differs from the recording."""
+    def __init__(self, tick: int, expected: int, actual: int):
+        super().__init__('checksum mismatch after tick {}: expected {:016x}, got {:016x}'.format(tick, expected, actual))
+        self.tick = tick
+        self.expected = expected
+        self.actual = actual
+
+
+class Replay:
+    def __init__(self, seed: int, rows: int, cols: int, jewel_types: list, checksum_interval: int = Checksum_Interval):
+        self.seed = seed
+        self.rows = rows
+        self.cols = cols
+        self.jewel_types = list(jewel_types)
+        self.checksum_interval = checksum_interval
+        # (tick, action): action applied before tick number `tick` (from 0)
+        self.inputs = []
+        # tick -> board hash after that many ticks
+        self.checksums = {}
+        self.ticks = 0
+        self.game_over = False
+
+    def to_bytes(self) -> bytes:
+        data = bytearray(_HEADER.pack(Magic, Version, self.rows, self.cols, self.seed,
+                                      self.checksum_interval, len(self.jewel_types)))
+        data += ''.join(self.jewel_types).encode('ascii')
+
+        # Inputs go before the checksum of the same tick count, as in play
+        events = [(tick, 0, _ACTION_OPS[action], None) for tick, action in self.inputs]
+        events += [(tick, 1, _OP_CHECKSUM, value) for tick, value in self.checksums.items()]
+        events.sort(key=lambda event: event[:2])
+        last = 0
+        for tick, _, op, value in events:
+            _write_varint(data, (tick - last) << 3 | op)
+            if value is not None:
+                data += _HASH.pack(value)
+            last = tick
+        _write_varint(data, (self.ticks - last) << 3 | _OP_END)
+        data.append(self.game_over)
+        return bytes(data)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Replay':
+        if len(data) < _HEADER.size or data[:4] != Magic:
+            raise ReplayError('not a Columns replay')
+        magic, version, rows, cols, seed, interval, jewel_count = _HEADER.unpack_from(data)
+        if version != Version:
+            raise ReplayError('unsupported replay version {}'.format(version))
+        offset = _HEADER.size
+        jewel_types = list(data[offset:offset + jewel_count].decode('ascii'))
+        offset += jewel_count
+
+        replay = cls(seed, rows, cols, jewel_types, interval)
+        tick = 0
+        while True:
+            if offset >= len(data):
+                raise ReplayError('replay is truncated')
+            value, offset = _read_varint(data, offset)
+            tick += value >> 3
+            op = value & 7
+            if op in _OP_ACTIONS:
+                replay.inputs.append((tick, _OP_ACTIONS[op]))
+            elif op == _OP_CHECKSUM:
+                replay.checksums[tick] = _HASH.unpack_from(data, offset)[0]
+                offset += _HASH.size
+            elif op == _OP_END:
+                replay.ticks = tick
+                replay.game_over = bool(data[offset])
+                return replay
+            else:
+                raise ReplayError('unknown replay event {}'.format(op))
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as replay_file:
+            replay_file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, 'rb') as replay_file:
+            return cls.from_bytes(replay_file.read())
+
+
+def _write_varint(data: bytearray, value: int) -> None:
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> tuple:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class ReplayRecorder:
+    """
+    Builds a Replay while a game is played.  Call action() for every input
+    applied to the faller, tick() after every ColumnsState.tick() and
+    finish() once the game has ended.
+    """
+    def __init__(self, seed: int, rows: int, cols: int, jewel_types: list, checksum_interval: int = Checksum_Interval):
+        self.replay = Replay(seed, rows, cols, jewel_types, checksum_interval)
+
+    def action(self, action: str) -> None:
+        self.replay.inputs.append((self.replay.ticks, action))
+
+    def tick(self, state: columnlogic.ColumnsState) -> None:
+        replay = self.replay
+        replay.ticks += 1
+        if replay.ticks % replay.checksum_interval == 0:
+            replay.checksums[replay.ticks] = state.zobrist_hash()
+
+    def finish(self, game_over: bool) -> Replay:
+        # The game can also end on the spawn after the last tick
+        self.replay.game_over = game_over
+        return self.replay
+
+
+def play(replay: Replay, verify: bool = True) -> columnlogic.ColumnsState:
+    """
+    Re-run a replay as fast as possible and return the final state.  With
+    verify, raises ReplayMismatch at the first checksum that differs and
+    ReplayError if the game does not end the way it was recorded.
+    """
+    state = columnlogic.ColumnsState(replay.rows, replay.cols)
+    generator = column_sim.FallerGenerator(replay.seed, replay.jewel_types)
+    inputs = replay.inputs
+    checksums = replay.checksums if verify else {}
+    next_input = 0
+
+    game_over = generator.spawn(state)
+    tick = 0
+    while tick < replay.ticks:
+        while next_input < len(inputs) and inputs[next_input][0] == tick:
+            column_sim.apply_action(state, inputs[next_input][1])
+            next_input += 1
+
+        # Skip straight through plain falling up to the next input or checksum
+        stop = min(replay.ticks, (tick // replay.checksum_interval + 1) * replay.checksum_interval)
+        if next_input < len(inputs):
+            stop = min(stop, inputs[next_input][0])
+        skipped = state.fast_forward(stop - tick)
+        if skipped:
+            tick += skipped
+        else:
+            game_over = state.tick()
+            tick += 1
+        if tick in checksums and checksums[tick] != state.zobrist_hash():
+            raise ReplayMismatch(tick, checksums[tick], state.zobrist_hash())
+
+        if not state.has_faller() and not game_over:
+            game_over = generator.spawn(state)
+
+    # Inputs made after the last tick, before the game was closed
+    for _, action in inputs[next_input:]:
+        column_sim.apply_action(state, action)
+
+    if verify and game_over != replay.game_over:
+        raise ReplayError('game over was {} after {} ticks, recorded {}'.format(game_over, tick, replay.game_over))
+    return state
+
+
+def record_game(seed: int, policy=column_sim.random_policy, rows: int = column_sim.Rows, cols: int = column_sim.Columns,
+                jewel_types: list = column_sim.Jewel_Types, max_ticks: int = column_sim.Max_Ticks) -> Replay:
+    """Play one headless game with column_sim.play_game and return its replay."""
+    recorder = ReplayRecorder(seed, rows, cols, jewel_types)
+    stats = column_sim.play_game(seed, policy, rows, cols, jewel_types, max_ticks, recorder)
+    return recorder.finish(stats['game_over'])
+
+
+def main(argv: list = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Record or verify Columns replays.')
+    parser.add_argument('replays', nargs='*', help='replay files to play back and verify')
+    parser.add_argument('--record', type=int, metavar='GAMES', help='record this many headless games instead')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', choices=sorted(column_sim.POLICIES), default='random')
+    parser.add_argument('--max-ticks', type=int, default=column_sim.Max_Ticks)
+    parser.add_argument('--dir', default='.', help='directory recorded replays are written to')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        os.makedirs(args.dir, exist_ok=True)
+        for game in range(args.record):
+            seed = args.seed + game
+            replay = record_game(seed, column_sim.POLICIES[args.policy], max_ticks=args.max_ticks)
+            replay.save(os.path.join(args.dir, 'game-{}.clrp'.format(seed)))
+        return 0
+
+    failed = 0
+    for path in args.replays:
+        start = time.perf_counter()
+        try:
+            replay = Replay.load(path)
+            play(replay)
+        except ReplayError as error:
+            failed += 1
+            print('{}: FAILED: {}'.format(path, error))
+            continue
+        elapsed = time.perf_counter() - start
+        print('{}: ok, {} ticks in {:.1f} ms'.format(path, replay.ticks, elapsed * 1000))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
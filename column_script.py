@@ -0,0 +1,288 @@
+"""
+The text-driven Columns flow, run from script files.
+
+A script sets up the board and then gives one command per line:
+
+    4               rows
+    3               columns
+    CONTENTS        or EMPTY, for an empty board
+    S X             with CONTENTS, one line per row; short lines are
+    XYZ             padded with empty cells
+    YYZ
+     XZ
+    F 2 S T V       spawn a faller in column 2, jewels top to bottom
+    R               rotate the faller
+    <               shift it left
+    >               shift it right
+                    (a blank line) tick
+    D               dump the board (see checkpoints below)
+    Q               quit
+
+After the setup and after every command the board is dumped, as rows of
+three-character cells ('[X]' falling, '|X|' landed, '*X*' matched,
+' X ' settled) between bars and a line of dashes, followed by GAME OVER
+when the game ends.  With checkpoints=True only the D commands and the
+end of the game dump the board.
+
+One stream may hold several scripts, each ending with Q.  Run as a script
+to play files (or - for stdin), or to check a corpus of scripts against
+their expected output:
+
+    python column_script.py game.script
+    python column_script.py --check corpus/
+"""
+import argparse
+import difflib
+import glob
+import os
+import sys
+import time
+
+import columnlogic
+
+Script_Suffix = '.script'
+Expected_Suffix = '.expected'
+
+_EMPTY = 'EMPTY'
+_CONTENTS = 'CONTENTS'
+_GAME_OVER = 'GAME OVER'
+
+# Cell text by state code, for a jewel character
+_CELL_FORMATS = ('   ', '[{}]', '|{}|', ' {} ', '*{}*')
+# Cell text by (state code << 8 | jewel code), filled on first use
+_CELLS = {}
+
+
+class ScriptError(Exception):
+    pass
+
+
+def _cell(state: int, jewel: int) -> str:
+    key = state << 8 | jewel
+    text = _CELLS.get(key)
+    if text is None:
+        text = _CELLS[key] = _CELL_FORMATS[state].format(columnlogic._JEWEL_NAMES[jewel])
+    return text
+
+
+def _render_row(state: columnlogic.ColumnsState, row: int) -> str:
+    cols = state.get_columns()
+    jewels, states = state.get_board_codes()
+    start = row * cols
+    return '|' + ''.join(map(_cell, states[start:start + cols], jewels[start:start + cols])) + '|'
+
+
+def _bottom_line(state: columnlogic.ColumnsState) -> str:
+    return ' ' + '---' * state.get_columns() + ' '
+
+
+def render_board(state: columnlogic.ColumnsState) -> list:
+    """The board as the lines of one dump."""
+    return [_render_row(state, row) for row in range(state.get_rows())] + [_bottom_line(state)]
+
+
+class _Lines:
+    """Numbered lines of a stream, without their line endings."""
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._peeked = None
+        self.number = 0
+
+    def next(self) -> str:
+        """The next line, or None at the end of the stream."""
+        line = self.peek()
+        if line is not None:
+            self._peeked = None
+            self.number += 1
+        return line
+
+    def peek(self) -> str:
+        if self._peeked is None:
+            line = next(self._lines, None)
+            if line is not None:
+                self._peeked = line.rstrip('\r\n')
+        return self._peeked
+
+    def error(self, message: str) -> ScriptError:
+        return ScriptError('line {}: {}'.format(self.number, message))
+
+
+def _read_setup(lines: _Lines) -> columnlogic.ColumnsState:
+    try:
+        rows = int(lines.next())
+        cols = int(lines.next())
+    except (TypeError, ValueError):
+        raise lines.error('expected the number of rows and then of columns')
+    if rows < 3 or cols < 1:
+        raise lines.error('a board needs at least 3 rows and 1 column')
+    state = columnlogic.ColumnsState(rows, cols)
+
+    layout = (lines.next() or '').strip().upper()
+    if layout == _CONTENTS:
+        contents = []
+        for _ in range(rows):
+            line = lines.next()
+            if line is None:
+                raise lines.error('expected {} rows of contents'.format(rows))
+            if len(line) > cols:
+                raise lines.error('row is wider than {} columns'.format(cols))
+            contents.append(line.ljust(cols))
+        state.initialize_board_contents(contents)
+    elif layout != _EMPTY:
+        raise lines.error('expected EMPTY or CONTENTS')
+    return state
+
+
+def _command(state: columnlogic.ColumnsState, line: str, lines: _Lines) -> bool:
+    """Run one command line; returns True if the game is over."""
+    if line == '':
+        return state.tick()
+    if line == 'R':
+        state.rotate_faller()
+    elif line == '<':
+        state.shift_faller_sideways(columnlogic.LEFT)
+    elif line == '>':
+        state.shift_faller_sideways(columnlogic.RIGHT)
+    elif line.startswith('F '):
+        words = line.split()
+        if (len(words) != 5 or not words[1].isdigit() or not 1 <= int(words[1]) <= state.get_columns()
+                or any(len(jewel) != 1 for jewel in words[2:])):
+            raise lines.error('expected F column jewel jewel jewel')
+        return state.spawn_faller(int(words[1]), words[2:])
+    else:
+        raise lines.error('unknown command {!r}'.format(line))
+    return False
+
+
+def run_script(lines, checkpoints: bool = False) -> list:
+    """
+    Run one script from an iterable of lines, up to its Q or the end of
+    the lines, and return the output lines.  Raises ScriptError for a
+    malformed script.
+    """
+    return _run(_Lines(lines), checkpoints)
+
+
+def _run(lines: _Lines, checkpoints: bool) -> list:
+    state = _read_setup(lines)
+    # The dump is kept up to date by re-rendering only the rows each command changed
+    board = render_board(state)
+    output = []
+    if not checkpoints:
+        output += board
+
+    while True:
+        line = lines.next()
+        if line is None or line == 'Q':
+            return output
+        if line == 'D':
+            output += board
+            continue
+        game_over = _command(state, line, lines)
+        for row in {row for row, col in state.get_changes().cells_changed}:
+            board[row] = _render_row(state, row)
+        if game_over:
+            output += board
+            output.append(_GAME_OVER)
+            # Skip the rest of the script, so the next script in the stream starts after its Q
+            while line is not None and line != 'Q':
+                line = lines.next()
+            return output
+        if not checkpoints:
+            output += board
+
+
+def run_stream(lines, checkpoints: bool = False):
+    """Run the scripts of a stream one after another, yielding each one's output lines."""
+    lines = _Lines(lines)
+    while True:
+        # Blank lines between scripts are not ticks
+        while lines.peek() is not None and not lines.peek().strip():
+            lines.next()
+        if lines.peek() is None:
+            return
+        yield _run(lines, checkpoints)
+
+
+def corpus_scripts(paths: list) -> list:
+    """The script files among `paths`, with directories searched for *.script files."""
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts += sorted(glob.glob(os.path.join(path, '**', '*' + Script_Suffix), recursive=True))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def check_script(path: str, checkpoints: bool = False) -> list:
+    """
+    Run a script file and compare its output with the file next to it
+    named with Expected_Suffix, ignoring trailing spaces.  Returns the
+    differences as unified diff lines, empty if the output is as expected.
+    """
+    expected_path = os.path.splitext(path)[0] + Expected_Suffix
+    with open(path) as script_file:
+        try:
+            output = run_script(script_file, checkpoints)
+        except ScriptError as error:
+            return ['{}: {}'.format(path, error)]
+    with open(expected_path) as expected_file:
+        expected = [line.rstrip() for line in expected_file.read().splitlines()]
+    output = [line.rstrip() for line in output]
+    if output == expected:
+        return []
+    return list(difflib.unified_diff(expected, output, expected_path, path, lineterm=''))
+
+
+def check_corpus(scripts: list, checkpoints: bool = False, workers: int = 1):
+    """Check every script, yielding (path, differences) in order, across a process pool when workers > 1."""
+    if workers == 1:
+        for path in scripts:
+            yield path, check_script(path, checkpoints)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(scripts) // (workers * 16))
+        yield from zip(scripts, executor.map(check_script, scripts, [checkpoints] * len(scripts), chunksize=chunksize))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Run Columns command scripts.')
+    parser.add_argument('scripts', nargs='+', help='script files, - for stdin, or with --check corpus directories')
+    parser.add_argument('--checkpoints', action='store_true', help='dump the board only at D commands and game over')
+    parser.add_argument('--check', action='store_true',
+                        help='compare every script with its {} file instead of printing'.format(Expected_Suffix))
+    parser.add_argument('--workers', type=int, default=1, help='processes checking scripts')
+    args = parser.parse_args(argv)
+
+    if not args.check:
+        for path in args.scripts:
+            script_file = sys.stdin if path == '-' else open(path)
+            try:
+                for output in run_stream(script_file, args.checkpoints):
+                    if output:
+                        sys.stdout.write('\n'.join(output) + '\n')
+            except ScriptError as error:
+                print('{}: {}'.format(path, error), file=sys.stderr)
+                return 1
+            finally:
+                if script_file is not sys.stdin:
+                    script_file.close()
+        return 0
+
+    start = time.perf_counter()
+    scripts = corpus_scripts(args.scripts)
+    failed = 0
+    for path, differences in check_corpus(scripts, args.checkpoints, args.workers):
+        if differences:
+            failed += 1
+            print('\n'.join(differences), file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print('{} scripts, {} failed, {:.2f}s ({:.0f} scripts/s)'.format(
+        len(scripts), failed, elapsed, len(scripts) / elapsed if elapsed else 0))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,578 @@
+"""
+Many Columns games served from one asyncio event loop.
+
+Every connection, over TCP or a Unix socket, is one game session driven
+by a line protocol.  Each command line gets exactly one reply line,
+starting with OK, ERR, BOARD, DIFF or STATS:
+
+    NEW [rows cols [seed]]   start a new game (OK)
+    SPAWN [col jewels]       spawn the given faller (e.g. SPAWN 3 RGB), of
+                             the server's jewel types, or with no
+                             arguments the seeded next one
+                             (OK, or GAMEOVER if it does not fit)
+    LEFT | RIGHT | ROTATE | DROP
+                             move the faller (OK)
+    TICK [n]                 run n ticks, spawning nothing; n is at most
+                             the server's max_tick_count (OK or GAMEOVER)
+    AUTO interval            tick every interval seconds and spawn the
+                             seeded fallers; AUTO 0 stops (OK)
+    DIFF                     the cells changed since the last DIFF, BOARD
+                             or pushed TICK
+    BOARD                    the whole board
+    STATS                    server statistics as JSON
+    QUIT                     close the connection (OK)
+
+Cells are sent as row:col:jewel:state with '.' for no jewel and state
+the ColumnsState code (0 empty, 1 falling, 2 landed, 3 occupied,
+4 matched); BOARD sends rows, cols, then every jewel and every state
+code row by row.  While AUTO is on, each tick is pushed as a line
+"TICK n cells..." and the end of the game as "ENDED n", n being the
+number of ticks played.
+
+Automatic ticks of every session are run by one shared timer.  Run as a
+script to serve, or with --load to measure a server against that many
+local clients:
+
+    python column_server.py --port 7777
+    python column_server.py --load 2000 --interval 0.05 --seconds 10
+"""
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import columnlogic
+import column_config
+import column_profile
+import column_sim
+
+Default_Port = 7777
+# A late session catches up at most this many ticks before its clock is
+# reset to now, as in ColumnsVisual
+Max_Catch_Up_Ticks = 5
+# Clients that fall this far behind on reading are disconnected
+Max_Write_Buffer = 1 << 20
+# Default limits on the boards and TICK counts a server accepts
+Max_Rows = 1000
+Max_Cols = 1000
+Max_Tick_Count = 1000
+# Longest line a client reads: a DIFF of every cell of the largest board
+# takes up to about 16 bytes a cell
+Client_Line_Limit = 16 * Max_Rows * Max_Cols + 64
+
+_NO_JEWEL = '.'
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class TickScheduler:
+    """
+    One timer for every automatically ticking session.  Sessions wait in
+    a heap by the time their next tick is due; the timer wakes for the
+    earliest one and runs every session that is due.
+    """
+    def __init__(self, profiler: column_profile.Profiler):
+        self._heap = []
+        self._order = itertools.count()
+        self._timer = None
+        self._latency = profiler.timing('tick_latency')
+        self._tick = profiler.timing('tick')
+
+    def add(self, session: 'GameSession', interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        # Bumping the generation drops the session's older heap entry
+        session.generation += 1
+        session.interval = interval
+        heapq.heappush(self._heap, (loop.time() + interval, next(self._order), session.generation, session))
+        self._set_timer(loop)
+
+    def remove(self, session: 'GameSession') -> None:
+        session.generation += 1
+        session.interval = None
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _set_timer(self, loop: asyncio.AbstractEventLoop) -> None:
+        while self._heap and self._heap[0][2] != self._heap[0][3].generation:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            return
+        due = self._heap[0][0]
+        if self._timer is None or self._timer.when() > due:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = loop.call_at(due, self._run, loop)
+
+    def _run(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._timer = None
+        heap = self._heap
+        now = loop.time()
+        try:
+            while heap and heap[0][0] <= now:
+                due, order, generation, session = heapq.heappop(heap)
+                if generation != session.generation:
+                    continue
+                start = loop.time()
+                self._latency.add(start - due)
+                try:
+                    session.scheduled_tick()
+                except Exception as error:
+                    # Only the failing session is dropped; the others keep ticking
+                    session.abort()
+                    loop.call_exception_handler({'message': 'automatic tick failed', 'exception': error})
+                    continue
+                self._tick.add(loop.time() - start)
+
+                if session.interval is not None and generation == session.generation:
+                    due += session.interval
+                    if now - due > Max_Catch_Up_Ticks * session.interval:
+                        due = now + session.interval
+                    heapq.heappush(heap, (due, next(self._order), generation, session))
+        finally:
+            self._set_timer(loop)
+
+
+class GameSession:
+    def __init__(self, server: 'ColumnsServer', writer: asyncio.StreamWriter):
+        self._server = server
+        self._writer = writer
+        self.state = None
+        self.generator = None
+        self.ticks = 0
+        self.interval = None
+        self.generation = 0
+        self.closed = False
+        # Cells changed since they were last sent
+        self._pending = set()
+
+    def send(self, line: str) -> None:
+        if self._writer.is_closing():
+            return
+        if self._writer.transport.get_write_buffer_size() > Max_Write_Buffer:
+            self._server.scheduler.remove(self)
+            self._writer.close()
+            return
+        self._writer.write(line.encode() + b'\n')
+
+    def abort(self) -> None:
+        """Stop ticking and close the connection."""
+        self._server.scheduler.remove(self)
+        self.closed = True
+        self._writer.close()
+
+    def _game(self) -> columnlogic.ColumnsState:
+        if self.state is None:
+            raise ProtocolError('no game, send NEW first')
+        return self.state
+
+    def _collect(self) -> None:
+        self._pending |= self.state.get_changes().cells_changed
+
+    def _cells(self, cells) -> str:
+        jewels, states = self.state.get_board_codes()
+        cols = self.state.get_columns()
+        tokens = []
+        for row, col in sorted(cells):
+            index = row * cols + col
+            jewel = jewels[index]
+            tokens.append('{}:{}:{}:{}'.format(row, col, _NO_JEWEL if jewel == columnlogic._NO_JEWEL else chr(jewel),
+                                               states[index]))
+        return ' '.join(tokens)
+
+    def _diff(self) -> str:
+        cells = self._cells(self._pending)
+        self._pending = set()
+        return cells
+
+    def scheduled_tick(self) -> None:
+        """One automatic tick: tick, spawn the next faller and push the changes."""
+        state = self.state
+        game_over = state.tick()
+        self._collect()
+        if not game_over and not state.has_faller():
+            game_over = self.generator.spawn(state)
+            self._collect()
+        self.ticks += 1
+        self._server.ticks += 1
+        self.send('TICK {} {}'.format(self.ticks, self._diff()).rstrip())
+        if game_over:
+            self._server.scheduler.remove(self)
+            self.send('ENDED {}'.format(self.ticks))
+
+    def handle(self, line: str) -> str:
+        """Run one command line and return the reply line."""
+        words = line.split()
+        if not words:
+            raise ProtocolError('empty command')
+        name = words[0].upper()
+        command = Commands.get(name)
+        if command is None:
+            raise ProtocolError('unknown command {}'.format(words[0]))
+        fewest, most = Argument_Counts[name]
+        if not fewest <= len(words) - 1 <= most:
+            raise ProtocolError('wrong number of arguments to {}'.format(name))
+        try:
+            return command(self, *words[1:])
+        except ValueError as error:
+            raise ProtocolError('bad arguments to {}: {}'.format(words[0].upper(), error))
+
+    def new_game(self, rows: str = None, cols: str = None, seed: str = None) -> str:
+        rows = int(rows) if rows else column_config.Rows
+        cols = int(cols) if cols else column_config.Columns
+        if not (3 <= rows <= self._server.max_rows and 1 <= cols <= self._server.max_cols):
+            raise ProtocolError('board must be 3-{} rows and 1-{} columns'.format(self._server.max_rows,
+                                                                                 self._server.max_cols))
+        self._server.scheduler.remove(self)
+        self.state = columnlogic.ColumnsState(rows, cols)
+        self.generator = column_config.FallerGenerator(int(seed) if seed else random.randrange(2 ** 63),
+                                                       self._server.jewel_types)
+        self.ticks = 0
+        self._pending = set()
+        return 'OK'
+
+    def spawn(self, col: str = None, jewels: str = None) -> str:
+        state = self._game()
+        if col is None:
+            game_over = self.generator.spawn(state)
+        else:
+            col = int(col)
+            if not 1 <= col <= state.get_columns():
+                raise ProtocolError('column must be 1-{}'.format(state.get_columns()))
+            if jewels is None or len(jewels) != 3 or any(jewel not in self._server.jewel_types for jewel in jewels):
+                raise ProtocolError('a faller is three of the jewels {}'.format(''.join(self._server.jewel_types)))
+            game_over = state.spawn_faller(col, list(jewels))
+        self._collect()
+        return 'GAMEOVER' if game_over else 'OK'
+
+    def move(self, action: str) -> str:
+        column_sim.apply_action(self._game(), action)
+        self._collect()
+        return 'OK'
+
+    def tick(self, count: str = '1') -> str:
+        state = self._game()
+        count = int(count)
+        if not 1 <= count <= self._server.max_tick_count:
+            raise ProtocolError('tick count must be 1-{}'.format(self._server.max_tick_count))
+        for _ in range(count):
+            game_over = state.tick()
+            self._collect()
+            self.ticks += 1
+            self._server.ticks += 1
+            if game_over:
+                return 'GAMEOVER'
+        return 'OK'
+
+    def auto(self, interval: str) -> str:
+        state = self._game()
+        interval = float(interval)
+        # nan or inf would be a deadline that breaks the shared tick heap
+        if not math.isfinite(interval):
+            raise ProtocolError('interval must be a finite number of seconds')
+        if interval <= 0:
+            self._server.scheduler.remove(self)
+            return 'OK'
+        if interval < self._server.min_interval:
+            raise ProtocolError('interval must be at least {}'.format(self._server.min_interval))
+        if not state.has_faller() and self.generator.spawn(state):
+            self._collect()
+            return 'GAMEOVER'
+        self._collect()
+        self._server.scheduler.add(self, interval)
+        return 'OK'
+
+    def diff(self) -> str:
+        self._game()
+        return 'DIFF {}'.format(self._diff()).rstrip()
+
+    def board(self) -> str:
+        state = self._game()
+        jewels, states = state.get_board_codes()
+        self._pending = set()
+        return 'BOARD {} {} {} {}'.format(state.get_rows(), state.get_columns(),
+                                          bytes(jewels).decode('latin-1').replace(columnlogic.EMPTY, _NO_JEWEL),
+                                          ''.join(map(str, states)))
+
+    def stats(self) -> str:
+        return 'STATS ' + json.dumps(self._server.stats(), sort_keys=True)
+
+    def quit(self) -> str:
+        self._server.scheduler.remove(self)
+        self.closed = True
+        return 'OK'
+
+
+Commands = {
+    'NEW': GameSession.new_game,
+    'SPAWN': GameSession.spawn,
+    'LEFT': lambda session: session.move(column_sim.LEFT),
+    'RIGHT': lambda session: session.move(column_sim.RIGHT),
+    'ROTATE': lambda session: session.move(column_sim.ROTATE),
+    'DROP': lambda session: session.move(column_sim.DROP),
+    'TICK': GameSession.tick,
+    'AUTO': GameSession.auto,
+    'DIFF': GameSession.diff,
+    'BOARD': GameSession.board,
+    'STATS': GameSession.stats,
+    'QUIT': GameSession.quit,
+}
+
+
+def _argument_counts(command) -> tuple:
+    """The fewest and most arguments a command takes after the session."""
+    most = command.__code__.co_argcount - 1
+    return most - len(command.__defaults__ or ()), most
+
+
+Argument_Counts = {name: _argument_counts(command) for name, command in Commands.items()}
+
+
+class ColumnsServer:
+    def __init__(self, jewel_types: list = column_config.Jewel_Types, min_interval: float = 0.001,
+                 max_rows: int = Max_Rows, max_cols: int = Max_Cols, max_tick_count: int = Max_Tick_Count):
+        # Jewels go over the wire as single characters, so only ASCII letters will do
+        if any(len(jewel) != 1 or not (jewel.isascii() and jewel.isalpha()) for jewel in jewel_types):
+            raise ValueError('jewel types must be single ASCII letters')
+        self.jewel_types = list(jewel_types)
+        self.min_interval = min_interval
+        self.max_rows = max_rows
+        self.max_cols = max_cols
+        self.max_tick_count = max_tick_count
+        self.profiler = column_profile.Profiler()
+        self.scheduler = TickScheduler(self.profiler)
+        self.sessions = set()
+        self.ticks = 0
+        self.commands = 0
+        self._servers = []
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    async def start_tcp(self, host: str = '127.0.0.1', port: int = Default_Port) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self._serve, host, port)
+        self._servers.append(server)
+        return server
+
+    async def start_unix(self, path: str) -> asyncio.AbstractServer:
+        server = await asyncio.start_unix_server(self._serve, path)
+        self._servers.append(server)
+        return server
+
+    async def close(self) -> None:
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self._start
+        timings = self.profiler.summary()['timings']
+        return {
+            'sessions': len(self.sessions),
+            'auto_sessions': sum(1 for session in self.sessions if session.interval is not None),
+            'ticks': self.ticks,
+            'commands': self.commands,
+            'elapsed_s': elapsed,
+            'cpu_s': time.process_time() - self._cpu_start,
+            'tick_latency': timings.get('tick_latency', {}),
+            'tick': timings.get('tick', {}),
+        }
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = GameSession(self, writer)
+        self.sessions.add(session)
+        try:
+            while not session.closed:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than the reader's limit; the rest of the line
+                    # cannot be told from the next command, so the session ends
+                    writer.write(b'ERR line too long\n')
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                self.commands += 1
+                try:
+                    reply = session.handle(line.decode('utf-8', 'replace'))
+                except ProtocolError as error:
+                    reply = 'ERR {}'.format(error)
+                writer.write(reply.encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.scheduler.remove(session)
+            self.sessions.discard(session)
+            writer.close()
+
+
+class ColumnsClient:
+    """
+    A client for one session.  command() sends a line and returns its
+    reply; the TICK and ENDED lines pushed by automatic ticks are queued
+    in events, followed by None when the connection closes.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._replies = asyncio.Queue()
+        self.events = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect_tcp(cls, host: str = '127.0.0.1', port: int = Default_Port) -> 'ColumnsClient':
+        return cls(*await asyncio.open_connection(host, port, limit=Client_Line_Limit))
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> 'ColumnsClient':
+        return cls(*await asyncio.open_unix_connection(path, limit=Client_Line_Limit))
+
+    async def _read(self) -> None:
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                line = line.decode().rstrip('\n')
+                if line.startswith(('TICK', 'ENDED')):
+                    self.events.put_nowait(line)
+                else:
+                    self._replies.put_nowait(line)
+        except ConnectionError:
+            pass
+        finally:
+            self._replies.put_nowait(None)
+            self.events.put_nowait(None)
+
+    async def command(self, line: str) -> str:
+        """Send one command and return its reply, or None if the connection closed."""
+        self._writer.write(line.encode() + b'\n')
+        await self._writer.drain()
+        return await self._replies.get()
+
+    async def close(self) -> None:
+        self._writer.close()
+        await self._task
+
+
+async def _load_client(connect, seed: int, interval: float, stop_time: float, rng: random.Random) -> int:
+    """Play automatic games with random moves until stop_time; returns the games started."""
+    client = await connect()
+    games = 0
+    try:
+        while time.monotonic() < stop_time:
+            await client.command('NEW {} {} {}'.format(column_config.Rows, column_config.Columns, seed + games))
+            games += 1
+            if await client.command('AUTO {}'.format(interval)) != 'OK':
+                continue
+            while time.monotonic() < stop_time:
+                event = await client.events.get()
+                if event is None or event.startswith('ENDED'):
+                    break
+                # A move now and then, like a slow player
+                if rng.random() < 0.3:
+                    await client.command(rng.choice(('LEFT', 'RIGHT', 'ROTATE')))
+            else:
+                await client.command('AUTO 0')
+    finally:
+        await client.close()
+    return games
+
+
+async def run_clients(clients: int, interval: float, seconds: float, port: int = Default_Port,
+                      unix_path: str = None) -> int:
+    """Run `clients` load clients against a server for `seconds`; returns the games they started."""
+    if unix_path:
+        connect = lambda: ColumnsClient.connect_unix(unix_path)
+    else:
+        connect = lambda: ColumnsClient.connect_tcp('127.0.0.1', port)
+    stop_time = time.monotonic() + seconds
+    rng = random.Random(0)
+    games = await asyncio.gather(*(_load_client(connect, client * 1000, interval, stop_time, random.Random(rng.random()))
+                                   for client in range(clients)))
+    return sum(games)
+
+
+async def run_load(clients: int, interval: float, seconds: float, unix_path: str = None) -> dict:
+    """
+    Serve `clients` local clients that each play automatic games for
+    `seconds`, and return the server statistics at the end.  The clients
+    run in a child process, so the CPU time counted is the server's own.
+    """
+    server = ColumnsServer()
+    if unix_path:
+        await server.start_unix(unix_path)
+        target = ['--unix', unix_path]
+    else:
+        listener = await server.start_tcp('127.0.0.1', 0)
+        target = ['--port', str(listener.sockets[0].getsockname()[1])]
+
+    try:
+        child = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--clients', str(clients), '--interval', str(interval),
+            '--seconds', str(seconds), *target, stdout=asyncio.subprocess.PIPE)
+        output, _ = await child.communicate()
+        if child.returncode:
+            raise RuntimeError('load clients failed with exit status {}'.format(child.returncode))
+        stats = server.stats()
+        stats['games'] = int(output)
+    finally:
+        await server.close()
+    return stats
+
+
+async def serve(host: str, port: int, unix_path: str = None) -> None:
+    server = ColumnsServer()
+    if unix_path:
+        await server.start_unix(unix_path)
+        print('serving on {}'.format(unix_path), file=sys.stderr)
+    else:
+        await server.start_tcp(host, port)
+        print('serving on {}:{}'.format(host, port), file=sys.stderr)
+    await asyncio.Event().wait()
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description='Serve Columns games over TCP or a Unix socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=Default_Port)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--load', type=int, metavar='CLIENTS', help='measure the server against this many local clients')
+    parser.add_argument('--clients', type=int, help='run this many load clients against a running server')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds per tick of the --load clients')
+    parser.add_argument('--seconds', type=float, default=10.0, help='length of the --load run')
+    args = parser.parse_args(argv)
+
+    if args.clients is not None:
+        print(asyncio.run(run_clients(args.clients, args.interval, args.seconds, args.port, args.unix)))
+        return
+    if args.load is None:
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    stats = asyncio.run(run_load(args.load, args.interval, args.seconds, args.unix))
+    cpu_share = stats['cpu_s'] / stats['elapsed_s'] if stats['elapsed_s'] else 0
+    print(json.dumps(stats, indent=2, sort_keys=True))
+    print('{} sessions, {:.0f} ticks/s, {:.0%} of a core; about {:.0f} sessions per core at this tick rate'.format(
+        args.load, stats['ticks'] / stats['elapsed_s'], cpu_share, args.load / cpu_share if cpu_share else 0),
+        file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,208 @@
+"""
+Headless Columns games for batch simulation.
+
+Games are played against columnlogic.ColumnsState with no window and no
+real-time waits, following the same spawn/input/tick order as
+ColumnsVisual.run.  Run as a script to play many games across a process
+pool and print per-game statistics.
+"""
+import os
+import random
+import sys
+import time
+
+import columnlogic
+# Re-exported: the game settings and faller generation live in column_config
+from column_config import Rows, Columns, Jewel_Types, FallerGenerator
+
+Max_Ticks = 100000
+
+# Input actions, spelled the same way as the text-driven command flow
+LEFT = '<'
+RIGHT = '>'
+ROTATE = 'R'
+DROP = 'D'
+
+
+def apply_action(state: columnlogic.ColumnsState, action: str) -> None:
+    if action == LEFT:
+        state.shift_faller_sideways(columnlogic.LEFT)
+    elif action == RIGHT:
+        state.shift_faller_sideways(columnlogic.RIGHT)
+    elif action == ROTATE:
+        state.rotate_faller()
+    elif action == DROP:
+        state.hard_drop()
+
+
+# Policies are called once before every tick while a faller is active and
+# return the actions to apply before that tick.  They must be picklable
+# (module-level functions or instances of module-level classes) to run in
+# worker processes.
+
+def idle_policy(state: columnlogic.ColumnsState, rng: random.Random) -> list:
+    return []
+
+
+def random_policy(state: columnlogic.ColumnsState, rng: random.Random) -> list:
+    roll = rng.random()
+    if roll < 0.2:
+        return [LEFT]
+    elif roll < 0.4:
+        return [RIGHT]
+    elif roll < 0.6:
+        return [ROTATE]
+    return []
+
+
+_bot = None
+
+
+def bot_policy(state: columnlogic.ColumnsState, rng: random.Random) -> list:
+    # column_ai builds on this module, so it is imported on first use.  No
+    # time budget, so games replay the same on any machine.
+    global _bot
+    if _bot is None:
+        import column_ai
+        _bot = column_ai.ColumnsBot(depth=1, time_budget=None)
+    return _bot(state, rng)
+
+
+POLICIES = {
+    'idle': idle_policy,
+    'random': random_policy,
+    'bot': bot_policy,
+}
+
+
+def play_game(seed: int, policy=random_policy, rows: int = Rows, cols: int = Columns,
+              jewel_types: list = Jewel_Types, max_ticks: int = Max_Ticks, recorder=None, profiler=None,
+              full_scan: bool = False, cascade_cache: columnlogic.CascadeCache = None) -> dict:
+    """
+    Play one game to the end (or max_ticks) and return its statistics:
+    ticks survived, fallers spawned, matches (chains started), cascades
+    (chain links after the first), longest chain and jewels cleared.
+    A column_replay.ReplayRecorder, if given, records the game, and a
+    column_profile.Profiler is attached to the game's state, which uses
+    cascade_cache if one is given.
+    """
+    state = columnlogic.ColumnsState(rows, cols, full_scan, cascade_cache)
+    if profiler:
+        profiler.attach(state)
+    generator = FallerGenerator(seed, jewel_types)
+    # The policy gets its own stream so its choices do not shift the fallers
+    policy_rng = random.Random('policy-{}'.format(seed))
+
+    stats = {
+        'seed': seed,
+        'ticks': 0,
+        'fallers': 0,
+        'matches': 0,
+        'cascades': 0,
+        'longest_chain': 0,
+        'jewels_cleared': 0,
+    }
+    chain = 0
+
+    game_over = generator.spawn(state)
+    if state.has_faller():
+        stats['fallers'] += 1
+
+    while not game_over and stats['ticks'] < max_ticks:
+        if state.has_faller():
+            for action in policy(state, policy_rng):
+                apply_action(state, action)
+                if recorder:
+                    recorder.action(action)
+
+        game_over = state.tick()
+        stats['ticks'] += 1
+        if recorder:
+            recorder.tick(state)
+
+        # Matches are marked on one tick and cleared on the next, so every
+        # tick that marks jewels is one link of a chain
+        matched = len(state.get_changes().matches_marked)
+        if matched:
+            if chain:
+                stats['cascades'] += 1
+            else:
+                stats['matches'] += 1
+            chain += 1
+            stats['jewels_cleared'] += matched
+            stats['longest_chain'] = max(stats['longest_chain'], chain)
+        else:
+            chain = 0
+
+        if not state.has_faller() and not game_over:
+            game_over = generator.spawn(state)
+            if state.has_faller():
+                stats['fallers'] += 1
+
+    stats['game_over'] = game_over
+    return stats
+
+
+def _play_game_args(args: tuple) -> dict:
+    return play_game(*args)
+
+
+def run_batch(games: int, seed: int = 0, policy=random_policy, rows: int = Rows, cols: int = Columns,
+              jewel_types: list = Jewel_Types, max_ticks: int = Max_Ticks, workers: int = None):
+    """
+    Play `games` games with seeds seed, seed + 1, ... spread across a
+    process pool, yielding each game's statistics in seed order.
+    """
+    jobs = [(seed + game, policy, rows, cols, jewel_types, max_ticks) for game in range(games)]
+    if workers == 1:
+        yield from map(_play_game_args, jobs)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    # Large chunks keep the pickling overhead small next to the games themselves
+    chunksize = max(1, games // (workers * 16))
+    # Imported here: the pool machinery is not needed inside the workers
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_play_game_args, jobs, chunksize=chunksize)
+
+
+def main(argv: list = None) -> None:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Play headless Columns games in parallel.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--rows', type=int, default=Rows)
+    parser.add_argument('--cols', type=int, default=Columns)
+    parser.add_argument('--max-ticks', type=int, default=Max_Ticks)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--output', help='write one JSON object per game to this file')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    totals = {'ticks': 0, 'matches': 0, 'cascades': 0, 'jewels_cleared': 0}
+    games = 0
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for stats in run_batch(args.games, args.seed, POLICIES[args.policy], args.rows, args.cols,
+                               Jewel_Types, args.max_ticks, args.workers):
+            games += 1
+            for key in totals:
+                totals[key] += stats[key]
+            if output:
+                output.write(json.dumps(stats) + '\n')
+    finally:
+        if output:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    print('games: {}  elapsed: {:.2f}s  ({:.0f} games/s)'.format(games, elapsed, games / elapsed if elapsed else 0))
+    for key, total in totals.items():
+        print('{}: {}  (mean {:.2f})'.format(key, total, total / games if games else 0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,34 +1,327 @@
-import pygame
+from __future__ import annotations
+
+import argparse
 import random
 import columnlogic
-import time 
+import column_ai
+import column_config
+import column_profile
+import column_render
+import column_replay
+import column_sim
+import collections
+import numpy as np
+import queue
+import sys
+import threading
+import time
+from column_config import Rows, Columns, Tick_Interval, Jewels_Colors, Jewel_Types
+# Drawing settings, kept importable from here
+from column_render import Sprite_Min_Cell_Size, Background_Color, Grind_Color, Landing_Color, Matching_Color
+
+# pygame is imported when the first window opens (see _load_pygame), so
+# importing this module stays cheap and needs no display
+pygame = None
+
+Flash_Duration = 0.3
+# The window is redrawn at most this often; the game ticks on its own thread
+Frame_Interval = 1 / 60
+# The simulation thread applies autoplay's planned actions one at a time,
+# this far apart, whatever the frame rate
+Autoplay_Interval = 1 / 60
+# After a stall (e.g. the window being dragged) at most this many ticks are
+# caught up before the tick clock is reset to now
+Max_Catch_Up_Ticks = 5
+Hud_Color = (0, 0, 0)
+Hud_Width = 300
+Hud_Line_Height = 16
+
+# Boards that fit the window with cells at least Min_Fit_Cell_Size pixels
+# are shown whole; bigger ones open at Default_Cell_Size in a scrollable,
+# zoomable viewport
+Padding = 20
+Min_Fit_Cell_Size = 8
+Default_Cell_Size = 24
+Min_Cell_Size = 1
+Max_Cell_Size = 64
+# The board is drawn from cached tiles of about this many pixels a side
+Tile_Pixels = 256
+Max_Tiles = 64
+Scroll_Cells = 3
+
+
+# Simulation commands other than the column_sim actions
+_AUTOPLAY = 'autoplay'
+_PROFILER = 'profiler'
+_STOP = 'stop'
+
+
+def _load_pygame():
+    global pygame
+    if pygame is None:
+        import pygame
+    return pygame
+
+
+class BoardSnapshot:
+    """
+    The game as the simulation thread published it: cell codes, faller,
+    game over and flash start times, plus the cells changed since the
+    snapshot before it.  Nothing in it changes after publishing, and it
+    reads like a ColumnsState, so drawing code can take either.  When no
+    cell changed since the `previous` snapshot, its cell codes are shared
+    rather than copied.
+    """
+    __slots__ = ('serial', 'rows', 'cols', 'jewels', 'states', 'faller', 'cells_changed',
+                 'landing_flash_time', 'matching_flash_time', 'game_over')
+
+    def __init__(self, serial: int, state: columnlogic.ColumnsState, cells_changed: set,
+                 landing_flash_time: float, matching_flash_time: float, game_over: bool,
+                 previous: 'BoardSnapshot' = None):
+        self.serial = serial
+        self.rows = state.get_rows()
+        self.cols = state.get_columns()
+        if previous is not None and not cells_changed:
+            self.jewels = previous.jewels
+            self.states = previous.states
+        else:
+            jewels, states = state.get_board_codes()
+            self.jewels = bytes(jewels)
+            self.states = bytes(states)
+        self.faller = state.get_faller()
+        self.cells_changed = cells_changed
+        self.landing_flash_time = landing_flash_time
+        self.matching_flash_time = matching_flash_time
+        self.game_over = game_over
+
+    def get_rows(self) -> int:
+        return self.rows
+
+    def get_columns(self) -> int:
+        return self.cols
+
+    def get_cell_state(self, row: int, col: int) -> str:
+        return columnlogic._STATE_NAMES[self.states[row * self.cols + col]]
+
+    def get_cell_contents(self, row: int, col: int) -> str:
+        return columnlogic._JEWEL_NAMES[self.jewels[row * self.cols + col]]
+
+    def get_board_codes(self) -> tuple:
+        return self.jewels, self.states
+
+    def get_faller(self) -> tuple:
+        return self.faller
+
+    def changes_since(self, earlier: 'BoardSnapshot') -> set:
+        """Cells that differ from an earlier snapshot, compared cell by cell if snapshots were skipped."""
+        if self.serial == earlier.serial + 1:
+            return self.cells_changed
+        differ = ((np.frombuffer(self.jewels, dtype=np.uint8) != np.frombuffer(earlier.jewels, dtype=np.uint8))
+                  | (np.frombuffer(self.states, dtype=np.uint8) != np.frombuffer(earlier.states, dtype=np.uint8)))
+        return {divmod(int(index), self.cols) for index in np.flatnonzero(differ)}
+
+
+class Simulation:
+    """
+    The game logic on its own thread.  Ticks fall due at fixed steps of
+    the tick interval whatever the renderer is doing, inputs arrive on a
+    queue, and after every change a new BoardSnapshot is published by
+    swapping one reference: the renderer keeps drawing the front snapshot
+    it holds while the next is built behind it, so neither side locks.
+    `notify` is called from the simulation thread when a snapshot is
+    published and the renderer has not yet taken the one before.
+    """
+    def __init__(self, rows: int, cols: int, jewel_types: list, tick_interval: float, seed: int,
+                 autoplay: bool, notify):
+        self.state = columnlogic.ColumnsState(rows, cols)
+        self.generator = column_config.FallerGenerator(seed, jewel_types)
+        self.recorder = column_replay.ReplayRecorder(seed, rows, cols, jewel_types)
+        self.tick_interval = tick_interval
+        self.game_over = False
+
+        self.autoplay = autoplay
+        self.bot = column_ai.ColumnsBot(jewel_types=jewel_types)
+        self.autoplay_moves = []
+        self.next_autoplay_time = 0
+        self.next_tick_time = None
+        self.profiler = None
+
+        self.landing_flash_time = float('-inf')
+        self.matching_flash_time = float('-inf')
+        # Cells changed since the last snapshot, and whether anything else has
+        self.cells_changed = set()
+        self.changed = False
+
+        self.inputs = queue.Queue()
+        self.notify = notify
+        self.notified = False
+        self.error = None
+        self.serial = 0
+        self.snapshot = None
+        self.publish()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='columns-simulation', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the thread and wait for it; the state and recorder are the caller's again afterwards."""
+        if self.thread is not None:
+            self.inputs.put((_STOP,))
+            self.thread.join()
+            self.thread = None
+
+    def send(self, command: str, argument=None):
+        """Queue a column_sim action or a simulation command for the thread."""
+        self.inputs.put((command, argument))
+
+    def publish(self):
+        self.serial += 1
+        self.snapshot = BoardSnapshot(self.serial, self.state, self.cells_changed, self.landing_flash_time,
+                                      self.matching_flash_time, self.game_over, self.snapshot)
+        self.cells_changed = set()
+        self.changed = False
+        if not self.notified:
+            self.notified = True
+            self.notify()
+
+    def take_snapshot(self) -> BoardSnapshot:
+        """The latest snapshot, for the renderer; the next publish notifies again."""
+        self.notified = False
+        return self.snapshot
 
-Rows = 13
-Columns = 6
-Tick_Interval = 1.0
+    def spawn_faller(self):
+        if self.state.has_faller():
+            return
 
-Jewels_Colors = {
-    'R': (255, 0, 0),
-    'G': (0, 255, 0),
-    'O': (255, 128, 0),
-    'P': (102, 0, 204),
-    'B': (0, 0, 255),
-    'Y': (255, 255, 0),
-    'T': (51, 255, 255)
-}
+        game_over = self.generator.spawn(self.state)
+        self.note_changes()
+        if game_over:
+            self.game_over = True
+            self.changed = True
+        elif self.autoplay:
+            self.autoplay_moves = self.bot.plan(self.state)
+
+    def apply_action(self, action: str):
+        self.recorder.action(action)
+        column_sim.apply_action(self.state, action)
+        self.note_changes()
+
+    def note_changes(self):
+        self.cells_changed |= self.state.get_changes().cells_changed
+
+    def handle_input(self, command: str, argument=None):
+        if command == _PROFILER:
+            if self.profiler is not None:
+                self.profiler.detach(self.state)
+            self.profiler = argument
+            if argument is not None:
+                argument.attach(self.state)
+        elif self.game_over:
+            return
+        elif command == _AUTOPLAY:
+            self.autoplay = not self.autoplay
+            self.autoplay_moves = self.bot.plan(self.state) if self.autoplay else []
+        elif self.state.has_faller():
+            self.apply_action(command)
+
+    def tick(self, now_time: float):
+        """Run every tick that is due by now_time, in fixed steps of the tick interval."""
+        if self.game_over:
+            return
+        if now_time - self.next_tick_time >= Max_Catch_Up_Ticks * self.tick_interval:
+            self.next_tick_time = now_time
+        while not self.game_over and now_time >= self.next_tick_time:
+            if self.profiler:
+                self.profiler.record('tick_lag', now_time - self.next_tick_time)
+            self.next_tick_time += self.tick_interval
+            self.game_over = self.state.tick()
+            self.recorder.tick(self.state)
+            self.note_changes()
+
+            changes = self.state.get_changes()
+            if changes.faller_landed:
+                self.landing_flash_time = now_time
+                self.changed = True
+            if changes.matches_marked:
+                self.matching_flash_time = now_time
+                self.changed = True
+            if changes.game_over:
+                self.changed = True
+
+            if not self.state.has_faller() and not self.game_over:
+                self.spawn_faller()
+
+    def next_wakeup(self, now_time: float):
+        """Seconds until the next tick or autoplay move, or None to wait for input."""
+        if self.game_over:
+            return None
+        deadline = self.next_tick_time
+        if self.autoplay_moves:
+            deadline = min(deadline, self.next_autoplay_time)
+        return max(0.0, deadline - now_time)
 
-Background_Color = (255, 255, 255)
-Grind_Color = (0, 0, 0)
-Landing_Color = (255, 255, 0)
-Matching_Color = (255, 255, 255)
+    def run(self):
+        try:
+            self.simulate()
+        except BaseException as error:
+            # Handed to the renderer, which raises it on its own thread
+            self.error = error
+            self.notify()
+
+    def simulate(self):
+        self.spawn_faller()
+        self.next_tick_time = time.monotonic() + self.tick_interval
+        self.publish()
+
+        while True:
+            # Wait for input until the next deadline, then take all queued input
+            try:
+                command = self.inputs.get(timeout=self.next_wakeup(time.monotonic()))
+                while True:
+                    if command[0] == _STOP:
+                        return
+                    self.handle_input(*command)
+                    command = self.inputs.get_nowait()
+            except queue.Empty:
+                pass
+
+            now_time = time.monotonic()
+            if self.autoplay_moves and not self.game_over and now_time >= self.next_autoplay_time:
+                self.apply_action(self.autoplay_moves.pop(0))
+                self.next_autoplay_time = now_time + Autoplay_Interval
+            self.tick(now_time)
+
+            if self.cells_changed or self.changed:
+                self.publish()
 
-Jewel_Types = list(Jewels_Colors.keys())
 
 class ColumnsVisual:
-    def __init__(self):
-        pygame.init()
-
-        self.state = columnlogic.ColumnsState(Rows, Columns)
+    def __init__(self, autoplay: bool = False, seed: int = None, replay_path: str = None, show_hud: bool = False,
+                 rows: int = None, cols: int = None, jewel_types: list = None, tick_interval: float = None):
+        _load_pygame().init()
+
+        # Board size, jewels and tick rate default to the module settings
+        self.rows = rows or Rows
+        self.cols = cols or Columns
+        self.jewel_types = list(jewel_types or Jewel_Types)
+        self.tick_interval = tick_interval or Tick_Interval
+
+        # The game runs on the simulation thread, which wakes the window
+        # with this event when it publishes a snapshot.  Fallers come from
+        # a seeded generator so every game can be replayed from its seed
+        # and inputs; the replay is saved on exit if a path is given
+        if seed is None:
+            seed = random.randrange(2 ** 63)
+        self.snapshot_event = pygame.event.custom_type()
+        self.simulation = Simulation(self.rows, self.cols, self.jewel_types, self.tick_interval, seed, autoplay,
+                                     lambda: pygame.event.post(pygame.event.Event(self.snapshot_event)))
+        # Only touched by the simulation thread while the game runs
+        self.state = self.simulation.state
+        self.recorder = self.simulation.recorder
+        self.replay_path = replay_path
+        self.snapshot = self.simulation.take_snapshot()
         self.game_over = False
 
         self.game_width = 600
@@ -36,206 +329,414 @@ class ColumnsVisual:
         self.surface = pygame.display.set_mode((self.game_width, self.game_height), pygame.RESIZABLE)
         pygame.display.set_caption("ICS H32 Columns Game")
 
+        # Viewport: the board pixel at the top left of the view, and whether
+        # it follows the faller (F toggles it)
+        self.view_x = 0
+        self.view_y = 0
+        self.follow = True
+        self.fit = True
+        # Cells changed since the last draw, and cells drawn flashing that
+        # need redrawing when the flash ends
+        self.dirty_cells = set()
+        self.flash_cells = set()
         self.calculate_cell_size()
-        self.last_tick_time = time.time()
 
-        self.landing_flash_time = 0
-        self.matching_flash_time = 0
+        # Set whenever what is on screen may be out of date
+        self.needs_redraw = True
+        self.next_frame_time = 0
 
-    def get_jewel_color(self, char: str) -> tuple:
-        if char in Jewels_Colors:
-            return Jewels_Colors[char]
-        return (128, 128, 128)
+        # When the latest flash ends and needs one more redraw, if one is on
+        self.flash_end_time = None
 
-    def calculate_cell_size(self):
-        padding = 20
-        width = self.game_width - (2 * padding)
-        height = self.game_height - (2 * padding)
-
-        cell_width = width/Columns
-        cell_height = height/Rows
-
-        self.cell_size = min(cell_width, cell_height)
-
-        board_width = self.cell_size * Columns
-        board_height = self.cell_size * Rows
+        self.game_over_text = pygame.font.Font(None, 72).render("GAME OVER", True, (255, 0, 0))
 
-        self.board_x_component = (self.game_width - board_width) // 2
-        self.board_y_component = (self.game_height - board_height) // 2
-
-    def spawn_faller(self):
-        if self.state.has_faller():
-            return
+        # The HUD (toggled with H) shows engine and frame timings; the
+        # profiler is only attached to the state while it is shown
+        self.hud_font = pygame.font.Font(None, 20)
+        self.profiler = None
+        self.frame_times = collections.deque()
+        self.frame_start = None
+        if show_hud:
+            self.toggle_hud()
 
-        available_cols = []
-
-        for col in range(1, Columns + 1):
-            if self.state.get_cell_state(0, col - 1) != columnlogic.OCCUPIED_JEWEL:
-                available_cols.append(col)
-
-        if not available_cols:
-                self.game_over = True
+    def calculate_cell_size(self):
+        self.view_rect = pygame.Rect(Padding, Padding, max(1, self.game_width - 2 * Padding),
+                                     max(1, self.game_height - 2 * Padding))
+        if self.fit:
+            fit_size = column_render.fit_cell_size(self.rows, self.cols, self.view_rect.width, self.view_rect.height)
+            if fit_size >= Min_Fit_Cell_Size:
+                self.set_cell_size(fit_size)
                 return
+            self.fit = False
+            self.set_cell_size(Default_Cell_Size)
+        else:
+            self.set_cell_size(self.cell_size)
+
+    def set_cell_size(self, size: int):
+        self.cell_size = max(Min_Cell_Size, min(Max_Cell_Size, size))
+        self.tile_cells = max(1, Tile_Pixels // self.cell_size)
+
+        # Cell sprites and tiles depend on the cell size, so a new size
+        # starts new caches and a full redraw
+        self.renderer = column_render.BoardRenderer(self.cell_size)
+        self.tiles = collections.OrderedDict()
+        self.place_view(self.view_x, self.view_y)
+
+    def place_view(self, view_x: int, view_y: int):
+        """Scroll the view to board pixel (view_x, view_y), kept on the board; small boards are centered."""
+        board_width = self.cell_size * self.cols
+        board_height = self.cell_size * self.rows
+        self.view_x = max(0, min(view_x, board_width - self.view_rect.width))
+        self.view_y = max(0, min(view_y, board_height - self.view_rect.height))
+
+        # Screen position of the board's top left corner
+        if board_width <= self.view_rect.width:
+            self.board_x_component = (self.game_width - board_width) // 2
+        else:
+            self.board_x_component = self.view_rect.x - self.view_x
+        if board_height <= self.view_rect.height:
+            self.board_y_component = (self.game_height - board_height) // 2
+        else:
+            self.board_y_component = self.view_rect.y - self.view_y
+
+        self.full_redraw = True
+        self.game_over_drawn = False
+        self.needs_redraw = True
+
+    def zoom(self, size: int, anchor: tuple = None):
+        """Change the cell size, keeping the board point under `anchor` (screen position) in place."""
+        if anchor is None:
+            anchor = self.view_rect.center
+        board_x = (anchor[0] - self.board_x_component) / self.cell_size
+        board_y = (anchor[1] - self.board_y_component) / self.cell_size
+        self.fit = False
+        self.set_cell_size(size)
+        self.place_view(int(board_x * self.cell_size - (anchor[0] - self.view_rect.x)),
+                        int(board_y * self.cell_size - (anchor[1] - self.view_rect.y)))
+
+    def zoom_to_fit(self):
+        self.fit = True
+        self.calculate_cell_size()
 
-        col = random.choice(available_cols)
-        colors = [random.choice(Jewel_Types) for _ in range(3)]
-
-        game_over = self.state.spawn_faller(col, colors)
-        if game_over:
-            self.game_over = True
+    def scroll(self, dx: int, dy: int):
+        self.follow = False
+        self.place_view(self.view_x + dx, self.view_y + dy)
 
+    def follow_faller(self):
+        """Center the view on the faller when it has moved out of view."""
+        faller = self.snapshot.get_faller()
+        if not self.follow or faller is None:
+            return
+        row, col = max(0, faller[0]), faller[1]
+        x = self.board_x_component + col * self.cell_size
+        y = self.board_y_component + row * self.cell_size
+        if not self.view_rect.contains(pygame.Rect(x, y - 2 * self.cell_size, self.cell_size, 3 * self.cell_size)):
+            self.place_view(col * self.cell_size - self.view_rect.width // 2,
+                            row * self.cell_size - self.view_rect.height // 2)
+
+    def view_keys(self, input) -> bool:
+        """Scroll and zoom keys; returns True if `input` was one of them."""
+        if input in (pygame.K_EQUALS, pygame.K_PLUS, pygame.K_KP_PLUS):
+            self.zoom(self.cell_size * 2)
+        elif input in (pygame.K_MINUS, pygame.K_KP_MINUS):
+            self.zoom(self.cell_size // 2)
+        elif input == pygame.K_0:
+            self.zoom_to_fit()
+        elif input == pygame.K_f:
+            self.follow = not self.follow
+            self.follow_faller()
+        elif input == pygame.K_PAGEUP:
+            self.scroll(0, -self.view_rect.height)
+        elif input == pygame.K_PAGEDOWN:
+            self.scroll(0, self.view_rect.height)
+        elif input == pygame.K_HOME:
+            self.scroll(0, -self.rows * self.cell_size)
+        elif input == pygame.K_END:
+            self.scroll(0, self.rows * self.cell_size)
+        else:
+            return False
+        return True
 
     def input_keys(self, input):
+        if self.view_keys(input):
+            return
+
         if self.game_over:
             return
 
-        if not self.state.has_faller():
+        if input == pygame.K_h:
+            self.toggle_hud()
             return
 
-        if input == pygame.K_LEFT:
-            self.state.shift_faller_sideways(columnlogic.LEFT)
+        # Autoplay plans each faller with the search bot and plays the
+        # planned moves one per frame; A toggles it
+        if input == pygame.K_a:
+            self.simulation.send(_AUTOPLAY)
+        elif input == pygame.K_LEFT:
+            self.simulation.send(column_sim.LEFT)
         elif input == pygame.K_RIGHT:
-            self.state.shift_faller_sideways(columnlogic.RIGHT)
+            self.simulation.send(column_sim.RIGHT)
         elif input == pygame.K_SPACE:
-            self.state.rotate_faller()
-
-    def trigger_matching(self):
-        for row in range(Rows):
-            for col in range(Columns):
-                if self.state.get_cell_state(row,col) == columnlogic.MATCHED_JEWEL:
-                    self.matching_flash_time = time.time()
-                    return
+            self.simulation.send(column_sim.ROTATE)
+
+    def take_snapshot(self):
+        """Switch to the latest published snapshot, queueing the cells it changed for redrawing."""
+        if self.simulation.error is not None:
+            raise self.simulation.error
+        snapshot = self.simulation.take_snapshot()
+        if snapshot is self.snapshot:
+            return
+        self.dirty_cells |= snapshot.changes_since(self.snapshot)
+        flash_end_time = max(snapshot.landing_flash_time, snapshot.matching_flash_time) + Flash_Duration
+        if flash_end_time > max(self.snapshot.landing_flash_time, self.snapshot.matching_flash_time) + Flash_Duration:
+            self.flash_end_time = flash_end_time
+        self.snapshot = snapshot
+        self.game_over = snapshot.game_over
+        self.needs_redraw = True
+        self.follow_faller()
+
+    def toggle_hud(self):
+        # The simulation attaches the profiler to the state on its thread
+        if self.profiler is None:
+            self.profiler = column_profile.Profiler()
+        else:
+            self.profiler = None
+            self.frame_times.clear()
+        self.simulation.send(_PROFILER, self.profiler)
+        self.full_redraw = True
+        self.needs_redraw = True
+
+    def draw_hud(self) -> pygame.Rect:
+        now_time = time.monotonic()
+        self.frame_times.append(now_time)
+        while self.frame_times[0] < now_time - 1.0:
+            self.frame_times.popleft()
+
+        lines = ['FPS {}'.format(len(self.frame_times))]
+        lines += self.profiler.hud_lines(['frame', 'draw', 'tick', 'tick_lag'])
+        rect = pygame.Rect(4, 4, Hud_Width, len(lines) * Hud_Line_Height + 4)
+        self.surface.fill(Background_Color, rect)
+        for i, line in enumerate(lines):
+            self.surface.blit(self.hud_font.render(line, True, Hud_Color), (rect.x + 2, rect.y + 2 + i * Hud_Line_Height))
+        return rect
+
+    def cell_flash(self, cell_state: str, now_time: float) -> bool:
+        if cell_state == columnlogic.FALLER_STOPPED_CELL:
+            return (now_time - self.snapshot.landing_flash_time) < Flash_Duration
+        elif cell_state == columnlogic.MATCHED_JEWEL:
+            return (now_time - self.snapshot.matching_flash_time) < Flash_Duration
+        return False
+
+    def draw_cell(self, tile: pygame.Surface, row: int, col: int, x: int, y: int, now_time: float):
+        contents = self.snapshot.get_cell_contents(row, col)
+        cell_state = self.snapshot.get_cell_state(row, col)
+        flash = self.cell_flash(cell_state, now_time)
+        if flash:
+            self.flash_cells.add((row, col))
+        tile.blit(self.renderer.get_sprite(contents, cell_state, flash), (x, y))
+
+    def get_tile(self, tile_row: int, tile_col: int) -> pygame.Surface:
+        """The cached tile of tile_cells x tile_cells cells, rendered if it is not cached."""
+        key = (tile_row, tile_col)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        size = self.cell_size
+        top = tile_row * self.tile_cells
+        left = tile_col * self.tile_cells
+        bottom = min(self.rows, top + self.tile_cells)
+        right = min(self.cols, left + self.tile_cells)
+        tile = pygame.Surface((self.tile_cells * size, self.tile_cells * size))
+        tile.fill(Background_Color)
+
+        if size < Sprite_Min_Cell_Size:
+            # Small cells never flash, so the renderer draws them all at once
+            self.renderer.draw_cells(tile, self.snapshot, top, left, bottom, right)
+        else:
+            now_time = time.monotonic()
+            for row in range(top, bottom):
+                for col in range(left, right):
+                    self.draw_cell(tile, row, col, (col - left) * size, (row - top) * size, now_time)
+
+        self.tiles[key] = tile
+        if len(self.tiles) > Max_Tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def visible_tiles(self):
+        tile_size = self.tile_cells * self.cell_size
+        first_col = max(0, (self.view_rect.left - self.board_x_component) // tile_size)
+        last_col = min((self.cols - 1) // self.tile_cells, (self.view_rect.right - 1 - self.board_x_component) // tile_size)
+        first_row = max(0, (self.view_rect.top - self.board_y_component) // tile_size)
+        last_row = min((self.rows - 1) // self.tile_cells, (self.view_rect.bottom - 1 - self.board_y_component) // tile_size)
+        for tile_row in range(first_row, last_row + 1):
+            for tile_col in range(first_col, last_col + 1):
+                yield tile_row, tile_col
 
     def draw_board(self):
-        self.surface.fill(Background_Color)
-        now_time = time.time()
-        landing_flash = (now_time - self.landing_flash_time) < 0.3
-        matching_flash = (now_time - self.matching_flash_time) < 0.3
-
-        for row in range(Rows):
-            for col in range(Columns):
-                x = self.board_x_component + col * self.cell_size
-                y = self.board_y_component + row * self.cell_size
-
-                contents = self.state.get_cell_contents(row, col)
-                cell_state = self.state.get_cell_state(row, col)
-
-                flash = False
-                if cell_state == columnlogic.FALLER_STOPPED_CELL and landing_flash:
-                    flash = True
-                elif cell_state == columnlogic.MATCHED_JEWEL and matching_flash:
-                    flash = True
-
-                if contents != columnlogic.EMPTY:
-                    self.draw_jewel(self.surface, x, y, contents, cell_state, flash)
+        draw_start = time.perf_counter()
+        size = self.cell_size
+        tile_cells = self.tile_cells
+        now_time = time.monotonic()
+
+        # Bring cached tiles up to date with the changed cells; uncached
+        # tiles are rendered from the board when they come into view
+        dirty_rects = []
+        self.surface.set_clip(self.view_rect)
+        for row, col in self.dirty_cells:
+            tile = self.tiles.get((row // tile_cells, col // tile_cells))
+            if tile is None:
+                continue
+            x = (col % tile_cells) * size
+            y = (row % tile_cells) * size
+            self.draw_cell(tile, row, col, x, y, now_time)
+            if not self.full_redraw:
+                rect = self.surface.blit(tile, (self.board_x_component + col * size, self.board_y_component + row * size),
+                                         pygame.Rect(x, y, size, size))
+                if rect.width and rect.height:
+                    dirty_rects.append(rect)
+        self.dirty_cells.clear()
+
+        if self.full_redraw:
+            self.surface.set_clip(None)
+            self.surface.fill(Background_Color)
+            self.surface.set_clip(self.view_rect)
+            tile_size = tile_cells * size
+            for tile_row, tile_col in self.visible_tiles():
+                self.surface.blit(self.get_tile(tile_row, tile_col),
+                                  (self.board_x_component + tile_col * tile_size, self.board_y_component + tile_row * tile_size))
+            self.game_over_drawn = False
+        self.surface.set_clip(None)
+
+        if self.game_over and (dirty_rects or not self.game_over_drawn):
+            text_rect = self.game_over_text.get_rect(center=(self.game_width // 2, self.game_height // 2))
+            dirty_rects.append(self.surface.blit(self.game_over_text, text_rect))
+            self.game_over_drawn = True
+
+        if self.profiler:
+            dirty_rects.append(self.draw_hud())
+
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        elif dirty_rects:
+            pygame.display.update(dirty_rects)
+
+        if self.profiler:
+            self.profiler.record('draw', time.perf_counter() - draw_start)
+
+    def next_wakeup(self, now_time: float):
+        """Seconds until the next frame or flash end, or None to wait for input and snapshots."""
+        deadlines = []
+        if self.needs_redraw:
+            deadlines.append(self.next_frame_time)
+        if self.flash_end_time is not None:
+            deadlines.append(self.flash_end_time)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now_time)
+
+    def handle_event(self, event) -> bool:
+        """Handle one event; returns False when the game window is closed."""
+        if event.type == pygame.QUIT:
+            return False
+        elif event.type == self.snapshot_event:
+            self.take_snapshot()
+        elif event.type == pygame.VIDEORESIZE:
+            self.game_width = event.w
+            self.game_height = event.h
+            self.surface = pygame.display.set_mode((self.game_width, self.game_height), pygame.RESIZABLE)
+            self.calculate_cell_size()
+            self.needs_redraw = True
+        elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+            self.full_redraw = True
+            self.needs_redraw = True
+        elif event.type == pygame.KEYDOWN:
+            self.input_keys(event.key)
+            self.needs_redraw = True
+        elif event.type == pygame.MOUSEWHEEL:
+            # Wheel scrolls, shift+wheel scrolls sideways, ctrl+wheel zooms
+            modifiers = pygame.key.get_mods()
+            if modifiers & pygame.KMOD_CTRL:
+                self.zoom(self.cell_size * 2 if event.y > 0 else self.cell_size // 2, pygame.mouse.get_pos())
+            elif modifiers & pygame.KMOD_SHIFT:
+                self.scroll(-event.y * Scroll_Cells * self.cell_size, 0)
+            else:
+                self.scroll(-event.x * Scroll_Cells * self.cell_size, -event.y * Scroll_Cells * self.cell_size)
+        elif event.type == pygame.MOUSEMOTION and (event.buttons[1] or event.buttons[2]):
+            # Drag with the middle or right button to pan
+            self.scroll(-event.rel[0], -event.rel[1])
+        return True
 
+    def run(self):
+        running = True
+        self.simulation.start()
+
+        try:
+            while running:
+                now_time = time.monotonic()
+                if self.needs_redraw and now_time >= self.next_frame_time:
+                    self.draw_board()
+                    self.needs_redraw = False
+                    self.next_frame_time = now_time + Frame_Interval
+                    # Frame time runs from waking up to the end of the redraw
+                    if self.profiler and self.frame_start is not None:
+                        self.profiler.record('frame', time.perf_counter() - self.frame_start)
+
+                # Sleep until the next event, snapshot or deadline; with
+                # nothing scheduled (game over, no flash) this waits for input alone
+                wakeup = self.next_wakeup(time.monotonic())
+                if wakeup is None:
+                    events = [pygame.event.wait()]
+                elif wakeup > 0:
+                    events = [pygame.event.wait(max(1, int(wakeup * 1000)))]
                 else:
-                    rect = pygame.Rect(x, y, self.cell_size - 2, self.cell_size - 2)
-                    pygame.draw.rect(self.surface, Grind_Color, rect, width=1)
-
-        if self.game_over:
-            font = pygame.font.Font(None, 72)
-            text = font.render("GAME OVER", True, (255, 0, 0))
-            text_rect = text.get_rect(center=(self.game_width // 2, self.game_height // 2))
-            self.surface.blit(text, text_rect)
-
-        pygame.display.flip()
+                    events = []
+                events += pygame.event.get()
+                self.frame_start = time.perf_counter()
+
+                for event in events:
+                    if event.type != pygame.NOEVENT and not self.handle_event(event):
+                        running = False
+
+                # A flash that has ended changes how cells look
+                now_time = time.monotonic()
+                if self.flash_end_time is not None and now_time >= self.flash_end_time:
+                    self.flash_end_time = None
+                    self.dirty_cells |= self.flash_cells
+                    self.flash_cells = set()
+                    self.needs_redraw = True
+        finally:
+            self.simulation.stop()
 
-    def draw_jewel(self, surface: pygame.Surface, x: int, y: int, char: str, state: str, flash: bool = False):
-        jewel_color = self.get_jewel_color(char)
-
-        if flash:
-            if state == columnlogic.FALLER_STOPPED_CELL:
-                jewel_color = tuple(min(255, c + 100) for c in jewel_color)
-            elif state == columnlogic.MATCHED_JEWEL:
-                jewel_color = tuple(min(255, c + 150) for c in jewel_color)
-
-        rect = pygame.Rect(x, y, self.cell_size - 2, self.cell_size - 2)
-
-        if state == columnlogic.FALLER_MOVING_JEWEL:
-            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
-            pygame.draw.rect(surface, (0,0,0), rect, width=2, border_radius=5)
-        elif state == columnlogic.FALLER_STOPPED_CELL:
-            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
-            pygame.draw.rect(surface, Landing_Color, rect, width=3, border_radius=5)
-        elif state == columnlogic.MATCHED_JEWEL:
-            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
-            pygame.draw.rect(surface, Matching_Color, rect, width=3, border_radius=5)
-
-            center_x = x + self.cell_size // 2
-            center_y = y + self.cell_size // 2
-            size = self.cell_size // 4
-
-            pygame.draw.line(surface, Matching_Color, (center_x - size, center_y), (center_x + size, center_y), 2)
-            pygame.draw.line(surface, Matching_Color, (center_x, center_y - size), (center_x, center_y + size), 2)
-            pygame.draw.line(surface, Matching_Color,(int(center_x - size*0.7), int(center_y - size*0.7)),(int(center_x + size*0.7), int(center_y + size*0.7)), 2)
-            pygame.draw.line(surface, Matching_Color,(int(center_x - size*0.7), int(center_y + size*0.7)),(int(center_x + size*0.7), int(center_y - size*0.7)), 2)
-        elif state == columnlogic.OCCUPIED_JEWEL:
-            pygame.draw.rect(surface, jewel_color, rect, border_radius=5)
-        else:
-            pygame.draw.rect(surface, Grind_Color, rect, width=1)
+        pygame.quit()
+        if self.replay_path:
+            self.recorder.finish(self.simulation.game_over).save(self.replay_path)
 
-    def run(self):
-        clock = pygame.time.Clock()
-        running = True
 
-        self.spawn_faller()
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Play Columns.')
+    parser.add_argument('replay', nargs='?', help='save the game as a replay to this file on exit')
+    parser.add_argument('--config', help='JSON file with any of rows, cols, jewels, tick_interval, seed')
+    parser.add_argument('--rows', type=int)
+    parser.add_argument('--cols', type=int)
+    parser.add_argument('--jewels', help='jewel types as one letter each, e.g. RGB')
+    parser.add_argument('--tick-interval', type=float, help='seconds per tick')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--autoplay', action='store_true')
+    parser.add_argument('--hud', action='store_true')
+    args = parser.parse_args(argv)
 
-        while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.VIDEORESIZE:
-                    self.game_width = event.w
-                    self.game_height = event.h
-                    self.surface = pygame.display.set_mode((self.game_width, self.game_height), pygame.RESIZABLE)
-                    self.calculate_cell_size()
-                elif event.type == pygame.KEYDOWN:
-                    self.input_keys(event.key)
-            now_time = time.time()
-            if now_time - self.last_tick_time >= Tick_Interval:
-                if not self.game_over:
-                    had_faller = self.state.has_faller()
-
-                    was_moving = False
-                    if had_faller:
-                        for row in range(Rows):
-                            for col in range(Columns):
-                                state = self.state.get_cell_state(row, col)
-                                if state == columnlogic.FALLER_MOVING_JEWEL:
-                                    was_moving = True
-                                    break
-                            if was_moving:
-                                break
-                    self.game_over = self.state.tick()
-
-                    if had_faller and was_moving:
-                        is_stopped = False
-                        for row in range(Rows):
-                            for col in range(Columns):
-                                state = self.state.get_cell_state(row, col)
-                                if state == columnlogic.FALLER_STOPPED_CELL:
-                                    is_stopped = True
-                                    break
-                            if is_stopped:
-                                break
-                        if is_stopped:
-                            self.landing_flash_time = time.time()
-                    self.trigger_matching()
-
-                    if not self.state.has_faller() and not self.game_over:
-                        self.spawn_faller()
-                self.last_tick_time = now_time
-
-            self.draw_board()
-            clock.tick(60)
+    # Command-line options override the config file
+    config = column_config.load_config(args.config, rows=args.rows, cols=args.cols, jewels=args.jewels,
+                                       tick_interval=args.tick_interval, seed=args.seed)
 
-        pygame.quit()
-            
+    ColumnsVisual(autoplay=args.autoplay, seed=config['seed'], replay_path=args.replay, show_hud=args.hud,
+                  rows=config['rows'], cols=config['cols'], jewel_types=config['jewels'],
+                  tick_interval=config['tick_interval']).run()
 
 
 if __name__ == '__main__':
-    ColumnsVisual().run()
-
-                
-                
+    main(sys.argv[1:])
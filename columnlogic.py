@@ -1,3 +1,6 @@
+import collections
+import functools
+
 EMPTY_JEWEL = 'EMPTY STATE'
 FALLER_MOVING_JEWEL = 'FALLER_MOVING STATE'
 FALLER_STOPPED_CELL = 'FALLER_STOPPED STATE'
@@ -13,26 +16,244 @@ DOWN_RIGHT = 3
 NO_GEM = 'NONE'
 EMPTY = ' '
 
+# Cells are stored as small integer codes in flat bytearrays.  The state
+# codes are ordered so that the matchable states (OCCUPIED, MATCHED) are
+# exactly the codes >= _OCCUPIED_CODE.
+_EMPTY_CODE = 0
+_FALLER_MOVING_CODE = 1
+_FALLER_STOPPED_CODE = 2
+_OCCUPIED_CODE = 3
+_MATCHED_CODE = 4
+_STATE_NAMES = (EMPTY_JEWEL, FALLER_MOVING_JEWEL, FALLER_STOPPED_CELL, OCCUPIED_JEWEL, MATCHED_JEWEL)
+_STATE_CODES = {name: code for code, name in enumerate(_STATE_NAMES)}
+
+# Single ASCII characters are their own jewel code; any other contents
+# string is interned into the codes above 127 on first use.
+_NO_JEWEL = ord(EMPTY)
+_JEWEL_NAMES = [chr(code) for code in range(128)]
+_JEWEL_CODES = {name: code for code, name in enumerate(_JEWEL_NAMES)}
+
+# (row step, column step) of the horizontal, vertical and two diagonal lines
+_LINE_STEPS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+_MASK64 = (1 << 64) - 1
+# Zobrist keys by (index << 11 | jewel << 3 | state), filled on first use
+_ZOBRIST_KEYS = {}
+
 
 def is_matchable_state(state: str) -> bool:
     return state == OCCUPIED_JEWEL or state == MATCHED_JEWEL
 
 
+def _jewel_code(contents: str) -> int:
+    code = _JEWEL_CODES.get(contents)
+    if code is None:
+        if len(_JEWEL_NAMES) >= 256:
+            raise ValueError('too many distinct jewel types')
+        code = len(_JEWEL_NAMES)
+        _JEWEL_NAMES.append(contents)
+        _JEWEL_CODES[contents] = code
+    return code
+
+
+def _splitmix64(value: int) -> int:
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+def _zobrist_key(index: int, jewel: int, state: int) -> int:
+    """
+    The 64-bit key of one cell value.  Empty cells have key 0, so an
+    empty board hashes to 0.  Keys are derived from the cell value alone,
+    so they agree between processes.
+    """
+    if state == _EMPTY_CODE and jewel == _NO_JEWEL:
+        return 0
+    value = (index << 11) | (jewel << 3) | state
+    key = _ZOBRIST_KEYS.get(value)
+    if key is None:
+        key = _ZOBRIST_KEYS[value] = _splitmix64(value)
+    return key
+
+
+class ColumnsSnapshot:
+    """
+    An immutable copy of a ColumnsState taken by ColumnsState.snapshot().
+    Snapshots compare equal when the boards and fallers are the same and
+    hash by the board's Zobrist hash, so they can key transposition tables.
+    """
+    def __init__(self, state: 'ColumnsState'):
+        self._rows = state._rows
+        self._columns = state._columns
+        self._jewels = bytes(state._jewels)
+        self._states = bytes(state._states)
+        faller = state._faller
+        self._faller = (faller.active, faller.row, faller.column, tuple(faller.contents), faller.state)
+        self._hash = state.zobrist_hash()
+        # Derived indexes, copied so restore() does not have to rebuild them
+        self._rowMasks = {jewel: tuple(masks) for jewel, masks in state._rowMasks.items()}
+        self._dirty = frozenset(state._dirty)
+        self._unsettledColumns = frozenset(state._unsettledColumns)
+        self._matchedCells = frozenset(state._matchedCells)
+        self._fallerCells = frozenset(state._fallerCells)
+        self._occupiedRows = tuple(state._occupiedRows)
+        self._boardHash = state._hash
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ColumnsSnapshot):
+            return NotImplemented
+        return (self._hash == other._hash and self._jewels == other._jewels
+                and self._states == other._states and self._faller == other._faller)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+
+class ColumnsChanges:
+    """
+    What one tick or input call changed on a ColumnsState.  Cells are
+    (row, col) pairs; cells_changed holds the cells written during the
+    call, including the marked and cleared ones.  A cell written and then
+    put back, such as one cleared and refilled, is listed too.
+    """
+    def __init__(self, cells_changed: set, matches_marked: set, cells_cleared: set,
+                 faller_landed: bool, game_over: bool):
+        self.cells_changed = cells_changed
+        self.matches_marked = matches_marked
+        self.cells_cleared = cells_cleared
+        self.faller_landed = faller_landed
+        self.game_over = game_over
+
+
+class CascadeCache:
+    """
+    A bounded LRU memo of cascade steps, shared by any number of
+    ColumnsState objects (see ColumnsState.set_cascade_cache).  Entries are
+    keyed by the board's Zobrist hash and checked against a copy of the
+    board, and hold the cells the step wrote, so a hit replays the step
+    without clearing, gravity or match searching.  Each entry takes about
+    two bytes per board cell plus its changed cells.
+    """
+    def __init__(self, max_entries: int = 4096):
+        if max_entries < 1:
+            raise ValueError('a cascade cache needs room for at least one entry')
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: tuple, jewels: bytearray, states: bytearray) -> '_CascadeEntry':
+        entry = self._entries.get(key)
+        if entry is None or entry.jewels != jewels or entry.states != states:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _store(self, key: tuple, entry: '_CascadeEntry') -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class _CascadeEntry:
+    """One cached step: the board before it, and what it wrote, marked and cleared."""
+    __slots__ = ('jewels', 'states', 'writes', 'changed', 'marked', 'cleared', 'links')
+
+    def __init__(self, jewels: bytes, states: bytes, writes: tuple, changed: frozenset, marked: frozenset,
+                 cleared: frozenset, links: list):
+        self.jewels = jewels
+        self.states = states
+        self.writes = writes
+        self.changed = changed
+        self.marked = marked
+        self.cleared = cleared
+        self.links = links
+
+
+# Cache keys tell a single chain link (one tick) from a whole cascade
+_CASCADE_LINK = 0
+_CASCADE_ALL = 1
+
+
+def _records_changes(method):
+    """Collect the changes made by a public ColumnsState call into a ColumnsChanges."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._changedCells = set()
+        self._markedCells = set()
+        self._clearedCells = set()
+        was_moving = self._faller.active and self._faller.state == FALLER_MOVING
+        result = method(self, *args, **kwargs)
+
+        cols = self._columns
+        marked = {divmod(index, cols) for index in self._markedCells}
+        changed = {divmod(index, cols) for index in self._changedCells}
+        changed |= marked
+        cleared = {divmod(index, cols) for index in self._clearedCells}
+        landed = was_moving and self._faller.active and self._faller.state == FALLER_STOPPED
+        self._changes = ColumnsChanges(changed, marked, cleared, landed, result is True)
+        return result
+    return wrapper
+
+
 class ColumnsState:
-    def __init__(self, rows: int, cols: int):
+    def __init__(self, rows: int, cols: int, full_scan: bool = False, cascade_cache: CascadeCache = None):
         self._rows = rows
         self._columns = cols
-        self._boardRows = []
-        self._boardStates = []
+        # Cell (row, col) lives at index row * cols + col of both arrays
+        self._jewels = bytearray([_NO_JEWEL]) * (rows * cols)
+        self._states = bytearray(rows * cols)
+        # For every jewel code, one bitmask per row with bit `col` set when
+        # that cell holds the jewel in a matchable state
+        self._rowMasks = {}
+        # Cells whose matchable jewel changed since matches were last
+        # searched; only lines through these are re-checked unless
+        # full_scan is set (useful for verifying the incremental search)
+        self._dirty = set()
+        self._fullScan = full_scan
+        # Columns with a cell whose state changed since gravity last ran;
+        # every other column is already settled
+        self._unsettledColumns = set()
+        # Indexes kept up to date by _write: the matched cells, the cells
+        # drawn as the faller, and one bitmask per column with bit `row`
+        # set for every occupied cell
+        self._matchedCells = set()
+        self._fallerCells = set()
+        self._occupiedRows = [0] * cols
+        # Zobrist hash of the board cells; the faller is mixed in by zobrist_hash
+        self._hash = 0
         self._faller = _Faller()
-        for i in range(rows):
-            row = []
-            stateRow = []
-            for j in range(cols):
-                row.append(EMPTY)
-                stateRow.append(EMPTY_JEWEL)
-            self._boardRows.append(row)
-            self._boardStates.append(stateRow)
+        # Flat indices touched by the current public call; see _records_changes
+        self._changedCells = set()
+        self._markedCells = set()
+        self._clearedCells = set()
+        self._changes = ColumnsChanges(set(), set(), set(), False, False)
+        # Optional memo of cascade steps by board; see CascadeCache
+        self._cascadeCache = cascade_cache
 
     def get_rows(self) -> int:
         return self._rows
@@ -43,29 +264,180 @@ class ColumnsState:
     def get_cell_state(self, row: int, col: int) -> str:
         if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
             return EMPTY_JEWEL
-        return self._boardStates[row][col]
+        return _STATE_NAMES[self._states[row * self._columns + col]]
 
     def get_cell_contents(self, row: int, col: int) -> str:
         if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
             return EMPTY
-        return self._boardRows[row][col]
+        return _JEWEL_NAMES[self._jewels[row * self._columns + col]]
 
     def set_cell_contents(self, row: int, col: int, contents: str) -> None:
         if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
             return
-        self._boardRows[row][col] = contents
+        index = row * self._columns + col
+        self._write(index, _jewel_code(contents), self._states[index])
 
     def set_cell_state(self, row: int, col: int, state: str) -> None:
         if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
             return
-        self._boardStates[row][col] = state
+        index = row * self._columns + col
+        self._write(index, self._jewels[index], _STATE_CODES[state])
 
     def set_cell(self, row: int, col: int, contents: str, state: str) -> None:
         if row < 0 or row >= self._rows or col < 0 or col >= self._columns:
             return
-        self.set_cell_contents(row, col, contents)
-        self.set_cell_state(row, col, state)
+        self._write(row * self._columns + col, _jewel_code(contents), _STATE_CODES[state])
+
+    def _write(self, index: int, jewel: int, state: int) -> None:
+        """Store one cell by flat index, keeping the bitmasks and indexes in step."""
+        oldJewel = self._jewels[index]
+        oldState = self._states[index]
+        oldMatchable = oldState >= _OCCUPIED_CODE
+        matchable = state >= _OCCUPIED_CODE
+        self._jewels[index] = jewel
+        self._states[index] = state
+        if oldState != state or oldJewel != jewel:
+            self._hash ^= _zobrist_key(index, oldJewel, oldState) ^ _zobrist_key(index, jewel, state)
+        if oldState != state:
+            col = index % self._columns
+            self._unsettledColumns.add(col)
+            self._changedCells.add(index)
+            if oldState == _MATCHED_CODE:
+                self._matchedCells.discard(index)
+            elif oldState == _FALLER_MOVING_CODE or oldState == _FALLER_STOPPED_CODE:
+                self._fallerCells.discard(index)
+            if state == _MATCHED_CODE:
+                self._matchedCells.add(index)
+            elif state == _FALLER_MOVING_CODE or state == _FALLER_STOPPED_CODE:
+                self._fallerCells.add(index)
+            if oldState == _OCCUPIED_CODE or state == _OCCUPIED_CODE:
+                self._occupiedRows[col] ^= 1 << (index // self._columns)
+        elif oldJewel != jewel:
+            self._changedCells.add(index)
+        if (oldMatchable or matchable) and (oldJewel != jewel or oldMatchable != matchable):
+            self._dirty.add(index)
+            row, col = divmod(index, self._columns)
+            if oldMatchable:
+                self._rowMasks[oldJewel][row] &= ~(1 << col)
+            if matchable:
+                masks = self._rowMasks.get(jewel)
+                if masks is None:
+                    masks = self._rowMasks[jewel] = [0] * self._rows
+                masks[row] |= 1 << col
+
+    def _mark_bits(self, row: int, bits: int) -> None:
+        """Mark every column whose bit is set in `bits` on `row` as matched."""
+        base = row * self._columns
+        while bits:
+            low = bits & -bits
+            self._mark(base + low.bit_length() - 1)
+            bits ^= low
+
+    def _mark(self, index: int) -> None:
+        # Only matchable cells are marked, and marking keeps them matchable,
+        # so the row bitmasks are unaffected
+        if self._states[index] != _MATCHED_CODE:
+            jewel = self._jewels[index]
+            self._hash ^= _zobrist_key(index, jewel, _OCCUPIED_CODE) ^ _zobrist_key(index, jewel, _MATCHED_CODE)
+            self._states[index] = _MATCHED_CODE
+            self._markedCells.add(index)
+            self._matchedCells.add(index)
+            row, col = divmod(index, self._columns)
+            self._occupiedRows[col] &= ~(1 << row)
+
+    def zobrist_hash(self) -> int:
+        """64-bit hash of the board and faller, kept up to date on every change."""
+        faller = self._faller
+        if not faller.active:
+            return self._hash
+        key = _splitmix64((faller.row & 0xFFFF) | faller.column << 16 | faller.state << 40)
+        for contents in faller.contents:
+            key = _splitmix64(key ^ _jewel_code(contents))
+        return self._hash ^ key
+
+    def snapshot(self) -> ColumnsSnapshot:
+        return ColumnsSnapshot(self)
+
+    def restore(self, snapshot: ColumnsSnapshot) -> None:
+        """Put the board and faller back to how they were when `snapshot` was taken."""
+        if snapshot._rows != self._rows or snapshot._columns != self._columns:
+            raise ValueError('snapshot is from a board of a different size')
+        self._jewels[:] = snapshot._jewels
+        self._states[:] = snapshot._states
+        self._faller.active, self._faller.row, self._faller.column, contents, self._faller.state = snapshot._faller
+        self._faller.contents = list(contents)
+        self._rowMasks = {jewel: list(masks) for jewel, masks in snapshot._rowMasks.items()}
+        self._dirty = set(snapshot._dirty)
+        self._unsettledColumns = set(snapshot._unsettledColumns)
+        self._matchedCells = set(snapshot._matchedCells)
+        self._fallerCells = set(snapshot._fallerCells)
+        self._occupiedRows = list(snapshot._occupiedRows)
+        self._hash = snapshot._boardHash
+        # Cells written outside a recorded call (set_cell, earlier restores)
+        # are dropped here rather than kept until the next recorded call
+        self._changedCells = set()
+        self._markedCells = set()
+        self._clearedCells = set()
+
+    def get_cascade_cache(self) -> CascadeCache:
+        return self._cascadeCache
+
+    def set_cascade_cache(self, cache: CascadeCache) -> None:
+        """Memoize cascade steps in `cache` from now on, or stop with None."""
+        self._cascadeCache = cache
+
+    def _cascade(self, kind: int) -> list:
+        """
+        Clear the matched jewels, apply gravity and mark new matches, once
+        for _CASCADE_LINK or until nothing is matched for _CASCADE_ALL, and
+        return the cells cleared by each link.  With a cascade cache, a
+        board seen before gets the cached result written back instead.
+        """
+        cache = self._cascadeCache
+        if cache is None or not self._matchedCells:
+            return self._run_cascade(kind)
+
+        key = (kind, self._rows, self._columns, self._hash)
+        entry = cache._lookup(key, self._jewels, self._states)
+        if entry is not None:
+            for index, jewel, state in entry.writes:
+                self._write(index, jewel, state)
+            # As after a real step: every changed cell has been scanned and every column settled
+            self._dirty.clear()
+            self._unsettledColumns.clear()
+            self._changedCells |= entry.changed
+            self._markedCells |= entry.marked
+            self._clearedCells |= entry.cleared
+            return [set(link) for link in entry.links]
+
+        jewels = bytes(self._jewels)
+        states = bytes(self._states)
+        changed = set(self._changedCells)
+        marked = set(self._markedCells)
+        cleared = set(self._clearedCells)
+        links = self._run_cascade(kind)
+        changed = self._changedCells - changed
+        marked = self._markedCells - marked
+        writes = tuple((index, self._jewels[index], self._states[index]) for index in sorted(changed | marked))
+        cache._store(key, _CascadeEntry(jewels, states, writes, frozenset(changed), frozenset(marked),
+                                        frozenset(self._clearedCells - cleared), [frozenset(link) for link in links]))
+        return links
+
+    def _run_cascade(self, kind: int) -> list:
+        cols = self._columns
+        links = []
+        while self._matchedCells:
+            links.append({divmod(index, cols) for index in self._matchedCells})
+            self._matching()
+            if kind == _CASCADE_LINK:
+                break
+        return links
+
+    def get_changes(self) -> ColumnsChanges:
+        """The changes made by the last tick, input or board initialization."""
+        return self._changes
 
+    @_records_changes
     def initialize_board_contents(self, contents: list) -> None:
         for row in range(self.get_rows()):
             for col in range(self.get_columns()):
@@ -81,6 +453,7 @@ class ColumnsState:
         # This matches the teacher's example where matches are shown with asterisks before clearing
         self._find_and_mark_matches()
 
+    @_records_changes
     def spawn_faller(self, column: int, faller: list) -> bool:
         """
         Spawn a new faller in the specified column.
@@ -106,6 +479,32 @@ class ColumnsState:
     def has_faller(self) -> bool:
         return self._faller.active
 
+    def count_matched(self) -> int:
+        return len(self._matchedCells)
+
+    def get_column_height(self, col: int) -> int:
+        """How far the topmost occupied cell of a column is above the floor, 0 if none."""
+        occupied = self._occupiedRows[col]
+        if not occupied:
+            return 0
+        return self._rows - ((occupied & -occupied).bit_length() - 1)
+
+    def get_board_codes(self) -> tuple:
+        """
+        Read-only views of the (jewels, states) cell codes, row by row, for
+        bulk copies.  ASCII jewels are their own code; states are numbered
+        EMPTY, FALLER_MOVING, FALLER_STOPPED, OCCUPIED, MATCHED from 0.
+        """
+        return memoryview(self._jewels).toreadonly(), memoryview(self._states).toreadonly()
+
+    def get_faller(self) -> tuple:
+        """(row, col, contents, stopped) of the active faller, or None if there is none."""
+        if not self._faller.active:
+            return None
+        faller = self._faller
+        return faller.get_row(), faller.get_col(), list(faller.contents), faller.state == FALLER_STOPPED
+
+    @_records_changes
     def rotate_faller(self) -> None:
         if not self._faller.active:
             return
@@ -119,6 +518,7 @@ class ColumnsState:
 
         self.update_faller_state()
 
+    @_records_changes
     def shift_faller_sideways(self, direction: int) -> None:
         if not self._faller.active:
             return
@@ -141,223 +541,181 @@ class ColumnsState:
                 return
         
         # Clear old column before moving (update_faller_state only clears the current column)
-        old_col = self._faller.get_col()
-        for row in range(self.get_rows()):
-            if self.get_cell_state(row, old_col) == FALLER_MOVING_JEWEL or self.get_cell_state(row, old_col) == FALLER_STOPPED_CELL:
-                self.set_cell(row, old_col, EMPTY, EMPTY_JEWEL)
+        self._clear_faller_cells(self._faller.get_col())
         
         self._faller.set_col(targetColumn)
         self.update_faller_state()
 
-    def _gem_gravity(self) -> None:
-        changed = True
-        while changed:
-            changed = False
-            for col in range(self.get_columns()):
-                for row in range(self.get_rows() - 2, -1, -1):
-                    state = self.get_cell_state(row, col)
-                    if state == FALLER_MOVING_JEWEL or state == FALLER_STOPPED_CELL:
-                        continue
-                    if state == OCCUPIED_JEWEL or state == MATCHED_JEWEL:
-                        if not self._is_solid(row + 1, col):
-                            contents = self.get_cell_contents(row, col)
-                            self.set_cell(row + 1, col, contents, state)
-                            self.set_cell(row, col, EMPTY, EMPTY_JEWEL)
-                            changed = True
+    def _gem_gravity(self) -> int:
+        """
+        Compact every unsettled column in one bottom-up pass.  Settled
+        jewels keep their order and drop onto the next jewel, faller cell
+        or the floor; faller cells themselves never move.  Returns the
+        number of jewels moved.
+        """
+        jewels = self._jewels
+        states = self._states
+        cols = self._columns
+        bottom = (self._rows - 1) * cols
+        columns = self._unsettledColumns
+        self._unsettledColumns = set()
+        moves = 0
+        for col in columns:
+            target = bottom + col
+            for index in range(target, -1, -cols):
+                state = states[index]
+                if state == _FALLER_MOVING_CODE or state == _FALLER_STOPPED_CODE:
+                    target = index - cols
+                elif state >= _OCCUPIED_CODE:
+                    if index != target:
+                        self._write(target, jewels[index], state)
+                        self._write(index, _NO_JEWEL, _EMPTY_CODE)
+                        moves += 1
+                    target -= cols
+        # The moves above flagged their own columns again, which are settled now
+        self._unsettledColumns.clear()
+        return moves
 
     def _matching(self) -> bool:
         # First, remove matched jewels
-        for row in range(self.get_rows()):
-            for col in range(self.get_columns()):
-                if self.get_cell_state(row, col) == MATCHED_JEWEL:
-                    self.set_cell(row, col, EMPTY, EMPTY_JEWEL)
+        self._clear_matched()
 
         # Apply gravity
         self._gem_gravity()
 
         # Find new matches
-        found_match = False
-        self.match_x_axis()
-        self.match_y_axis()
-        self.match_diagonal()
-        
+        self._find_and_mark_matches()
+
         # Check if any matches were found
-        for row in range(self.get_rows()):
-            for col in range(self.get_columns()):
-                if self.get_cell_state(row, col) == MATCHED_JEWEL:
-                    found_match = True
-                    break
-            if found_match:
-                break
-        
-        return found_match
+        return bool(self._matchedCells)
+
+    def _clear_matched(self) -> None:
+        for index in list(self._matchedCells):
+            self._write(index, _NO_JEWEL, _EMPTY_CODE)
+            self._clearedCells.add(index)
 
     def _find_and_mark_matches(self) -> None:
         """Find and mark matches without clearing them (for display purposes)."""
-        self.match_x_axis()
-        self.match_y_axis()
-        self.match_diagonal()
+        if self._fullScan:
+            self.match_x_axis()
+            self.match_y_axis()
+            self.match_diagonal()
+            self._dirty.clear()
+        else:
+            self._mark_dirty_matches()
 
-    def match_x_axis(self) -> None:
-        for currentRow in range(self.get_rows()):
-            matches = 0
-            gem = NO_GEM
-            for col in range(self.get_columns()):
-                contents = self.get_cell_contents(currentRow, col)
-                state = self.get_cell_state(currentRow, col)
-                is_Matchable = is_matchable_state(state)
-                cell_Match = (contents == gem and is_Matchable)
-
-                if cell_Match:
-                    matches += 1
-                    if col == self.get_columns() - 1 and matches >= 3:
-                        self._mark_matched_cells(currentRow, col, LEFT, matches)
-                else:
-                    if matches >= 3:
-                        self._mark_matched_cells(currentRow, col - 1, LEFT, matches)
+    def _mark_dirty_matches(self) -> None:
+        """
+        Mark every run of three through a cell changed since the last scan.
+        Runs that do not touch a changed cell were marked by an earlier scan.
+        """
+        jewels = self._jewels
+        states = self._states
+        rows = self._rows
+        cols = self._columns
+        for index in self._dirty:
+            if states[index] < _OCCUPIED_CODE:
+                continue
+            gem = jewels[index]
+            row, col = divmod(index, cols)
+            for rowStep, colStep in _LINE_STEPS:
+                step = rowStep * cols + colStep
+                # The changed cell can be the first, second or third of a run
+                for offset in range(3):
+                    startRow = row - offset * rowStep
+                    startCol = col - offset * colStep
+                    endCol = startCol + 2 * colStep
+                    if startRow < 0 or startRow + 2 * rowStep >= rows or min(startCol, endCol) < 0 or max(startCol, endCol) >= cols:
+                        continue
+                    start = index - offset * step
+                    middle = start + step
+                    end = middle + step
+                    if (states[start] >= _OCCUPIED_CODE and jewels[start] == gem
+                            and states[middle] >= _OCCUPIED_CODE and jewels[middle] == gem
+                            and states[end] >= _OCCUPIED_CODE and jewels[end] == gem):
+                        self._mark(start)
+                        self._mark(middle)
+                        self._mark(end)
+        self._dirty.clear()
 
-                    if is_matchable_state(state):
-                        gem = contents
-                        matches = 1
-                    else:
-                        gem = NO_GEM
-                        matches = 0
+    def match_x_axis(self) -> None:
+        # A run of three starting at column c exists where bits c, c+1 and
+        # c+2 of a row mask are all set
+        for masks in self._rowMasks.values():
+            for row in range(self._rows):
+                mask = masks[row]
+                runs = mask & (mask >> 1) & (mask >> 2)
+                if runs:
+                    self._mark_bits(row, runs | (runs << 1) | (runs << 2))
 
     def match_y_axis(self) -> None:
-        for currentCol in range(self.get_columns()):
-            matches = 0
-            gem = NO_GEM
-            for row in range(self.get_rows() - 1, -1, -1):
-                contents = self.get_cell_contents(row, currentCol)
-                state = self.get_cell_state(row, currentCol)
-                is_Matchable = is_matchable_state(state)
-                cell_Match = (contents == gem and is_Matchable)
-
-                if cell_Match:
-                    matches += 1
-
-                if not cell_Match or row == 0:
-                    if row == 0 and cell_Match:
-                        if matches >= 3:
-                            self._mark_matched_cells(row, currentCol, DOWN, matches)
-                    elif matches >= 3:
-                        start_row = row + 1
-                        self._mark_matched_cells(start_row, currentCol, DOWN, matches)
-
-                    if is_matchable_state(state):
-                        gem = contents
-                        matches = 1
-                    else:
-                        gem = NO_GEM
-                        matches = 0
+        for masks in self._rowMasks.values():
+            for row in range(self._rows - 2):
+                runs = masks[row] & masks[row + 1] & masks[row + 2]
+                if runs:
+                    self._mark_bits(row, runs)
+                    self._mark_bits(row + 1, runs)
+                    self._mark_bits(row + 2, runs)
 
     def match_diagonal(self) -> None:
-        # Check diagonal from top-left to bottom-right
-        for start_row in range(self.get_rows()):
-            for start_col in range(self.get_columns()):
-                matches = 0
-                gem = NO_GEM
-                row = start_row
-                col = start_col
-                while row < self.get_rows() and col < self.get_columns():
-                    contents = self.get_cell_contents(row, col)
-                    state = self.get_cell_state(row, col)
-                    is_Matchable = is_matchable_state(state)
-                    cell_Match = (contents == gem and is_Matchable)
-
-                    if cell_Match:
-                        matches += 1
-                    else:
-                        if matches >= 3:
-                            self._mark_matched_cells(row - 1, col - 1, DOWN_RIGHT, matches)
-
-                        if is_matchable_state(state):
-                            gem = contents
-                            matches = 1
-                        else:
-                            gem = NO_GEM
-                            matches = 0
-
-                    row += 1
-                    col += 1
-
+        rows = self._rows
+        cols = self._columns
+        # Check diagonals from top-left to bottom-right, each starting on
+        # the top row or the left column
+        for col in range(cols):
+            self._match_line(col, cols + 1, min(rows, cols - col))
+        for row in range(1, rows):
+            self._match_line(row * cols, cols + 1, min(rows - row, cols))
+
+        # Check diagonals from top-right to bottom-left, each starting on
+        # the top row or the right column
+        for col in range(cols):
+            self._match_line(col, cols - 1, min(rows, col + 1))
+        for row in range(1, rows):
+            self._match_line(row * cols + cols - 1, cols - 1, min(rows - row, cols))
+
+    def _match_line(self, start: int, step: int, length: int) -> None:
+        """
+        Walk `length` cells from flat index `start` in steps of `step` once,
+        marking every run of three or more equal matchable jewels.
+        """
+        jewels = self._jewels
+        states = self._states
+        gem = -1
+        matches = 0
+        runStart = start
+        index = start
+        for _ in range(length):
+            if states[index] >= _OCCUPIED_CODE and jewels[index] == gem:
+                matches += 1
+            else:
                 if matches >= 3:
-                    self._mark_matched_cells(row - 1, col - 1, DOWN_RIGHT, matches)
-
-        # Check diagonal from top-right to bottom-left
-        for start_row in range(self.get_rows()):
-            for start_col in range(self.get_columns()):
-                matches = 0
-                gem = NO_GEM
-                row = start_row
-                col = start_col
-                while row < self.get_rows() and col >= 0:
-                    contents = self.get_cell_contents(row, col)
-                    state = self.get_cell_state(row, col)
-                    is_Matchable = is_matchable_state(state)
-                    cell_Match = (contents == gem and is_Matchable)
-
-                    if cell_Match:
-                        matches += 1
-                    else:
-                        if matches >= 3:
-                            self._mark_matched_cells(row - 1, col + 1, DOWN_LEFT, matches)
-
-                        if is_matchable_state(state):
-                            gem = contents
-                            matches = 1
-                        else:
-                            gem = NO_GEM
-                            matches = 0
-
-                    row += 1
-                    col -= 1
+                    for cell in range(runStart, index, step):
+                        self._mark(cell)
+                if states[index] >= _OCCUPIED_CODE:
+                    gem = jewels[index]
+                    matches = 1
+                else:
+                    gem = -1
+                    matches = 0
+                runStart = index
+            index += step
 
-                if matches >= 3:
-                    self._mark_matched_cells(row - 1, col + 1, DOWN_LEFT, matches)
-
-    def _mark_matched_cells(self, row: int, col: int, direction: int, amount: int) -> None:
-        if direction == LEFT:
-            for i in range(amount):
-                targetColumn = col - i
-                if targetColumn >= 0:
-                    self.set_cell_state(row, targetColumn, MATCHED_JEWEL)
-        elif direction == DOWN:
-            for i in range(amount):
-                targetRow = row + i
-                if targetRow < self.get_rows():
-                    self.set_cell_state(targetRow, col, MATCHED_JEWEL)
-        elif direction == DOWN_LEFT:
-            for i in range(amount):
-                targetRow = row + i
-                targetCol = col - i
-                if targetRow < self.get_rows() and targetCol >= 0:
-                    self.set_cell_state(targetRow, targetCol, MATCHED_JEWEL)
-        elif direction == DOWN_RIGHT:
-            for i in range(amount):
-                targetRow = row + i
-                targetCol = col + i
-                if targetRow < self.get_rows() and targetCol < self.get_columns():
-                    self.set_cell_state(targetRow, targetCol, MATCHED_JEWEL)
+        if matches >= 3:
+            for cell in range(runStart, index, step):
+                self._mark(cell)
 
     def _is_solid(self, row: int, col: int) -> bool:
         if row >= self.get_rows():
             return True
 
-        if self.get_cell_state(row, col) == OCCUPIED_JEWEL:
-            return True
-
-        return False
+        return self._states[row * self._columns + col] == _OCCUPIED_CODE
 
     def update_faller_state(self) -> None:
         if not self._faller.active:
             return
 
-        # Clear old faller positions in this column FIRST
         col = self._faller.get_col()
-        for row in range(self.get_rows()):
-            if self.get_cell_state(row, col) == FALLER_MOVING_JEWEL or self.get_cell_state(row, col) == FALLER_STOPPED_CELL:
-                self.set_cell(row, col, EMPTY, EMPTY_JEWEL)
 
         # The faller's row represents where the bottom jewel would be
         # Check if faller can move down (check the row below the bottom jewel)
@@ -368,15 +726,16 @@ class ColumnsState:
             targetRow = 1
         
         if self._is_solid(targetRow, self._faller.get_col()):
-            state = FALLER_STOPPED_CELL
+            state = _FALLER_STOPPED_CODE
             self._faller.state = FALLER_STOPPED
         else:
-            state = FALLER_MOVING_JEWEL
+            state = _FALLER_MOVING_CODE
             self._faller.state = FALLER_MOVING
 
-        # Draw faller in new positions
+        # New faller positions
         # Bottom jewel is at faller.row, middle at faller.row-1, top at faller.row-2
         # When faller.row = -1, only bottom jewel is visible at row 0
+        cells = {}
         for i in range(3):
             row = bottom_row - i  # i=0: bottom, i=1: middle, i=2: top
             # Special case: when faller is at row -1, bottom jewel appears at row 0
@@ -384,7 +743,21 @@ class ColumnsState:
                 row = 0
             jewel_content = self._faller.contents[2 - i]  # contents[2] is bottom, contents[1] is middle, contents[0] is top
             if row >= 0 and row < self.get_rows():
-                self.set_cell(row, col, jewel_content, state)
+                cells[row * self._columns + col] = _jewel_code(jewel_content)
+
+        # Clear old faller positions in this column, then draw the new ones,
+        # skipping cells that already hold the right jewel and state
+        cols = self._columns
+        for index in [index for index in self._fallerCells if index % cols == col and index not in cells]:
+            self._write(index, _NO_JEWEL, _EMPTY_CODE)
+        for index, jewel in cells.items():
+            if self._jewels[index] != jewel or self._states[index] != state:
+                self._write(index, jewel, state)
+
+    def _clear_faller_cells(self, col: int) -> None:
+        cols = self._columns
+        for index in [index for index in self._fallerCells if index % cols == col]:
+            self._write(index, _NO_JEWEL, _EMPTY_CODE)
 
     def move_faller_down(self) -> None:
         if not self._faller.active:
@@ -407,6 +780,76 @@ class ColumnsState:
             self._faller.set_row(self._faller.get_row() + 1)
         self.update_faller_state()
 
+    @_records_changes
+    def hard_drop(self) -> None:
+        """
+        Move the faller straight down to the row where it lands, exactly as
+        if move_faller_down were called until it stopped moving.
+        """
+        if not self._faller.active:
+            return
+
+        check_row = self._faller_check_row()
+        landing_row = self._faller_landing_row(check_row)
+        if landing_row >= check_row:
+            self._drop_faller(check_row, landing_row)
+
+    @_records_changes
+    def fast_forward(self, ticks: int) -> int:
+        """
+        Run up to `ticks` ticks in one step for as long as each of them would
+        only move the faller down one row: no matched jewels waiting to be
+        cleared and a moving faller with room below.  Returns the number of
+        ticks run, 0 when the next tick has more to do than that.
+        """
+        if self._matchedCells or not self._faller.active or self._faller.state != FALLER_MOVING:
+            return 0
+
+        check_row = self._faller_check_row()
+        ticks = min(ticks, self._faller_landing_row(check_row) - check_row + 1)
+        if ticks > 0:
+            self._drop_faller(check_row, check_row + ticks - 1)
+        return max(ticks, 0)
+
+    @_records_changes
+    def resolve_all(self) -> list:
+        """
+        Resolve the whole chain reaction in one call: clear the matched
+        jewels, apply gravity and mark new matches until none are left.
+        The board ends up as ticking until count_matched() is 0 would leave
+        it with no faller; an active faller is not moved.  Returns the
+        (row, col) cells cleared by each chain link, so its length is the
+        chain length.
+        """
+        return self._cascade(_CASCADE_ALL)
+
+    def _faller_check_row(self) -> int:
+        # If faller is at row -1, bottom jewel is displayed at row 0, so check row 1
+        bottom_row = self._faller.get_row()
+        if bottom_row == -1:
+            return 1
+        return bottom_row + 1
+
+    def _faller_landing_row(self, check_row: int) -> int:
+        below = self._occupiedRows[self._faller.get_col()] >> check_row
+        if below:
+            return check_row + (below & -below).bit_length() - 2
+        return self._rows - 1
+
+    def _drop_faller(self, check_row: int, target_row: int) -> None:
+        # Stepping down draws the faller over every row from check_row - 2
+        # down and erases it again, so anything left in the rows above its
+        # final three (matched jewels, frozen cells after a game over) is gone
+        col = self._faller.get_col()
+        for row in range(max(0, check_row - 2), target_row - 2):
+            index = row * self._columns + col
+            if self._states[index] != _EMPTY_CODE:
+                self._write(index, _NO_JEWEL, _EMPTY_CODE)
+
+        self._faller.set_row(target_row)
+        self.update_faller_state()
+
+    @_records_changes
     def tick(self) -> bool:
         """
         Handle one tick of game time.
@@ -415,27 +858,10 @@ class ColumnsState:
         # First, handle any existing matched jewels (clear them and find new matches)
         # This happens on every tick, even if there's no active faller
         # Clear existing matches, apply gravity, then find and mark new matches (but don't clear them yet)
-        has_matched = False
-        for row in range(self.get_rows()):
-            for col in range(self.get_columns()):
-                if self.get_cell_state(row, col) == MATCHED_JEWEL:
-                    has_matched = True
-                    break
-            if has_matched:
-                break
-        
-        if has_matched:
-            # Clear matched jewels
-            for row in range(self.get_rows()):
-                for col in range(self.get_columns()):
-                    if self.get_cell_state(row, col) == MATCHED_JEWEL:
-                        self.set_cell(row, col, EMPTY, EMPTY_JEWEL)
-            
-            # Apply gravity
-            self._gem_gravity()
-            
-            # Find and mark new matches (but don't clear them - they'll be displayed with asterisks)
-            self._find_and_mark_matches()
+        if self._matchedCells:
+            # Clear matched jewels, apply gravity, then find and mark new
+            # matches (but don't clear them - they'll be displayed with asterisks)
+            self._cascade(_CASCADE_LINK)
         
         if not self._faller.active:
             return False
@@ -461,20 +887,6 @@ class ColumnsState:
             # Find and mark matches (but don't clear them yet - they'll be cleared on next tick)
             # This allows matched jewels to be displayed with asterisks before being cleared
             self._find_and_mark_matches()
-            
-            # After matching, check if there are any jewels above row 0 in the column
-            # This would indicate that not all three jewels fit
-            for row in range(self.get_rows()):
-                if self.get_cell_state(row, faller_col) == OCCUPIED_JEWEL:
-                    # Found first occupied cell, check if there are any above it
-                    if row > 0:
-                        # Check rows above
-                        for check_row in range(row):
-                            if self.get_cell_state(check_row, faller_col) == OCCUPIED_JEWEL:
-                                # There's a jewel above - game over
-                                return True
-                    break
-            
             return False
         else:
             # Faller is moving, try to move it down
@@ -0,0 +1,291 @@
+"""
+Seeded differential tests for the Columns engine.
+
+Random games are played through a full-scan ColumnsState, which re-checks
+every line for matches and steps one row at a time, and through the
+incremental paths that must behave exactly like it: dirty-cell matching,
+hard_drop, fast_forward, resolve_all and the cascade cache.  The boards
+are compared after every call.  The same games check BatchColumnsState
+against one ColumnsState per board, and RewindableColumnsState undo and
+seek against snapshots taken as the game was played.
+
+    python -m unittest test_columnlogic
+"""
+import random
+import unittest
+
+import columnlogic
+import column_batch
+import column_history
+
+Rows = 13
+Columns = 6
+# Few jewel types, so most landings and cascades make matches
+Jewels = 'RGB'
+Seeds = range(40)
+Calls_Per_Game = 400
+
+
+def random_board(rng: random.Random, rows: int = Rows, cols: int = Columns) -> list:
+    """Rows of jewels and EMPTY, filled to a random height in each column before gravity."""
+    board = [[columnlogic.EMPTY] * cols for _ in range(rows)]
+    for col in range(cols):
+        for row in range(rng.randrange(rows // 2), rows):
+            if rng.random() < 0.8:
+                board[row][col] = rng.choice(Jewels)
+    return board
+
+
+def random_faller(rng: random.Random) -> list:
+    return [rng.choice(Jewels) for _ in range(3)]
+
+
+def board_of(state: columnlogic.ColumnsState) -> tuple:
+    """Everything observable about a state: its cell codes, faller and hash."""
+    jewels, states = state.get_board_codes()
+    return bytes(jewels), bytes(states), state.get_faller(), state.zobrist_hash()
+
+
+def changes_of(state: columnlogic.ColumnsState) -> tuple:
+    changes = state.get_changes()
+    return (changes.cells_changed, changes.matches_marked, changes.cells_cleared, changes.faller_landed,
+            changes.game_over)
+
+
+class EngineDifferentialTest(unittest.TestCase):
+    def play(self, seed: int, states: list, reference: columnlogic.ColumnsState, new_board: bool = True) -> None:
+        """
+        Play a random game on every state in `states` and, one call at a
+        time, on `reference` without the fast paths, comparing the boards
+        and the changes after each call, until the game is over.  The game
+        starts from a random board unless new_board is False.
+        """
+        rng = random.Random(seed)
+        if new_board:
+            contents = random_board(rng)
+            for state in states + [reference]:
+                state.initialize_board_contents(contents)
+            self.check(states, reference, 'initialize_board_contents', changes=True)
+
+        for call in range(Calls_Per_Game):
+            choice = rng.random()
+            if not reference.has_faller() and reference.count_matched() and choice < 0.3:
+                # resolve_all ends where ticking until nothing is matched does
+                links = [state.resolve_all() for state in states]
+                expected = []
+                while reference.count_matched():
+                    reference.tick()
+                    expected.append(reference.get_changes().cells_cleared)
+                for result in links:
+                    self.assertEqual(result, expected, 'seed {} call {} resolve_all links'.format(seed, call))
+                self.check(states, reference, 'seed {} call {} resolve_all'.format(seed, call))
+                continue
+
+            if not reference.has_faller() and not reference.count_matched():
+                faller = random_faller(rng)
+                column = rng.randint(1, Columns)
+                results = [state.spawn_faller(column, list(faller)) for state in states]
+                expected = reference.spawn_faller(column, list(faller))
+                name = 'spawn_faller'
+            elif reference.has_faller() and choice < 0.15:
+                results = [state.hard_drop() for state in states]
+                # hard_drop lands exactly where stepping down one row at a time does
+                while reference.has_faller() and not reference.get_faller()[3]:
+                    reference.move_faller_down()
+                expected = None
+                name = 'hard_drop'
+            elif choice < 0.3:
+                ticks = rng.randint(1, Rows)
+                results = [state.fast_forward(ticks) for state in states]
+                expected = results[0]
+                # fast_forward(n) returning k is k ticks that only move the faller
+                for _ in range(expected):
+                    self.assertFalse(reference.tick())
+                name = 'fast_forward'
+            elif choice < 0.45:
+                results = [state.rotate_faller() for state in states]
+                expected = reference.rotate_faller()
+                name = 'rotate_faller'
+            elif choice < 0.6:
+                direction = rng.choice((columnlogic.LEFT, columnlogic.RIGHT))
+                results = [state.shift_faller_sideways(direction) for state in states]
+                expected = reference.shift_faller_sideways(direction)
+                name = 'shift_faller_sideways'
+            else:
+                results = [state.tick() for state in states]
+                expected = reference.tick()
+                name = 'tick'
+
+            where = 'seed {} call {} {}'.format(seed, call, name)
+            for result in results:
+                self.assertEqual(result, expected, where)
+            # The reference took several calls for hard_drop and fast_forward
+            self.check(states, reference, where, changes=name not in ('hard_drop', 'fast_forward'))
+
+            if expected is True:
+                # Game over; the faller that did not fit stays on the board
+                return
+
+    def check(self, states: list, reference: columnlogic.ColumnsState, where: str, changes: bool = False) -> None:
+        for state in states:
+            self.assertEqual(board_of(state), board_of(reference), where)
+            self.assertEqual(state.count_matched(), reference.count_matched(), where)
+            if changes:
+                self.assertEqual(changes_of(state), changes_of(reference), where)
+            for col in range(Columns):
+                self.assertEqual(state.get_column_height(col), reference.get_column_height(col), where)
+
+    def test_incremental_matches_full_scan(self):
+        # Two states share a cache: the first fills it and the second, making
+        # each call right after it, replays the cascades from it.  The cache
+        # is small enough to evict, so lookups that miss are checked too.
+        cache = columnlogic.CascadeCache(max_entries=16)
+        for seed in Seeds:
+            with self.subTest(seed=seed):
+                states = [columnlogic.ColumnsState(Rows, Columns),
+                          columnlogic.ColumnsState(Rows, Columns, cascade_cache=cache),
+                          columnlogic.ColumnsState(Rows, Columns, cascade_cache=cache)]
+                self.play(seed, states, columnlogic.ColumnsState(Rows, Columns, full_scan=True))
+        self.assertGreater(cache.hits, 0)
+        self.assertGreater(cache.evictions, 0)
+
+    def test_snapshot_restore_continues_the_same_game(self):
+        for seed in Seeds:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                state = columnlogic.ColumnsState(Rows, Columns)
+                state.initialize_board_contents(random_board(rng))
+                state.spawn_faller(rng.randint(1, Columns), random_faller(rng))
+                for _ in range(rng.randrange(20)):
+                    state.tick()
+                snapshot = state.snapshot()
+                restored = columnlogic.ColumnsState(Rows, Columns)
+                restored.restore(snapshot)
+                self.assertEqual(restored.snapshot(), snapshot)
+                self.assertEqual(board_of(restored), board_of(state))
+                # Both carry on through the same game, indexes included
+                self.play(seed, [restored], state, new_board=False)
+
+
+class BatchDifferentialTest(unittest.TestCase):
+    Boards = 16
+    Ticks = 300
+
+    def test_batch_matches_columns_state(self):
+        for seed in Seeds[:10]:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                batch = column_batch.BatchColumnsState(self.Boards, Rows, Columns)
+                singles = [columnlogic.ColumnsState(Rows, Columns) for _ in range(self.Boards)]
+                contents = [random_board(rng) for _ in range(self.Boards)]
+                batch.initialize_board_contents(contents)
+                for single, board in zip(singles, contents):
+                    single.initialize_board_contents(board)
+                self.check(batch, singles, 'seed {} initialize_board_contents'.format(seed))
+                playing = [True] * self.Boards
+
+                for tick in range(self.Ticks):
+                    columns = [rng.randint(1, Columns) for _ in singles]
+                    fallers = [random_faller(rng) for _ in singles]
+                    spawn = [playing[board] and not singles[board].has_faller() and rng.random() < 0.5
+                             for board in range(self.Boards)]
+                    game_over = batch.spawn_faller(columns, fallers, mask=spawn)
+                    for board, single in enumerate(singles):
+                        expected = spawn[board] and single.spawn_faller(columns[board], list(fallers[board]))
+                        self.assertEqual(bool(game_over[board]), expected)
+
+                    rotate = [rng.random() < 0.2 for _ in singles]
+                    batch.rotate_faller(mask=rotate)
+                    directions = [rng.choice((0, 0, columnlogic.LEFT, columnlogic.RIGHT)) for _ in singles]
+                    batch.shift_faller_sideways(directions)
+                    for board, single in enumerate(singles):
+                        if rotate[board]:
+                            single.rotate_faller()
+                        if directions[board]:
+                            single.shift_faller_sideways(directions[board])
+                    self.check(batch, singles, 'seed {} tick {} input'.format(seed, tick))
+
+                    game_over = batch.tick()
+                    for board, single in enumerate(singles):
+                        over = single.tick()
+                        self.assertEqual(bool(game_over[board]), over)
+                        if over:
+                            playing[board] = False
+                    self.check(batch, singles, 'seed {} tick {}'.format(seed, tick))
+
+    def check(self, batch: column_batch.BatchColumnsState, singles: list, where: str) -> None:
+        jewels = batch.get_jewels()
+        states = batch.get_states()
+        fallers = batch.has_faller()
+        for board, single in enumerate(singles):
+            single_jewels, single_states = single.get_board_codes()
+            self.assertEqual(jewels[board].tobytes(), bytes(single_jewels), '{} board {}'.format(where, board))
+            self.assertEqual(states[board].tobytes(), bytes(single_states), '{} board {}'.format(where, board))
+            self.assertEqual(bool(fallers[board]), single.has_faller(), '{} board {}'.format(where, board))
+
+
+class RewindDifferentialTest(unittest.TestCase):
+    def test_seek_returns_every_version(self):
+        for seed in Seeds[:20]:
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                state = column_history.RewindableColumnsState(Rows, Columns)
+                snapshots = [state.snapshot()]
+                # Play through every recorded call, keeping a snapshot of each version
+                state.initialize_board_contents(random_board(rng))
+                snapshots.append(state.snapshot())
+                for _ in range(Calls_Per_Game):
+                    if not state.has_faller() and not state.count_matched():
+                        if state.spawn_faller(rng.randint(1, Columns), random_faller(rng)):
+                            snapshots.append(state.snapshot())
+                            break
+                    else:
+                        call = rng.choice(('tick', 'tick', 'tick', 'rotate_faller', 'hard_drop', 'resolve_all',
+                                           'fast_forward', 'shift_faller_sideways'))
+                        if call == 'fast_forward':
+                            state.fast_forward(rng.randint(1, Rows))
+                        elif call == 'shift_faller_sideways':
+                            state.shift_faller_sideways(rng.choice((columnlogic.LEFT, columnlogic.RIGHT)))
+                        elif getattr(state, call)() is True:
+                            snapshots.append(state.snapshot())
+                            break
+                    snapshots.append(state.snapshot())
+                self.assertEqual(state.get_version_count(), len(snapshots))
+
+                # Jump around the history; every version reads back as it was played
+                for _ in range(100):
+                    before = state.snapshot()
+                    version = rng.randrange(len(snapshots))
+                    state.seek(version)
+                    self.assertEqual(state.snapshot(), snapshots[version], 'seed {} version {}'.format(seed, version))
+                    expected = {divmod(index, Columns) for index in range(Rows * Columns)
+                                if before._jewels[index] != snapshots[version]._jewels[index]
+                                or before._states[index] != snapshots[version]._states[index]}
+                    self.assertEqual(state.get_changes().cells_changed, expected)
+
+                state.seek(len(snapshots) - 1)
+                self.assertEqual(state.undo(len(snapshots) + 5), len(snapshots) - 1)
+                self.assertEqual(state.snapshot(), snapshots[0])
+                self.assertEqual(state.redo(3), 3)
+                self.assertEqual(state.snapshot(), snapshots[3])
+
+                # Play on from a past version exactly as a fresh state restored to it would
+                version = rng.randrange(1, len(snapshots))
+                state.seek(version)
+                fresh = columnlogic.ColumnsState(Rows, Columns)
+                fresh.restore(snapshots[version])
+                column = rng.randint(1, Columns)
+                faller = random_faller(rng)
+                self.assertEqual(state.spawn_faller(column, list(faller)), fresh.spawn_faller(column, list(faller)))
+                for _ in range(50):
+                    over = state.tick()
+                    self.assertEqual(over, fresh.tick())
+                    self.assertEqual(board_of(state), board_of(fresh))
+                    if over:
+                        break
+                # The versions after the one played on from are gone
+                self.assertEqual(state.get_version_count(), state.get_version() + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()